@@ -1,54 +1,50 @@
-"""ExonCov flask app."""
-from subprocess import check_output
-from os import path
+"""ExonCov flask app.
 
-from flask import Flask, url_for
+The app is set up in two profiles. The cli profile (database, models and CLI commands) is set up on import, the web
+profile (views, admin, security and debug toolbar, see web.py) is set up by create_app() or before the first request.
+"""
+import sqlite3
+
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_wtf.csrf import CSRFProtect
-import flask_admin
-from flask_security import Security, SQLAlchemyUserDatastore
-from flask_debugtoolbar import DebugToolbarExtension
-from flask_migrate import Migrate
+from sqlalchemy.engine import Engine
 
-from ExonCov.utils import url_for_other_page, event_logger
+from ExonCov.utils import event_logger
+from ExonCov.metrics import TimedQueuePool
 
-# Setup APP
-app = Flask(__name__)
-app.config.from_object('config')
-db = SQLAlchemy(app)
-migrate = Migrate(app, db, command='db_migrate')
-csrf = CSRFProtect(app)
-admin = flask_admin.Admin(app, name='ExonCov Admin', template_mode='bootstrap3')
 
-# Debug
-toolbar = DebugToolbarExtension(app)
+def create_app(profile='web'):
+    """Return the ExonCov app set up for profile cli or web, for example gunicorn 'ExonCov:create_app()'."""
+    if profile == 'web':
+        from . import web  # Sets up the web profile on first import
+    elif profile != 'cli':
+        raise ValueError("Unknown profile {0}, use cli or web.".format(profile))
+    return app
 
-# Jinja globals
-app.jinja_env.globals['url_for_other_page'] = url_for_other_page
-git_command = ['git', '--git-dir', '{file_path}/../.git'.format(file_path=path.abspath(path.dirname(__file__)))]
-app.jinja_env.globals['git_version'] = check_output(git_command + ['describe', '--tags']).decode('ascii').strip()
-app.jinja_env.globals['git_commit'] = check_output(git_command + ['rev-parse', 'HEAD']).decode('ascii').strip()
 
-from . import views, api_views, admin_views, models, forms, cli
+class ExonCovFlask(Flask):
+    """Flask app setting up the web profile before handling requests, for example gunicorn ExonCov:app."""
+
+    def __call__(self, environ, start_response):
+        create_app('web')
+        return super().__call__(environ, start_response)
 
-# Setup CLI
-app.cli.add_command(cli.db_cli)
 
-# Setup flask_security
-user_datastore = SQLAlchemyUserDatastore(db, models.User, models.Role)
-security = Security(app, user_datastore, register_form=forms.ExtendedRegisterForm)
-security.login_manager.session_protection = 'strong'
+# Setup APP
+app = ExonCovFlask(__name__)
+app.config.from_object('config')
+db = SQLAlchemy(app, engine_options={'poolclass': TimedQueuePool})
 
+from . import models, cli
+from .benchmark import cli as benchmark_cli
+from .reference_data import changed_generations, bump_generations
 
-@security.context_processor
-def security_context_processor():
-    """Merge flask-admin's template context into the flask-security views."""
-    return dict(
-        admin_base_template=admin.base_template,
-        admin_view=admin.index_view,
-        h=flask_admin.helpers,
-        get_url=url_for
-    )
+# Setup CLI
+app.cli.add_command(cli.db_cli)
+app.cli.add_command(cli.db_migrate_cli)
+app.cli.add_command(cli.users_cli)
+app.cli.add_command(cli.roles_cli)
+app.cli.add_command(benchmark_cli.benchmark_cli)
 
 
 # DB event listeners
@@ -66,11 +62,19 @@ def after_insert(mapper, connection, target):
     event_logger(connection, models.EventLog, target.__class__.__name__, 'update', event_data)
 
 
-# Custom filters
-@app.template_filter('supress_none')
-def supress_none_filter(value):
-    """Jinja2 filter to supress none/empty values."""
-    if not value:
-        return '-'
-    else:
-        return value
+@db.event.listens_for(db.session, "after_flush")
+def bump_cache_generations(session, flush_context):
+    """Invalidate worker reference data caches when reference data changes."""
+    generations = changed_generations(session)
+    if generations:
+        bump_generations(session.connection(), generations)
+
+
+@db.event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply SQLITE_PRAGMAS to SQLite connections."""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in app.config['SQLITE_PRAGMAS'].items():
+            cursor.execute('PRAGMA {0} = {1}'.format(pragma, value))
+        cursor.close()
@@ -3,7 +3,8 @@ from flask import redirect, abort, url_for, request
 from flask_admin.contrib.sqla import ModelView
 from flask_security import current_user
 
-from . import db, admin
+from . import db
+from .web import admin
 from ExonCov import models
 
 
@@ -123,6 +124,14 @@ class TranscriptAdminView(CustomModelView):
     }
 
 
+class DesignAdminView(CustomModelView):
+    """Design admin view, exons and transcripts are loaded with the load_design command."""
+    column_list = ['name', 'active', 'created_date', 'exon_bed_file']
+    column_sortable_list = ['name', 'created_date']
+
+    form_columns = ['name', 'active', 'exon_bed_file', 'comments']
+
+
 class ExonAdminView(CustomModelView):
     """Exon admin view."""
     column_list = ['chr', 'start', 'end']
@@ -134,13 +143,13 @@ class ExonAdminView(CustomModelView):
 
 class SampleAdminView(CustomModelView):
     """Sample admin view."""
-    column_list = ['name', 'type', 'project', 'sequencing_runs', 'import_date']
+    column_list = ['name', 'type', 'project', 'design', 'sequencing_runs', 'import_date']
     column_sortable_list = ['name', 'import_date']
     column_searchable_list = ['name']
 
     form_columns = [
-        'name', 'type', 'project', 'sequencing_runs', 'import_date', 'file_name', 'import_command',
-        'exon_measurement_file'
+        'name', 'type', 'project', 'design', 'sequencing_runs', 'import_date', 'file_name', 'import_command',
+        'exon_measurement_file', 'gap_file'
     ]
     form_ajax_refs = {
         'project': {
@@ -217,6 +226,7 @@ admin.add_view(SequencingRunAdminView(models.SequencingRun, db.session))
 admin.add_view(GeneAdminView(models.Gene, db.session))
 admin.add_view(TranscriptAdminView(models.Transcript, db.session))
 admin.add_view(ExonAdminView(models.Exon, db.session))
+admin.add_view(DesignAdminView(models.Design, db.session))
 
 admin.add_view(UserAdminView(models.User, db.session))
 admin.add_view(CustomModelView(models.Role, db.session))
@@ -1,12 +1,15 @@
 """
 ExonCov API routes.
-Currently only used to implement api calls for select2 forms (ajax).
+Used to implement api calls for select2 forms (ajax) and cohort queries.
 """
+import datetime
+
 from flask import request, jsonify
 from flask_security import login_required
 
-from . import app
+from . import app, low_coverage, region_query
 from .models import Sample
+from .reference_data import reference_data
 
 
 @app.route('/api/sample')
@@ -24,3 +27,99 @@ def api_samples():
 
     result = {'results': [{'id': sample.id, 'text': str(sample)} for sample in samples]}
     return jsonify(result)
+
+
+@app.route('/api/low_coverage')
+@login_required
+def api_low_coverage():
+    """Samples with less than 100% coverage at threshold for exons, transcripts, genes or panels."""
+    threshold = request.args.get('threshold', default=15, type=int)
+    if threshold not in low_coverage.THRESHOLDS:
+        return jsonify({'errors': ['Unknown threshold: {0}.'.format(threshold)]}), 400
+
+    try:
+        min_date, max_date = [
+            datetime.date.fromisoformat(request.args[arg]) if request.args.get(arg) else None
+            for arg in ['min_date', 'max_date']
+        ]
+    except ValueError:
+        return jsonify({'errors': ['Invalid date, use YYYY-MM-DD.']}), 400
+
+    exon_ids, transcript_ids, errors = low_coverage.resolve_targets(
+        exons=request.args.getlist('exon'),
+        transcripts=request.args.getlist('transcript'),
+        genes=request.args.getlist('gene'),
+        panels=request.args.getlist('panel')
+    )
+    if not errors and not exon_ids and not transcript_ids:
+        errors.append('Provide at least one exon, transcript, gene or panel.')
+    if errors:
+        return jsonify({'errors': errors}), 400
+
+    transcripts = reference_data.design().transcripts
+    samples = [
+        {
+            'id': sample_id,
+            'name': sample_name,
+            'project': project_name,
+            'import_date': import_date.isoformat(),
+            'exons': low_exon_ids,
+            'transcripts': [transcripts[transcript_id].name for transcript_id in low_transcript_ids],
+        }
+        for sample_id, sample_name, project_name, import_date, low_exon_ids, low_transcript_ids in (
+            low_coverage.query_low_coverage(
+                threshold, exon_ids, transcript_ids, request.args.get('project'), min_date, max_date
+            )
+        )
+    ]
+    return jsonify({'threshold': threshold, 'samples': samples})
+
+
+@app.route('/api/region_coverage', methods=['GET', 'POST'])
+@login_required
+def api_region_coverage():
+    """Exon measurements for regions (chr:start-end or bed lines) in samples and/or sample sets."""
+    args = request.values
+    regions, errors = region_query.parse_regions('\n'.join(args.getlist('region')))
+    if not errors and not regions:
+        errors.append('Provide at least one region.')
+
+    sample_ids = set(args.getlist('sample', type=int))
+    sample_sets = reference_data.sample_sets().sample_sets
+    for sample_set_id in args.getlist('sample_set', type=int):
+        if sample_set_id in sample_sets:
+            sample_ids.update(sample_sets[sample_set_id].sample_ids)
+        else:
+            errors.append('Unknown sample set: {0}.'.format(sample_set_id))
+
+    measurement_types = args.getlist('measurement_type') or region_query.MEASUREMENT_TYPES
+    for measurement_type in measurement_types:
+        if measurement_type not in region_query.MEASUREMENT_TYPES:
+            errors.append('Unknown measurement type: {0}.'.format(measurement_type))
+
+    samples = Sample.query.filter(Sample.id.in_(sample_ids)).order_by(Sample.name).all()
+    if not errors and not samples:
+        errors.append('Provide at least one sample or sample set.')
+    if errors:
+        return jsonify({'errors': errors}), 400
+
+    region_exons, sample_measurements = region_query.query_regions(regions, samples, measurement_types)
+    return jsonify({
+        'samples': [{'id': sample.id, 'name': sample.name} for sample in samples],
+        'missing_samples': [sample.id for sample in samples if sample_measurements[sample.id] is None],
+        'regions': [
+            {
+                'region': '{0}:{1}-{2}'.format(*region),
+                'exons': [
+                    {
+                        'id': exon_id,
+                        'samples': {
+                            sample.id: (sample_measurements[sample.id] or {}).get(exon_id) for sample in samples
+                        }
+                    }
+                    for exon_id in region_exons[region]
+                ]
+            }
+            for region in regions
+        ]
+    })
@@ -0,0 +1,153 @@
+"""Panel BED export.
+
+Exons and genes for all requested panel versions are fetched with one joined query and grouped per panel version,
+limited to the exons of one design (default the newest active design).
+Output is sorted on chromosome (natural order), start and end and can be merged to non overlapping intervals.
+Validated panel versions are immutable, their BED files are cached per design and design generation (changed by
+load_design and gene or transcript edits) in PANEL_BED_CACHE_PATH.
+"""
+import os
+import re
+import tempfile
+
+from . import app, db, metrics
+from .models import Design, Exon, Transcript, designs_exons, exons_transcripts, panels_transcripts
+from .reference_data import get_generations
+
+FLANK = 20
+
+
+def chromosome_sort_key(chr):
+    """Natural chromosome order: 1-22, X, Y, MT, other."""
+    if chr.isdigit():
+        return (0, int(chr), '')
+    return (1, {'X': 0, 'Y': 1, 'MT': 2, 'M': 2}.get(chr, 3), chr)
+
+
+def default_design_id():
+    """Return id of the newest active design (used for new imports), None if no design is active."""
+    design = db.session.query(Design.id).filter_by(active=True).order_by(Design.id.desc()).first()
+    if design:
+        return design.id
+
+
+def panel_exons(panel_version_ids, design_id):
+    """Return {panel_version_id: {(chr, start, end): gene_ids}} for design exons using one query."""
+    query = (
+        db.session.query(panels_transcripts.c.panel_id, Exon.chr, Exon.start, Exon.end, Transcript.gene_id)
+        .join(Transcript, Transcript.id == panels_transcripts.c.transcript_id)
+        .join(exons_transcripts, exons_transcripts.c.transcript_id == Transcript.id)
+        .join(Exon, Exon.id == exons_transcripts.c.exon_id)
+        .join(designs_exons, designs_exons.c.exon_id == Exon.id)
+        .filter(designs_exons.c.design_id == design_id)
+        .filter(panels_transcripts.c.panel_id.in_(panel_version_ids))
+    )
+    panels = {panel_version_id: {} for panel_version_id in panel_version_ids}
+    for panel_version_id, chr, start, end, gene_id in query:
+        panels[panel_version_id].setdefault((chr, start, end), set()).add(gene_id)
+    return panels
+
+
+def bed_rows(exons, remove_flank=False, merge=False):
+    """Return sorted (chr, start, end, genes) rows for {(chr, start, end): gene_ids}.
+
+    Unmerged rows use the first gene id (sorted) of an exon, merged rows list all gene ids comma separated.
+    """
+    rows = []
+    for (chr, start, end), gene_ids in sorted(
+        exons.items(), key=lambda exon: (chromosome_sort_key(exon[0][0]), exon[0][1], exon[0][2])
+    ):
+        if remove_flank:
+            start += FLANK
+            end -= FLANK
+
+        if merge and rows and rows[-1][0] == chr and start <= rows[-1][2]:
+            rows[-1][2] = max(rows[-1][2], end)
+            rows[-1][3].update(gene_ids)
+        elif merge:
+            rows.append([chr, start, end, set(gene_ids)])
+        else:
+            rows.append([chr, start, end, {min(gene_ids)}])
+    return [(chr, start, end, ','.join(sorted(gene_ids))) for chr, start, end, gene_ids in rows]
+
+
+def format_bed(rows):
+    """Return BED text for rows."""
+    return ''.join('{0}\t{1}\t{2}\t{3}\n'.format(*row) for row in rows)
+
+
+def cache_file(panel_version, design_id, generation, remove_flank=False, merge=False):
+    """Return cache file path for a validated panel version, design and design generation."""
+    return os.path.join(app.config['PANEL_BED_CACHE_PATH'], cache_file_name(
+        panel_version.name_version, design_id, generation, remove_flank, merge
+    ))
+
+
+def cache_file_name(panel_name_version, design_id, generation, remove_flank=False, merge=False):
+    return '{panel}_design{design_id}_generation{generation}{flank}{merge}.bed'.format(
+        panel=panel_name_version,
+        design_id=design_id,
+        generation=generation,
+        flank='_noflank' if remove_flank else '',
+        merge='_merged' if merge else ''
+    )
+
+
+def remove_stale_cache_files(panel_version, design_id, generation, remove_flank=False, merge=False):
+    """Remove cache files of a panel version and design for other design generations."""
+    stale_name = re.compile(re.escape(
+        cache_file_name(panel_version.name_version, design_id, 'GENERATION', remove_flank, merge)
+    ).replace('GENERATION', r'\d+') + '$')
+    current_name = cache_file_name(panel_version.name_version, design_id, generation, remove_flank, merge)
+    for file_name in os.listdir(app.config['PANEL_BED_CACHE_PATH']):
+        if file_name != current_name and stale_name.match(file_name):
+            try:
+                os.remove(os.path.join(app.config['PANEL_BED_CACHE_PATH'], file_name))
+            except FileNotFoundError:  # Removed by another worker
+                pass
+
+
+def write_atomic(path, text):
+    """Write text to path using a temporary file and rename, readers never see partial files."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(file_descriptor, 'w') as temp_file:
+        temp_file.write(text)
+    os.replace(temp_path, path)
+
+
+def panel_beds(panel_versions, design_id, remove_flank=False, merge=False):
+    """Return {panel_version_id: BED text} for design exons, validated panel versions are read from and written to
+    the cache.
+    """
+    generation = get_generations().get('design', 0)
+    beds = {}
+    missing = []
+    for panel_version in panel_versions:
+        path = cache_file(panel_version, design_id, generation, remove_flank, merge)
+        if panel_version.validated:
+            metrics.cache_lookup('panel_bed', os.path.exists(path))
+        if panel_version.validated and os.path.exists(path):
+            with open(path) as bed_file:
+                beds[panel_version.id] = bed_file.read()
+        else:
+            missing.append(panel_version)
+
+    if missing:
+        exons = panel_exons([panel_version.id for panel_version in missing], design_id)
+        for panel_version in missing:
+            beds[panel_version.id] = format_bed(bed_rows(exons[panel_version.id], remove_flank, merge))
+            if panel_version.validated:
+                write_atomic(cache_file(panel_version, design_id, generation, remove_flank, merge), beds[panel_version.id])
+                remove_stale_cache_files(panel_version, design_id, generation, remove_flank, merge)
+    return beds
+
+
+def combined_bed(panel_versions, design_id, remove_flank=False, merge=False):
+    """Return BED text for the union of design exons in panel versions."""
+    exons = {}
+    for panel_exon in panel_exons([panel_version.id for panel_version in panel_versions], design_id).values():
+        for exon, gene_ids in panel_exon.items():
+            exons.setdefault(exon, set()).update(gene_ids)
+    return format_bed(bed_rows(exons, remove_flank, merge))
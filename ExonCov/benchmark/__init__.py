@@ -0,0 +1 @@
+"""ExonCov synthetic data generator and benchmark suite."""
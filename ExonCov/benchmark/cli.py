@@ -0,0 +1,101 @@
+"""Benchmark CLI functions, benchmark modules are imported on use to keep CLI startup fast."""
+import json
+import sys
+
+import click
+from flask.cli import AppGroup
+
+from .. import app
+from ..models import Sample
+
+benchmark_cli = AppGroup('benchmark', help="Synthetic data and benchmark commands, use a separate database.")
+
+
+@benchmark_cli.command('generate')
+@click.argument('data_dir', type=click.Path(file_okay=False))
+@click.option('-n', '--samples', type=int, default=10, help="Number of samples.")
+@click.option('-g', '--genes', type=int, default=200, help="Number of genes.")
+@click.option('-t', '--transcripts_per_gene', type=int, default=2)
+@click.option('-e', '--exons_per_transcript', type=int, default=8)
+@click.option('-p', '--panels', type=int, default=10, help="Number of gene panels.")
+@click.option('--genes_per_panel', type=int, default=50)
+@click.option('-s', '--scale', 'scales', type=int, multiple=True, help="Benchmark scale (samples), default all samples.")
+@click.option('--seed', type=int, default=1, help="Random seed.")
+def generate(data_dir, samples, genes, transcripts_per_gene, exons_per_transcript, panels, genes_per_panel, scales, seed):
+    """Populate an empty database with synthetic data, exon measurement files are written to DATA_DIR."""
+    from . import synthetic
+    if Sample.query.first():
+        sys.exit("ERROR: Database {0} contains samples, use an empty database.".format(app.config['SQLALCHEMY_DATABASE_URI']))
+
+    synthetic.generate(
+        data_dir, samples=samples, genes=genes, transcripts_per_gene=transcripts_per_gene,
+        exons_per_transcript=exons_per_transcript, panels=panels, genes_per_panel=genes_per_panel,
+        scales=scales or [samples], seed=seed
+    )
+
+
+@benchmark_cli.command('run')
+@click.option('-s', '--scale', 'scales', type=int, multiple=True, required=True, help="Benchmark scale (samples).")
+@click.option('-r', '--repeats', type=int, default=3)
+@click.option('-c', '--case', 'cases', multiple=True, help="Only run case, for example sample_set.")
+@click.option('-o', '--output', type=click.File('w'), help="Write results to json file.")
+def run(scales, repeats, cases, output):
+    """Time hot views and CLI commands on synthetic data."""
+    from . import suite
+    try:
+        results = suite.run(scales, repeats=repeats, cases=cases, log=lambda message: print(message, file=sys.stderr))
+    except LookupError as error:
+        sys.exit("ERROR: {0}".format(error))
+
+    if output:
+        json.dump(results, output, indent=2)
+
+
+@benchmark_cli.command('import')
+@click.argument('data_dir', type=click.Path(file_okay=False))
+@click.option('-g', '--design_genes', type=int, multiple=True, default=[100, 1000], help="Design size (genes).")
+@click.option('-c', '--concurrency', type=int, multiple=True, default=[1, 4], help="Number of parallel imports.")
+@click.option('-n', '--samples', type=int, default=8, help="Number of samples per design size and concurrency.")
+@click.option('-o', '--output', type=click.File('w'), help="Write results to json file.")
+def benchmark_import(data_dir, design_genes, concurrency, samples, output):
+    """Time import_bam stages on synthetic bam files using a sambamba stub, files are written to DATA_DIR."""
+    from . import imports, suite
+    results = imports.run(
+        data_dir, design_genes, concurrency, samples, log=lambda message: print(message, file=sys.stderr)
+    )
+    if output:
+        json.dump(dict(suite.run_metadata(), imports=results), output, indent=2)
+
+
+@benchmark_cli.command('compare')
+@click.argument('baseline', type=click.File('r'))
+@click.argument('current', type=click.File('r'))
+def compare(baseline, current):
+    """Compare two benchmark result files."""
+    from . import suite
+    baseline = json.load(baseline)
+    current = json.load(current)
+    print("Baseline: {version} {commit} {date}".format(**baseline))
+    print("Current: {version} {commit} {date}".format(**current))
+    results = list(suite.compare(baseline, current))
+    if results:
+        print("Case\tScale\tBaseline (s)\tCurrent (s)\tRatio\tBaseline queries\tCurrent queries\tBaseline MB\tCurrent MB")
+    for (name, scale), baseline_result, current_result in results:
+        if 'error' in baseline_result or 'error' in current_result:
+            print("{0}\t{1}\terror".format(name, scale))
+            continue
+        print("{0}\t{1}\t{2:.4f}\t{3:.4f}\t{4:.2f}\t{5}\t{6}\t{7:.1f}\t{8:.1f}".format(
+            name, scale,
+            baseline_result['median'], current_result['median'], current_result['median'] / baseline_result['median'],
+            baseline_result['queries'], current_result['queries'],
+            baseline_result['peak_memory'] / 1024 / 1024, current_result['peak_memory'] / 1024 / 1024
+        ))
+
+    import_results = list(suite.compare(baseline, current, 'imports', ('design_genes', 'concurrency')))
+    if import_results:
+        print("Design genes\tConcurrency\tBaseline samples/hour\tCurrent samples/hour\tBaseline db rows/s\tCurrent db rows/s")
+    for (genes, concurrency), baseline_result, current_result in import_results:
+        print("{0}\t{1}\t{2:.0f}\t{3:.0f}\t{4:.0f}\t{5:.0f}".format(
+            genes, concurrency, baseline_result['samples_per_hour'], current_result['samples_per_hour'],
+            baseline_result['db_rows_per_second'], current_result['db_rows_per_second']
+        ))
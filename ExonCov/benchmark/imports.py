@@ -0,0 +1,176 @@
+"""Import throughput benchmark.
+
+Synthetic bam files (header with read groups and a few reads per exon) are imported with import_bam, using the
+deterministic sambamba stub instead of sambamba. Imports are timed per stage for several design sizes and
+concurrency levels (imports running in parallel threads, each with its own app context and database session).
+"""
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import pysam
+
+from .. import app, db
+from .. import cli
+from ..design_loader import DesignFiles, load_design
+from ..models import Design, LowCoverageIndex, Sample, SampleProject, TranscriptMeasurement
+from . import synthetic
+
+PROJECT_NAME = 'BENCHMARK_IMPORT'
+READ_LENGTH = 100
+SAMBAMBA_STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sambamba_stub.py')
+
+
+def design_name(genes):
+    """Return import benchmark design name for number of genes."""
+    return 'import_{0}'.format(genes)
+
+
+def load_import_design(data_dir, genes, seed=1):
+    """Load synthetic import design with number of genes, returns design exons {exon_id: (chr, start, end)}."""
+    paths = synthetic.write_design_files(
+        os.path.join(data_dir, 'designs', str(genes)), genes, transcripts_per_gene=2, exons_per_transcript=8, panels=0,
+        genes_per_panel=0, rng=random.Random(seed), prefix='IMP'
+    )
+    design_files = DesignFiles()
+    design_files.parse_exon_file(paths['exons'])
+    design_files.parse_gene_transcript_file(paths['gene_transcripts'])
+    design_files.parse_preferred_transcripts_file(paths['preferred_transcripts'])
+    if not Design.query.filter_by(name=design_name(genes)).first():
+        load_design(design_files, design_name(genes), synthetic.benchmark_user_id(), log=lambda message: None)
+        db.session.commit()
+    return design_files.exons
+
+
+def write_bam(bam_file, sample_name, platform_units, exons):
+    """Write sorted and indexed bam file with one read group per platform unit and reads at exon starts."""
+    chromosomes = sorted(set(chr for chr, start, end in exons.values()), key=synthetic.CHROMOSOMES.index)
+    lengths = {chr: max(end for exon_chr, start, end in exons.values() if exon_chr == chr) + 10000 for chr in chromosomes}
+    header = {
+        'HD': {'VN': '1.6', 'SO': 'coordinate'},
+        'SQ': [{'SN': chr, 'LN': lengths[chr]} for chr in chromosomes],
+        'RG': [
+            {'ID': 'RG{0}'.format(index), 'SM': sample_name, 'PU': platform_unit, 'PL': 'ILLUMINA'}
+            for index, platform_unit in enumerate(platform_units)
+        ]
+    }
+    with pysam.AlignmentFile(bam_file, 'wb', header=header) as bam:
+        for reference_id, chr in enumerate(chromosomes):
+            starts = sorted(start for exon_chr, start, end in exons.values() if exon_chr == chr)
+            for index, start in enumerate(starts):
+                read = pysam.AlignedSegment(bam.header)
+                read.query_name = '{0}_{1}_{2}'.format(sample_name, chr, start)
+                read.reference_id = reference_id
+                read.reference_start = start
+                read.mapping_quality = 60
+                read.cigarstring = '{0}M'.format(READ_LENGTH)
+                read.query_sequence = 'A' * READ_LENGTH
+                read.query_qualities = pysam.qualitystring_to_array('I' * READ_LENGTH)
+                read.set_tag('RG', 'RG{0}'.format(index % len(platform_units)))
+                bam.write(read)
+    pysam.index(bam_file)
+
+
+def import_sample(bam_file, design):
+    """Import bam file in a new app context, returns (stages, error)."""
+    with app.app_context():
+        try:
+            with click.Context(cli.import_bam) as context:
+                context.invoke(
+                    cli.import_bam, project_name=PROJECT_NAME, sample_type='WES', bam=bam_file, design_name=design,
+                    overwrite=True
+                )
+        except SystemExit as error:
+            return cli.import_timer.stages, str(error)
+        except Exception as error:
+            return cli.import_timer.stages, repr(error)
+        finally:
+            db.session.remove()
+    return cli.import_timer.stages, None
+
+
+def count_rows(sample_names):
+    """Return number of sample, transcript measurement and low coverage index rows for imported samples."""
+    sample_ids = [
+        sample_id for sample_id, in (
+            db.session.query(Sample.id)
+            .join(SampleProject)
+            .filter(SampleProject.name == PROJECT_NAME)
+            .filter(Sample.name.in_(sample_names))
+        )
+    ]
+    return (
+        len(sample_ids) +
+        TranscriptMeasurement.query.filter(TranscriptMeasurement.sample_id.in_(sample_ids)).count() +
+        LowCoverageIndex.query.filter(LowCoverageIndex.sample_id.in_(sample_ids)).count()
+    )
+
+
+def run(data_dir, design_sizes, concurrency_levels, samples, seed=1, log=print):
+    """Run import benchmark, returns list of result dicts."""
+    config = {key: app.config[key] for key in ['SAMBAMBA', 'EXON_MEASUREMENTS_RSYNC_PATH']}
+    app.config['SAMBAMBA'] = '{0} {1}'.format(sys.executable, SAMBAMBA_STUB)
+    app.config['EXON_MEASUREMENTS_RSYNC_PATH'] = os.path.abspath(os.path.join(data_dir, 'measurements'))
+    os.makedirs(app.config['EXON_MEASUREMENTS_RSYNC_PATH'], exist_ok=True)
+    bam_dir = os.path.join(data_dir, 'bams')
+    os.makedirs(bam_dir, exist_ok=True)
+
+    results = []
+    try:
+        for genes in design_sizes:
+            exons = load_import_design(data_dir, genes, seed)
+            for concurrency in concurrency_levels:
+                sample_names = []
+                bam_files = []
+                for index in range(samples):
+                    sample_name = 'IMP{0}_{1}_{2}'.format(genes, concurrency, index)
+                    bam_file = os.path.join(bam_dir, '{0}.bam'.format(sample_name))
+                    write_bam(bam_file, sample_name, ['IMPRUN{0}'.format(index % 2)], exons)
+                    sample_names.append(sample_name)
+                    bam_files.append(bam_file)
+
+                start_time = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    imports = list(executor.map(import_sample, bam_files, [design_name(genes)] * samples))
+                seconds = time.perf_counter() - start_time
+                rows = count_rows(sample_names)
+
+                stages = {}
+                for import_stages, error in imports:
+                    for stage, stage_seconds in import_stages:
+                        stages.setdefault(stage, []).append(stage_seconds)
+                errors = [error for import_stages, error in imports if error]
+                imported = samples - len(errors)
+                insert_seconds = sum(stages.get('insert', []))
+
+                result = {
+                    'design_genes': genes,
+                    'design_exons': len(exons),
+                    'concurrency': concurrency,
+                    'samples': samples,
+                    'imported': imported,
+                    'errors': errors,
+                    'seconds': seconds,
+                    'samples_per_hour': imported / seconds * 3600,
+                    'rows': rows,
+                    'rows_per_second': rows / seconds,
+                    'db_rows_per_second': rows / insert_seconds if insert_seconds else 0,
+                    'stages': {
+                        stage: {'median': statistics.median(stage_seconds), 'total': sum(stage_seconds)}
+                        for stage, stage_seconds in stages.items()
+                    },
+                }
+                results.append(result)
+                log("{0} genes\t{1} threads\t{2}/{3} samples\t{4:.1f}s\t{5:.0f} samples/hour\t{6:.0f} db rows/s".format(
+                    genes, concurrency, imported, samples, seconds, result['samples_per_hour'],
+                    result['db_rows_per_second']
+                ))
+                for error in sorted(set(errors)):
+                    log("ERROR: {0}".format(error))
+    finally:
+        app.config.update(config)
+    return results
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""Deterministic sambamba stub for import benchmarks.
+
+Emits 'sambamba depth region' output for every region in the --regions bed file, coverage values are drawn from a
+generator seeded on the bam file name and region. 'sambamba depth base' emits per base coverage around the region mean
+coverage, bases of overlapping regions once. Use as SAMBAMBA = '<python> <path to this file>'.
+This file does not import ExonCov, it is executed as a separate process by import_bam.
+"""
+import argparse
+import math
+import random
+import zlib
+
+import pysam
+
+
+def mean_coverage(rng):
+    """Random mean coverage, 5% of exons have low coverage."""
+    if rng.random() < 0.05:
+        return rng.uniform(0, 30)
+    return max(rng.gauss(120, 40), 1)
+
+
+def percentage(mean_coverage, threshold):
+    """Percentage of bases covered at threshold for mean coverage."""
+    percentage = 100 / (1 + math.exp((threshold - mean_coverage) / (0.2 * mean_coverage + 1)))
+    return round(min(100.0, percentage * 1.02), 2)
+
+
+def sample_name(bam_file):
+    with pysam.AlignmentFile(bam_file, 'rb') as bam:
+        return bam.header.to_dict()['RG'][0]['SM']
+
+
+def read_regions(bed_file):
+    """Yield (chr, start, end) strings from a bed file."""
+    with open(bed_file) as regions:
+        for line in regions:
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            chr, start, end = line.split('\t')[:3]
+            yield chr, start, end.strip()
+
+
+def region_rng(chr, start, end, seed):
+    return random.Random(zlib.crc32('{0}_{1}_{2}'.format(chr, start, end).encode('utf-8'), seed))
+
+
+def depth_region(bam_file, bed_file, thresholds):
+    """Yield sambamba depth region output lines."""
+    name = sample_name(bam_file)
+    seed = zlib.crc32(name.encode('utf-8'))
+
+    yield '\t'.join(
+        ['# chrom', 'chromStart', 'chromEnd', 'readCount', 'meanCoverage'] +
+        ['percentage{0}'.format(threshold) for threshold in thresholds] +
+        ['sampleName']
+    )
+    for chr, start, end in read_regions(bed_file):
+        coverage = mean_coverage(region_rng(chr, start, end, seed))
+        read_count = int(coverage * (int(end) - int(start)) / 150)
+        yield '\t'.join(
+            [chr, start, end, str(read_count), str(round(coverage, 2))] +
+            [str(percentage(coverage, threshold)) for threshold in thresholds] +
+            [name]
+        )
+
+
+def depth_base(bam_file, bed_file):
+    """Yield sambamba depth base output lines, bases without coverage are skipped."""
+    name = sample_name(bam_file)
+    seed = zlib.crc32(name.encode('utf-8'))
+
+    yield '\t'.join(['REF', 'POS', 'COV', 'A', 'C', 'G', 'T', 'DEL', 'REFSKIP', 'SAMPLE'])
+    previous_chr, previous_end = None, 0
+    for chr, start, end in sorted(read_regions(bed_file), key=lambda region: (region[0], int(region[1]))):
+        rng = region_rng(chr, start, end, seed)
+        coverage = mean_coverage(rng)
+        if chr != previous_chr:
+            previous_chr, previous_end = chr, 0
+        for position in range(max(int(start), previous_end), int(end)):
+            depth = max(int(rng.gauss(coverage, 0.25 * coverage)), 0)
+            if depth:
+                yield '\t'.join([chr, str(position), str(depth), str(depth), '0', '0', '0', '0', '0', name])
+        previous_end = max(previous_end, int(end))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('command', choices=['depth'])
+    parser.add_argument('subcommand', choices=['region', 'base'])
+    parser.add_argument('bam')
+    parser.add_argument('--regions', '-L', required=True)
+    parser.add_argument('--cov-threshold', '-T', type=int, action='append', default=[])
+    parser.add_argument('--nthreads', '-t', type=int)
+    parser.add_argument('--filter', '-F')
+    parser.add_argument('--min-base-quality', '-q', type=int)
+    parser.add_argument('--fix-mate-overlaps', '-m', action='store_true')
+    args = parser.parse_args()
+
+    if args.subcommand == 'base':
+        lines = depth_base(args.bam, args.regions)
+    else:
+        lines = depth_region(args.bam, args.regions, args.cov_threshold)
+    for line in lines:
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
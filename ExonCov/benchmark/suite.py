@@ -0,0 +1,188 @@
+"""Benchmark suite for hot views and CLI commands.
+
+Every case is run once to warm up reference data caches, timed for a number of repeats and run once more with
+tracemalloc enabled to record peak memory and the number of executed queries.
+Cases are parameterised on scale, the number of samples in the synthetic benchmark sample set and custom panel.
+Report cases compute the sample set and custom panel reports, the sample set and custom panel view cases render the
+stored report.
+"""
+import datetime
+import platform
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from .. import app, db, reports
+from ..models import CustomPanel, PanelVersion, Report, Sample, SampleSet
+from ..utils import git_version
+from .synthetic import custom_panel_name, sample_set_name
+
+
+@contextmanager
+def count_queries():
+    """Count executed queries, yields a one item list with the count."""
+    count = [0]
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        count[0] += 1
+
+    db.event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield count
+    finally:
+        db.event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def view_case(url):
+    """Return case function requesting url with the flask test client."""
+    def case():
+        with app.test_client() as client:
+            response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError('{0} returned status {1}.'.format(url, response.status_code))
+    return case
+
+
+def cli_case(args):
+    """Return case function invoking a CLI command."""
+    def case():
+        result = app.test_cli_runner().invoke(args=args)
+        if result.exit_code != 0:
+            raise RuntimeError('{0} failed: {1}'.format(' '.join(args), result.output or result.exception))
+    return case
+
+
+def report_case(kind, object_id):
+    """Return case function computing and storing a report, the stored report is removed before every run."""
+    def case():
+        Report.query.filter_by(kind=kind, object_id=object_id).delete()
+        db.session.commit()
+        report = reports.get_report(kind, object_id, inline=False)
+        if not reports.claim_report(report.id) or not reports.compute_report(report) or report.status != 'done':
+            raise RuntimeError('{0} report {1} failed: {2}'.format(kind, object_id, report.error))
+    return case
+
+
+def report_view_case(url, kind, object_id):
+    """Return view case for a report page, the report is computed and stored on the first (warm up) run."""
+    view = view_case(url)
+    compute = report_case(kind, object_id)
+    computed = []
+
+    def case():
+        if not computed:
+            compute()
+            computed.append(True)
+        view()
+    return case
+
+
+def benchmark_cases(scale):
+    """Return [(kind, name, case)] for scale, raises LookupError for missing benchmark data."""
+    sample = Sample.query.filter_by(name='SYN000000').first()
+    panel_version = (
+        PanelVersion.query
+        .filter_by(panel_name='SYNPANEL0')
+        .order_by(PanelVersion.id.desc())
+        .first()
+    )
+    sample_set = SampleSet.query.filter_by(name=sample_set_name(scale)).first()
+    custom_panel = CustomPanel.query.filter_by(research_number=custom_panel_name(scale)).first()
+    if not sample or not panel_version or not sample_set or not custom_panel:
+        raise LookupError('No benchmark data for scale {0}, run benchmark generate.'.format(scale))
+
+    qc_args = ['sample_qc']
+    for sample_set_sample in sample_set.samples:
+        qc_args.extend(['-s', str(sample_set_sample.id), '-p', panel_version.panel_name])
+
+    return [
+        ('report', 'sample_set_report', report_case('sample_set', sample_set.id)),
+        ('report', 'custom_panel_report', report_case('custom_panel', custom_panel.id)),
+        ('view', 'samples', view_case('/sample')),
+        ('view', 'samples_filtered', view_case('/sample?sample=SYN00')),
+        ('view', 'sample', view_case('/sample/{0}'.format(sample.id))),
+        ('view', 'sample_panel', view_case('/sample/{0}/panel/{1}'.format(sample.id, panel_version.id))),
+        ('view', 'sample_set', report_view_case('/sample_set/{0}'.format(sample_set.id), 'sample_set', sample_set.id)),
+        ('view', 'sample_set_panel', view_case('/sample_set/{0}/panel/{1}'.format(sample_set.id, panel_version.id))),
+        ('view', 'custom_panel', report_view_case(
+            '/panel/custom/{0}'.format(custom_panel.id), 'custom_panel', custom_panel.id
+        )),
+        ('cli', 'sample_qc', cli_case(qc_args)),
+        ('cli', 'coverage_stats_panel', cli_case(['db', 'coverage_stats', str(sample_set.id), 'panel'])),
+        ('cli', 'coverage_stats_transcript', cli_case(['db', 'coverage_stats', str(sample_set.id), 'transcript'])),
+    ]
+
+
+def run_case(case, repeats):
+    """Run case, returns result dict with timings (seconds), query count and peak memory (bytes)."""
+    case()  # Warm up
+
+    timings = []
+    for repeat in range(repeats):
+        start_time = time.perf_counter()
+        case()
+        timings.append(time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    with count_queries() as query_count:
+        case()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'min': min(timings),
+        'median': statistics.median(timings),
+        'max': max(timings),
+        'repeats': repeats,
+        'queries': query_count[0],
+        'peak_memory': peak_memory,
+    }
+
+
+def run(scales, repeats=3, cases=None, log=print):
+    """Run benchmark cases for scales, returns result dict."""
+    login_disabled = app.config.get('LOGIN_DISABLED')
+    app.config['LOGIN_DISABLED'] = True
+    results = []
+    try:
+        for scale in scales:
+            for kind, name, case in benchmark_cases(scale):
+                if cases and name not in cases:
+                    continue
+                try:
+                    result = run_case(case, repeats)
+                except RuntimeError as error:
+                    result = {'error': str(error)}
+                    log("{0}\t{1}\tERROR: {2}".format(name, scale, error))
+                else:
+                    log("{0}\t{1}\t{2:.4f}s\t{3} queries\t{4:.1f} MB".format(
+                        name, scale, result['median'], result['queries'], result['peak_memory'] / 1024 / 1024
+                    ))
+                result.update({'kind': kind, 'name': name, 'scale': scale})
+                results.append(result)
+    finally:
+        app.config['LOGIN_DISABLED'] = login_disabled
+
+    return dict(run_metadata(), results=results)
+
+
+def run_metadata():
+    """Return ExonCov version, database and python metadata for benchmark results."""
+    version, commit = git_version()
+    return {
+        'version': version,
+        'commit': commit,
+        'dialect': db.engine.dialect.name,
+        'python': platform.python_version(),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+    }
+
+
+def compare(baseline, current, results='results', keys=('name', 'scale')):
+    """Compare two benchmark results, yields (key, baseline, current) for cases present in both."""
+    baseline_results = {tuple(result[key] for key in keys): result for result in baseline.get(results, [])}
+    for result in current.get(results, []):
+        result_key = tuple(result[key] for key in keys)
+        if result_key in baseline_results:
+            yield result_key, baseline_results[result_key], result
@@ -0,0 +1,269 @@
+"""Synthetic benchmark data.
+
+Writes design files for a synthetic design (loaded with the design loader) and populates samples with transcript
+measurements, low coverage index rows and tabix exon measurement files.
+Random values are drawn from a seeded generator, the same parameters always produce the same data.
+"""
+import datetime
+import os
+import random
+
+import pysam
+
+from .. import db, low_coverage
+from ..design_loader import DesignFiles, load_design
+from ..models import (
+    CustomPanel, Design, LowCoverageIndex, PanelVersion, Sample, SampleProject, SampleSet, SequencingRun, Transcript,
+    TranscriptMeasurement, User, custom_panels_samples, custom_panels_transcripts, panels_transcripts, sample_sets_samples,
+    samples_sequencingRun
+)
+from ..reference_data import bump_generations
+from .sambamba_stub import mean_coverage, percentage
+
+MEASUREMENT_TYPES = (
+    'measurement_mean_coverage', 'measurement_percentage10', 'measurement_percentage15', 'measurement_percentage20',
+    'measurement_percentage30', 'measurement_percentage50', 'measurement_percentage100'
+)
+THRESHOLDS = (10, 15, 20, 30, 50, 100)
+CHROMOSOMES = [str(chr) for chr in range(1, 23)] + ['X']
+
+
+def sample_set_name(scale):
+    """Return benchmark sample set name for scale."""
+    return 'Synthetic benchmark {0}'.format(scale)
+
+
+def custom_panel_name(scale):
+    """Return benchmark custom panel research number for scale."""
+    return 'SYN{0}'.format(scale)
+
+
+def write_design_files(
+    output_dir, genes, transcripts_per_gene, exons_per_transcript, panels, genes_per_panel, rng, prefix='SYN'
+):
+    """Write exon bed, gene transcript, preferred transcript and gene panel files, returns file paths.
+
+    Gene ids are <prefix><index>, designs written with the same seed and a larger number of genes are supersets.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {
+        name: os.path.join(output_dir, '{0}.txt'.format(name))
+        for name in ['exons', 'gene_transcripts', 'preferred_transcripts', 'gene_panels']
+    }
+    positions = {chr: 10000 for chr in CHROMOSOMES}
+    exons = []  # (chr, start, end, [transcript names])
+    gene_ids = []
+
+    with open(paths['gene_transcripts'], 'w') as gene_transcripts, \
+            open(paths['preferred_transcripts'], 'w') as preferred_transcripts:
+        for gene_index in range(genes):
+            gene_id = '{0}{1}'.format(prefix, gene_index)
+            gene_ids.append(gene_id)
+            chr = CHROMOSOMES[gene_index % len(CHROMOSOMES)]
+
+            # Gene exon pool, transcript t skips exon t for alternative transcripts
+            gene_exons = []
+            for exon_index in range(exons_per_transcript + 1):
+                start = positions[chr] + rng.randint(200, 5000)
+                end = start + rng.randint(80, 400)
+                positions[chr] = end
+                gene_exons.append((chr, start, end, []))
+
+            for transcript_index in range(transcripts_per_gene):
+                transcript_name = 'NM_{0}{1}_{2}'.format(prefix, gene_index, transcript_index)
+                for exon_index, exon in enumerate(gene_exons):
+                    if exon_index != (transcript_index + 1) % len(gene_exons) or transcript_index == 0:
+                        exon[3].append(transcript_name)
+                gene_transcripts.write('{0}\t{1}\n'.format(gene_id, transcript_name))
+                if transcript_index == 0:
+                    preferred_transcripts.write('{0}\t{1}\n'.format(gene_id, transcript_name))
+            exons.extend(gene_exons)
+
+    with open(paths['exons'], 'w') as exon_file:
+        for chr, start, end, transcript_names in sorted(exons, key=lambda exon: (CHROMOSOMES.index(exon[0]), exon[1])):
+            exon_file.write('{0}\t{1}\t{2}\tNA\tNA\tNA\t{3}\n'.format(
+                chr, start, end, ':'.join(transcript_names) or 'NA'
+            ))
+
+    with open(paths['gene_panels'], 'w') as gene_panels:
+        for panel_index in range(panels):
+            panel_genes = rng.sample(gene_ids, min(genes_per_panel, len(gene_ids)))
+            gene_panels.write('SYNPANEL{0}v24.1\tsynthetic\t{1}\n'.format(panel_index, ','.join(panel_genes)))
+
+    return paths
+
+
+def exon_measurement(rng):
+    """Random exon measurement, mean coverage and matching decreasing percentages."""
+    coverage = mean_coverage(rng)
+    measurement = {'measurement_mean_coverage': round(coverage, 2)}
+    for threshold in THRESHOLDS:
+        measurement['measurement_percentage{0}'.format(threshold)] = percentage(coverage, threshold)
+    return measurement
+
+
+def benchmark_user_id():
+    """Return first user id, creates an inactive benchmark user for empty databases."""
+    user_id = db.session.query(User.id).order_by(User.id).limit(1).scalar()
+    if user_id is None:
+        user_id = db.session.execute(User.__table__.insert().values(
+            email='benchmark@localhost', password='', first_name='Benchmark', last_name='Benchmark', active=False,
+            fs_uniquifier='benchmark'
+        )).inserted_primary_key[0]
+    return user_id
+
+
+def generate(
+    data_dir, samples=10, genes=200, transcripts_per_gene=2, exons_per_transcript=8, panels=10, genes_per_panel=50,
+    runs=4, scales=(10,), seed=1, log=print
+):
+    """Populate the database with a synthetic design and samples, returns summary dict."""
+    rng = random.Random(seed)
+    user_id = benchmark_user_id()
+    db.session.commit()
+
+    # Design
+    paths = write_design_files(
+        os.path.join(data_dir, 'design'), genes, transcripts_per_gene, exons_per_transcript, panels, genes_per_panel, rng
+    )
+    design_files = DesignFiles().parse(
+        paths['exons'], paths['gene_transcripts'], paths['preferred_transcripts'], paths['gene_panels']
+    )
+    load_design(design_files, 'synthetic', user_id, log=lambda message: None)
+    design_id = db.session.query(Design.id).filter(Design.name == 'synthetic').scalar()
+    db.session.execute(
+        PanelVersion.__table__.update()
+        .where(PanelVersion.panel_name.like('SYNPANEL%'))
+        .values(coverage_requirement_15=95)
+    )
+
+    # Transcript exons, ordered on exon start
+    transcripts = {}
+    for transcript_id, transcript_name in (
+        db.session.query(Transcript.id, Transcript.name).filter(Transcript.name.in_(design_files.transcripts.keys()))
+    ):
+        transcripts[transcript_name] = (transcript_id, [])
+    for exon_id, transcript_name in sorted(
+        design_files.exons_transcripts, key=lambda exon_transcript: design_files.exons[exon_transcript[0]][1]
+    ):
+        transcripts[transcript_name][1].append(exon_id)
+
+    # Projects and sequencing runs
+    run_ids = []
+    project_ids = []
+    for run_index in range(runs):
+        run_ids.append(db.session.execute(SequencingRun.__table__.insert().values(
+            platform_unit='SYNRUN{0}_{1}'.format(seed, run_index)
+        )).inserted_primary_key[0])
+        project_ids.append(db.session.execute(SampleProject.__table__.insert().values(
+            name='SYN_SYNRUN{0}_{1}'.format(seed, run_index), type=''
+        )).inserted_primary_key[0])
+
+    # Samples
+    sample_dir = os.path.join(data_dir, 'samples')
+    os.makedirs(sample_dir, exist_ok=True)
+    exons = sorted(design_files.exons.items(), key=lambda exon: (CHROMOSOMES.index(exon[1][0]), exon[1][1]))
+    today = datetime.date.today()
+    sample_ids = []
+    transcript_measurement_count = 0
+
+    for sample_index in range(samples):
+        sample_id = db.session.execute(Sample.__table__.insert().values(
+            name='SYN{0:06d}'.format(sample_index),
+            import_date=today - datetime.timedelta(days=sample_index % 365),
+            file_name='synthetic.bam',
+            import_command='synthetic',
+            project_id=project_ids[sample_index % runs],
+            exon_measurement_file='',
+            type='WES',
+            design_id=design_id,
+        )).inserted_primary_key[0]
+        sample_ids.append(sample_id)
+        db.session.execute(samples_sequencingRun.insert().values(
+            sample_id=sample_id, sequencingRun_id=run_ids[sample_index % runs]
+        ))
+
+        # Exon measurements and tabix file
+        exon_measurements = {}
+        exon_measurement_file = os.path.join(sample_dir, '{0}.txt'.format(sample_id))
+        with open(exon_measurement_file, 'w') as f:
+            f.write('#chr\tstart\tend\t{0}\n'.format('\t'.join(MEASUREMENT_TYPES)))
+            for exon_id, (chr, start, end) in exons:
+                exon_measurements[exon_id] = exon_measurement(rng)
+                f.write('{0}\t{1}\t{2}\t{3}\n'.format(
+                    chr, start, end,
+                    '\t'.join(str(exon_measurements[exon_id][measurement_type]) for measurement_type in MEASUREMENT_TYPES)
+                ))
+        pysam.tabix_compress(exon_measurement_file, exon_measurement_file + '.gz', force=True)
+        pysam.tabix_index(exon_measurement_file + '.gz', seq_col=0, start_col=1, end_col=2, force=True)
+        os.remove(exon_measurement_file)
+        db.session.execute(
+            Sample.__table__.update().where(Sample.id == sample_id).values(exon_measurement_file=exon_measurement_file + '.gz')
+        )
+
+        # Transcript measurements
+        transcript_measurements = {}
+        for transcript_id, exon_ids in transcripts.values():
+            lengths = [design_files.exons[exon_id][2] - design_files.exons[exon_id][1] for exon_id in exon_ids]
+            total_length = sum(lengths)
+            transcript_measurements[transcript_id] = dict(
+                sample_id=sample_id,
+                transcript_id=transcript_id,
+                len=total_length,
+                **{
+                    measurement_type: sum(
+                        exon_measurements[exon_id][measurement_type] * length for exon_id, length in zip(exon_ids, lengths)
+                    ) / total_length
+                    for measurement_type in MEASUREMENT_TYPES
+                }
+            )
+        db.session.execute(TranscriptMeasurement.__table__.insert(), list(transcript_measurements.values()))
+        db.session.execute(
+            LowCoverageIndex.__table__.insert(),
+            low_coverage.build_index_rows(sample_id, exon_measurements, transcript_measurements)
+        )
+        transcript_measurement_count += len(transcript_measurements)
+        db.session.commit()
+
+    # Sample sets and custom panels per benchmark scale
+    panel_version_id = db.session.query(PanelVersion.id).filter(PanelVersion.panel_name == 'SYNPANEL0').scalar()
+    panel_transcript_ids = [
+        transcript_id for transcript_id, in (
+            db.session.query(panels_transcripts.c.transcript_id)
+            .filter(panels_transcripts.c.panel_id == panel_version_id)
+        )
+    ]
+    for scale in sorted(set(min(scale, samples) for scale in scales)):
+        sample_set_id = db.session.execute(SampleSet.__table__.insert().values(
+            name=sample_set_name(scale), description='Synthetic benchmark samples', active=True, date=today
+        )).inserted_primary_key[0]
+        db.session.execute(
+            sample_sets_samples.insert(),
+            [{'sample_set_id': sample_set_id, 'sample_id': sample_id} for sample_id in sample_ids[:scale]]
+        )
+        custom_panel_id = db.session.execute(CustomPanel.__table__.insert().values(
+            user_id=user_id, research_number=custom_panel_name(scale), date=today
+        )).inserted_primary_key[0]
+        db.session.execute(
+            custom_panels_samples.insert(),
+            [{'custom_panel_id': custom_panel_id, 'sample_id': sample_id} for sample_id in sample_ids[:scale]]
+        )
+        db.session.execute(
+            custom_panels_transcripts.insert(),
+            [{'custom_panel_id': custom_panel_id, 'transcript_id': transcript_id} for transcript_id in panel_transcript_ids]
+        )
+    bump_generations(db.session.connection(), ['sample_sets'])
+    db.session.commit()
+
+    summary = {
+        'samples': samples,
+        'genes': genes,
+        'transcripts': len(transcripts),
+        'exons': len(design_files.exons),
+        'panels': panels,
+        'transcript_measurements': transcript_measurement_count,
+    }
+    log("Generated {samples} samples, {genes} genes, {transcripts} transcripts, {exons} exons and {panels} panels.".format(
+        **summary
+    ))
+    return summary
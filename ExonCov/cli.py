@@ -1,28 +1,78 @@
 """CLI functions."""
-from collections import OrderedDict
+import os
 import sys
 from subprocess import run as subprocess_run, PIPE, Popen, CalledProcessError
 import shlex
 import urllib.request
 import datetime
+from functools import partial
+import io
+import json
+import random
 
 import click
 from flask.cli import AppGroup
-from sqlalchemy.orm import joinedload
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import bindparam, or_
+from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.sql.expression import func
 import tempfile
 import shutil
-import pysam
 
-from . import app, db, utils
+from . import (
+    app, create_app, db, utils, bed_export, depth_histograms, design_loader, gaps, low_coverage, metrics, region_query,
+    reports, sketches, sqlite_export
+)
 from .models import (
     Gene, GeneAlias, Transcript, Exon, SequencingRun, Sample, SampleProject, TranscriptMeasurement, Panel,
-    PanelVersion, panels_transcripts, CustomPanel, SampleSet
+    PanelVersion, panels_transcripts, CustomPanel, SampleSet, LowCoverageIndex, Design,
+    sample_sets_samples, samples_sequencingRun, designs_exons, designs_transcripts
 )
+from .reference_data import reference_data, bump_generations
 
 db_cli = AppGroup('db', help="Database commands.")
+import_timer = utils.StageTimer()  # import_bam stage durations, used by the import benchmark
+migrations_path = os.path.join(os.path.dirname(app.root_path), 'migrations')  # Next to the ExonCov package
+
+
+def setup_migrate():
+    """Set up Flask-Migrate on first use (imports alembic), returns the Flask-Migrate command group."""
+    import flask_migrate
+    if 'migrate' not in app.extensions:
+        flask_migrate.Migrate(app, db, directory=migrations_path, command='db_migrate')
+    return flask_migrate.cli.db
+
+
+class MigrateCommands(click.MultiCommand):
+    """db_migrate command group, loads the Flask-Migrate commands when a db_migrate command is used."""
+
+    def list_commands(self, ctx):
+        return setup_migrate().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return setup_migrate().get_command(ctx, name)
+
+
+db_migrate_cli = MigrateCommands('db_migrate', help="Database migration commands (Flask-Migrate).")
+
+
+class SecurityCommands(click.MultiCommand):
+    """Flask-Security users and roles command groups, sets up the web profile (security) when a command is used."""
+
+    def security_group(self):
+        from flask_security import cli as security_cli
+        return getattr(security_cli, self.name)
+
+    def list_commands(self, ctx):
+        return self.security_group().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        create_app('web')
+        return self.security_group().get_command(ctx, name)
+
+
+users_cli = SecurityCommands('users', help="User commands (Flask-Security).")
+roles_cli = SecurityCommands('roles', help="Role commands (Flask-Security).")
 
 
 @db_cli.command('stats')
@@ -88,14 +138,32 @@ def print_transcripts(preferred_transcripts):
 @click.argument('project_name')
 @click.argument('sample_type', type=click.Choice(['WES', 'WGS', 'RNA']))
 @click.argument('bam')
-@click.option('-b', '--exon_bed', 'exon_bed_file', default=app.config['EXON_BED_FILE'])
+@click.option('-d', '--design', 'design_name', help="Design name, default newest active design.")
+@click.option('-b', '--exon_bed', 'exon_bed_file', help="Exon bed file, default design exon bed file.")
 @click.option('-t', '--threads', default=1)
 @click.option('-f', '--overwrite', is_flag=True)
 @click.option('--print_output', is_flag=True)
 @click.option('--print_sample_id', is_flag=True)
 @click.option('--temp', 'temp_path', default=None)
-def import_bam(project_name, sample_type, bam, exon_bed_file, threads, overwrite, print_output, print_sample_id, temp_path):
+def import_bam(
+    project_name, sample_type, bam, design_name, exon_bed_file, threads, overwrite, print_output, print_sample_id,
+    temp_path
+):
     """Import sample from bam file."""
+    import pysam  # Imported on use, keeps startup of other commands fast
+    import_timer.start()
+
+    # Select design
+    if design_name:
+        design = Design.query.filter_by(name=design_name).first()
+    else:
+        design = Design.query.filter_by(active=True).order_by(Design.id.desc()).first()
+    if not design:
+        sys.exit("ERROR: Design not found.")
+    design_id = design.id
+    if not exon_bed_file:
+        exon_bed_file = design.exon_bed_file or app.config['EXON_BED_FILE']
+
     try:
         bam_file = pysam.AlignmentFile(bam, "rb")
     except IOError as e:
@@ -138,6 +206,7 @@ def import_bam(project_name, sample_type, bam, exon_bed_file, threads, overwrite
     # Look for sample in database
     sample = Sample.query.filter_by(name=sample_name).filter_by(project_id=sample_project.id).first()
     if sample and overwrite:
+        sketches.remove_sample(sample)
         db.session.delete(sample)
         db.session.commit()
     elif sample and not overwrite:
@@ -164,6 +233,7 @@ def import_bam(project_name, sample_type, bam, exon_bed_file, threads, overwrite
         name=sample_name,
         project=sample_project,
         type=sample_type,
+        design_id=design_id,
         file_name=bam,
         import_command=sambamba_command,
         sequencing_runs=list(sequencing_runs.values()),
@@ -179,6 +249,7 @@ def import_bam(project_name, sample_type, bam, exon_bed_file, threads, overwrite
     # Store sample_id and close session before starting Sambamba
     sample_id = sample.id
     db.session.close()
+    import_timer.mark('setup')
 
     # Create temp_dir
     if not temp_path:
@@ -258,12 +329,73 @@ def import_bam(project_name, sample_type, bam, exon_bed_file, threads, overwrite
                     'measurement_percentage100': measurement_percentage100,
                 }
 
-    # Set transcript measurements
-    transcripts = Transcript.query.options(joinedload(Transcript.exons)).all()
+    import_timer.mark('sambamba')
+
+    # Coverage gaps and depth histograms, second sambamba pass with per base coverage
+    gap_file_path = None
+    if app.config['COVERAGE_GAP_THRESHOLDS'] or app.config['DEPTH_HISTOGRAM_BINS']:
+        depth_base_command = (
+            "{sambamba} depth base {bam_file} --nthreads {threads} --filter '{filter}' --regions {bed_file} {settings}"
+        ).format(
+            sambamba=app.config['SAMBAMBA'],
+            bam_file=bam,
+            threads=threads,
+            filter=app.config['SAMBAMBA_FILTER'],
+            bed_file=exon_bed_file,
+            settings='--fix-mate-overlaps --min-base-quality 10'
+        )
+        collectors = {}
+        if app.config['COVERAGE_GAP_THRESHOLDS']:
+            collectors['gaps'] = partial(gaps.ExonGaps, thresholds=app.config['COVERAGE_GAP_THRESHOLDS'])
+        if app.config['DEPTH_HISTOGRAM_BINS']:
+            collectors['depth_histogram'] = partial(
+                depth_histograms.ExonDepthHistogram, bins=app.config['DEPTH_HISTOGRAM_BINS']
+            )
+        sample_gaps = []
+        exon_depth_histograms = {}
+
+        p = Popen(shlex.split(depth_base_command), stdout=PIPE, encoding='utf-8')
+        for exon, results in gaps.stream_exons(
+            exons=[
+                (chr, int(start), int(end))
+                for chr, start, end in (exon_id.rsplit('_', 2) for exon_id in exon_measurements)
+            ],
+            base_coverage=gaps.read_depth_base(p.stdout),
+            collectors=collectors
+        ):
+            if 'gaps' in results:
+                sample_gaps.extend(results['gaps'])
+            if 'depth_histogram' in results:
+                exon_depth_histograms['{0}_{1}_{2}'.format(*exon)] = results['depth_histogram']
+        if p.wait():
+            sys.exit("ERROR: Sambamba depth base unsuccesful, returncode {0}.".format(p.returncode))
+
+        if app.config['COVERAGE_GAP_THRESHOLDS']:
+            gap_file_path = '{0}/{1}_gaps.txt'.format(temp_dir, os.path.splitext(sample.exon_measurement_file)[0])
+            gaps.write_gap_file(gap_file_path, gaps.sort_gaps(sample_gaps), app.config['COVERAGE_GAP_THRESHOLDS'])
+        if app.config['DEPTH_HISTOGRAM_BINS']:
+            depth_histograms.add_to_exon_file(
+                exon_measurement_file_path, app.config['DEPTH_HISTOGRAM_BINS'], exon_depth_histograms
+            )
+        import_timer.mark('depth_base')
+
+    # Set transcript measurements for design transcripts and exons
+    design_exon_ids = set(
+        exon_id for exon_id, in db.session.query(designs_exons.c.exon_id).filter(designs_exons.c.design_id == design_id)
+    )
+    transcripts = (
+        Transcript.query
+        .join(designs_transcripts, designs_transcripts.c.transcript_id == Transcript.id)
+        .filter(designs_transcripts.c.design_id == design_id)
+        .options(joinedload(Transcript.exons))
+        .all()
+    )
     transcripts_measurements = {}
 
     for transcript in transcripts:
         for exon in transcript.exons:
+            if exon.id not in design_exon_ids:
+                continue
             exon_measurement = exon_measurements[exon.id]
             if transcript.id not in transcripts_measurements:
                 transcripts_measurements[transcript.id] = {
@@ -291,6 +423,8 @@ def import_bam(project_name, sample_type, bam, exon_bed_file, threads, overwrite
                     )
                 transcripts_measurements[transcript.id]['len'] += exon.len
 
+    import_timer.mark('transcript_measurements')
+
     # Bulk insert transcript measurements
     bulk_insert_n = 1000
     transcript_values = list(transcripts_measurements.values())
@@ -298,20 +432,42 @@ def import_bam(project_name, sample_type, bam, exon_bed_file, threads, overwrite
         db.session.bulk_insert_mappings(TranscriptMeasurement, transcript_values[i:i+bulk_insert_n])
         db.session.commit()
 
+    # Low coverage index
+    db.session.bulk_insert_mappings(
+        LowCoverageIndex,
+        low_coverage.build_index_rows(sample_id, exon_measurements, transcripts_measurements)
+    )
+    db.session.commit()
+
+    import_timer.mark('insert')
+
+    # Coverage sketches, separate transaction to keep sketch rows locked shortly
+    if not sketches.add_sample(sample_type, Sample.query.get(sample_id).import_date.year, transcript_values):
+        print("WARNING: Coverage sketches not updated, run: flask --app ExonCov db rebuild_sketches")
+    import_timer.mark('sketches')
+
     # Compress, index and rsync exon_measurements
     exon_measurement_file_path_gz = '{0}.gz'.format(exon_measurement_file_path)
     pysam.tabix_compress(exon_measurement_file_path, exon_measurement_file_path_gz)
     pysam.tabix_index(exon_measurement_file_path_gz, seq_col=0, start_col=1, end_col=2)
+    rsync_files = '{0}*'.format(exon_measurement_file_path_gz)
+    if gap_file_path:
+        pysam.tabix_compress(gap_file_path, '{0}.gz'.format(gap_file_path))
+        pysam.tabix_index('{0}.gz'.format(gap_file_path), seq_col=0, start_col=1, end_col=2)
+        rsync_files += ' {0}.gz*'.format(gap_file_path)
+
+    import_timer.mark('tabix')
 
     # External subprocess
     command_result = subprocess_run(
-        f"rsync {exon_measurement_file_path_gz}* {app.config['EXON_MEASUREMENTS_RSYNC_PATH']}", shell=True, stdout=PIPE
+        f"rsync {rsync_files} {app.config['EXON_MEASUREMENTS_RSYNC_PATH']}", shell=True, stdout=PIPE
     )
     # Check returncode and raise CalledProcessError if non-zero.
     try:
         command_result.check_returncode()
     except CalledProcessError:
         sys.exit(f'ERROR: Rsync unsuccesful, returncode {command_result.returncode}.')
+    import_timer.mark('rsync')
 
     # Change exon_measurement_file to path on server.
     sample = Sample.query.get(sample_id)
@@ -319,12 +475,25 @@ def import_bam(project_name, sample_type, bam, exon_bed_file, threads, overwrite
         app.config['EXON_MEASUREMENTS_RSYNC_PATH'].split(':')[-1],
         sample.exon_measurement_file
     )
+    if gap_file_path:
+        sample.gap_file = '{0}/{1}.gz'.format(
+            app.config['EXON_MEASUREMENTS_RSYNC_PATH'].split(':')[-1],
+            os.path.basename(gap_file_path)
+        )
     db.session.add(sample)
     db.session.commit()
 
     # Remove temp_dir
     if not temp_path:
         shutil.rmtree(temp_dir)
+    import_timer.mark('finish')
+
+    # Import metrics
+    if app.config['METRICS_PATH']:
+        for stage, seconds in import_timer.stages:
+            metrics.registry.observe('exoncov_import_stage_seconds', seconds, [('stage', stage)])
+        metrics.registry.increment('exoncov_imports_total', [('type', sample_type)])
+        metrics.flush_cli(app.config['METRICS_PATH'])
 
     # Return sample id
     if print_sample_id:
@@ -445,6 +614,7 @@ def remove_sample(sample_id):
         sys.exit("ERROR: Sample is used in custom panels.")
 
     else:
+        sketches.remove_sample(sample)
         db.session.delete(sample)
         db.session.commit()
 
@@ -478,11 +648,14 @@ def check_samples():
 @click.option('-s', '--sample_filter', default='')
 @click.option('-t', '--sample_type', default='WES')
 @click.option('-n', '--sample_number', type=int, default=100)
-def create_sample_set(name, min_days, max_days, sample_filter, sample_type, sample_number):
+@click.option('--seed', type=int, help="Random seed, use to reproduce a sample set.")
+def create_sample_set(name, min_days, max_days, sample_filter, sample_type, sample_number, seed):
     """Create (random) sample set."""
-    description = '{0} random {1} samples. Minimum age: {2} days. Maximum age: {3} days. Sample name filter: {4}'.format(
-        sample_number, sample_type, min_days, max_days, sample_filter
-    )
+    if seed is None:
+        seed = random.randrange(2**32)
+    description = (
+        '{0} random {1} samples. Minimum age: {2} days. Maximum age: {3} days. Sample name filter: {4}. Seed: {5}'
+    ).format(sample_number, sample_type, min_days, max_days, sample_filter, seed)
     min_date = datetime.date.today() - datetime.timedelta(days=min_days)
     max_date = datetime.date.today() - datetime.timedelta(days=max_days)
 
@@ -493,34 +666,38 @@ def create_sample_set(name, min_days, max_days, sample_filter, sample_type, samp
                 "maximum date {max_date} is greater than min date {min_date}"
             ).format(max_days=max_days, min_days=min_days, max_date=max_date, min_date=min_date)
         )
+
+    # Candidate samples: import date, no 'special' project type (validation etc), no merge samples (one sequencing run)
+    # and sequencing run platform unit in project name.
+    candidate_sample_ids = (
+        db.session.query(Sample.id)
+        .join(SampleProject, Sample.project_id == SampleProject.id)
+        .join(samples_sequencingRun, samples_sequencingRun.c.sample_id == Sample.id)
+        .join(SequencingRun, SequencingRun.id == samples_sequencingRun.c.sequencingRun_id)
+        .filter(Sample.name.like('%{0}%'.format(sample_filter)))
+        .filter(Sample.type == sample_type)
+        .filter(Sample.import_date > max_date, Sample.import_date <= min_date)
+        .filter(or_(SampleProject.type.is_(None), SampleProject.type == ''))
+        .group_by(Sample.id)
+        .having(func.count(SequencingRun.id) == 1)
+        .having(func.max(func.instr(SampleProject.name, SequencingRun.platform_unit)) > 0)
+        .order_by(Sample.id)
+    )
+    sample_ids = utils.reservoir_sample((sample_id for sample_id, in candidate_sample_ids.yield_per(10000)), sample_number, seed)
     samples = (
         Sample.query
-        .filter(Sample.name.like('%{0}%'.format(sample_filter)))
-        .filter_by(type=sample_type)
-        .order_by(func.rand())
+        .filter(Sample.id.in_(sample_ids))
+        .options(joinedload(Sample.project), selectinload(Sample.sequencing_runs))
+        .order_by(Sample.import_date.desc(), Sample.name)
+        .all()
     )
-    sample_count = 0
 
     sample_set = SampleSet(
         name=name,
         description=description,
+        samples=samples
     )
 
-    for sample in samples:
-        # Filter sampels: import date, 'special' project type (validation etc), Merge samples,
-        if (
-            sample.import_date > max_date
-            and sample.import_date <= min_date
-            and not sample.project.type
-            and len(sample.sequencing_runs) == 1
-            and sample.sequencing_runs[0].platform_unit in sample.project.name
-        ):
-            sample_set.samples.append(sample)
-            sample_count += 1
-
-        if sample_count >= sample_number:
-            break
-
     if len(sample_set.samples) != sample_number:
         print("Not enough samples found to create sample set, found {0} samples.".format(len(sample_set.samples)))
     else:
@@ -548,18 +725,39 @@ def create_sample_set(name, min_days, max_days, sample_filter, sample_type, samp
 
 
 @db_cli.command('import_alias_table')
-def import_alias_table():
-    """Import gene aliases from HGNC (ftp://ftp.ebi.ac.uk/pub/databases/genenames/new/tsv/hgnc_complete_set.txt)"""
-    hgnc_file = urllib.request.urlopen('ftp://ftp.ebi.ac.uk/pub/databases/genenames/new/tsv/hgnc_complete_set.txt')
-    header = hgnc_file.readline().decode("utf-8").strip().split('\t')
+@click.argument('hgnc_file', type=click.File('r', encoding='utf-8'), required=False)
+@click.option('-n', '--dry_run', is_flag=True, help="Only report changes.")
+def import_alias_table(hgnc_file, dry_run):
+    """Import gene aliases from a HGNC complete set file (- for stdin), replaces all existing aliases.
+
+    Without file the HGNC complete set is downloaded from
+    ftp://ftp.ebi.ac.uk/pub/databases/genenames/new/tsv/hgnc_complete_set.txt
+    """
+    if not hgnc_file:
+        hgnc_file = io.TextIOWrapper(
+            urllib.request.urlopen('ftp://ftp.ebi.ac.uk/pub/databases/genenames/new/tsv/hgnc_complete_set.txt'),
+            encoding='utf-8'
+        )
+
+    gene_ids = set(gene_id for gene_id, in db.session.query(Gene.id))
+    existing_aliases = set(db.session.query(GeneAlias.id, GeneAlias.gene_id))
+    aliases = set()
+    error_count = 0
+
+    header = hgnc_file.readline().strip().split('\t')
+    locus_group_index = header.index('locus_group')
+    refseq_accession_index = header.index('refseq_accession')
+    symbol_index = header.index('symbol')
+    prev_symbol_index = header.index('prev_symbol')
+
     for line in hgnc_file:
-        data = line.decode("utf-8").strip().split('\t')
+        data = line.strip().split('\t')
         # Skip lines without locus_group, refseq_accession, gene symbol or alias symbol
         try:
-            locus_group = data[header.index('locus_group')]
-            refseq_accession = data[header.index('refseq_accession')]
-            hgnc_gene_symbol = data[header.index('symbol')]  # Current hgnc gene symbol
-            hgnc_prev_symbols = data[header.index('prev_symbol')].strip('"')   # Use only previous gene symbols as aliases
+            locus_group = data[locus_group_index]
+            refseq_accession = data[refseq_accession_index]
+            hgnc_gene_symbol = data[symbol_index]  # Current hgnc gene symbol
+            hgnc_prev_symbols = data[prev_symbol_index].strip('"')   # Use only previous gene symbols as aliases
         except IndexError:
             continue
 
@@ -573,31 +771,53 @@ def import_alias_table():
             hgnc_gene_ids = [hgnc_gene_symbol]
             hgnc_gene_ids.extend(hgnc_prev_symbols.split('|'))
 
-            # Find gene in database
-            db_genes_ids = []
-            for hgnc_gene_id in hgnc_gene_ids:
-                db_gene = Gene.query.get(hgnc_gene_id)
-                if db_gene:
-                    db_genes_ids.append(db_gene.id)
+            # Find genes in database
+            db_genes_ids = [hgnc_gene_id for hgnc_gene_id in hgnc_gene_ids if hgnc_gene_id in gene_ids]
 
             # Check db genes
             if not db_genes_ids:
                 print("ERROR: No gene in database found for: {0}".format(','.join(hgnc_gene_ids)))
+                error_count += 1
 
             # Create aliases
             else:
                 for db_gene_id in db_genes_ids:
                     for hgnc_gene_id in hgnc_gene_ids:
                         if hgnc_gene_id not in db_genes_ids:
-                            try:
-                                gene_alias = GeneAlias(id=hgnc_gene_id, gene_id=db_gene_id)
-                                db.session.add(gene_alias)
-                                db.session.commit()
-                            except IntegrityError:
-                                db.session.rollback()
-                                continue
+                            aliases.add((hgnc_gene_id, db_gene_id))
                         elif hgnc_gene_id != db_gene_id:  # Does exist as gene in database
                             print("ERROR: Can not import alias: {0} for gene: {1}".format(hgnc_gene_id, db_gene_id))
+                            error_count += 1
+
+    new_aliases = aliases - existing_aliases
+    removed_aliases = existing_aliases - aliases
+
+    # Apply changes in one transaction
+    if not dry_run and (new_aliases or removed_aliases):
+        gene_alias_table = GeneAlias.__table__
+        if removed_aliases:
+            db.session.execute(
+                gene_alias_table.delete()
+                .where(gene_alias_table.c.id == bindparam('alias_id'))
+                .where(gene_alias_table.c.gene_id == bindparam('alias_gene_id')),
+                [{'alias_id': alias_id, 'alias_gene_id': gene_id} for alias_id, gene_id in removed_aliases]
+            )
+        if new_aliases:
+            db.session.execute(
+                gene_alias_table.insert(),
+                [{'id': alias_id, 'gene_id': gene_id} for alias_id, gene_id in sorted(new_aliases)]
+            )
+        bump_generations(db.session.connection(), ['design'])
+        db.session.commit()
+
+    print("Aliases: {0} total, {1} added, {2} removed, {3} unchanged, {4} errors.{5}".format(
+        len(aliases),
+        len(new_aliases),
+        len(removed_aliases),
+        len(aliases & existing_aliases),
+        error_count,
+        ' Dry run, database not changed.' if dry_run else ''
+    ))
 
 
 @db_cli.command('export_alias_table')
@@ -616,11 +836,23 @@ def export_alias_table():
     '-a', '--archived_panels', 'active_panels', default=True, is_flag=True,
     help="Use archived panels instead of active panels"
 )
-def print_panel_bed(remove_flank, panel, active_panels):
+@click.option('-m', '--merge', is_flag=True, help="Merge overlapping exons.")
+@click.option(
+    '-o', '--output_dir', type=click.Path(file_okay=False),
+    help="Write a bed file per panel to output directory instead of printing all regions."
+)
+@click.option('-d', '--design', 'design_name', help="Design name, default newest active design.")
+def print_panel_bed(remove_flank, panel, active_panels, merge, output_dir, design_name):
     """Print bed file containing regions in validated active or validated archived panels.
     FULL_autosomal and FULL_TARGET are filtered from the list.
     """
-    exons = []
+    if design_name:
+        design = Design.query.filter_by(name=design_name).first()
+        design_id = design.id if design else None
+    else:
+        design_id = bed_export.default_design_id()
+    if not design_id:
+        sys.exit("ERROR: Design not found.")
 
     if panel:
         panel_name, version = panel.split('v')
@@ -630,36 +862,26 @@ def print_panel_bed(remove_flank, panel, active_panels):
             .filter_by(panel_name=panel_name)
             .filter_by(version_year=version_year)
             .filter_by(version_revision=version_revision)
-            .options(joinedload(PanelVersion.transcripts))
         )
     else:
         panel_versions = (
             PanelVersion.query
             .filter_by(active=active_panels)
             .filter_by(validated=True)
-            .options(joinedload(PanelVersion.transcripts))
         )
-
-    for panel in panel_versions:
-        if 'FULL' not in panel.panel_name:  # Skip FULL_autosomal and FULL_TARGET
-            for transcript in panel.transcripts:
-                for exon in transcript.exons:
-                    if exon.id not in exons:
-                        exons.append(exon.id)
-                        if remove_flank:
-                            print("{chr}\t{start}\t{end}\t{gene}".format(
-                                chr=exon.chr,
-                                start=exon.start + 20,  # Add 20bp to remove flank
-                                end=exon.end - 20,  # Substract 20bp to remove flank
-                                gene=transcript.gene.id
-                            ))
-                        else:
-                            print("{chr}\t{start}\t{end}\t{gene}".format(
-                                chr=exon.chr,
-                                start=exon.start,
-                                end=exon.end,
-                                gene=transcript.gene.id
-                            ))
+    panel_versions = [
+        panel_version for panel_version in panel_versions
+        if 'FULL' not in panel_version.panel_name  # Skip FULL_autosomal and FULL_TARGET
+    ]
+
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        beds = bed_export.panel_beds(panel_versions, design_id, remove_flank, merge)
+        for panel_version in panel_versions:
+            with open(os.path.join(output_dir, '{0}.bed'.format(panel_version.name_version)), 'w') as bed_file:
+                bed_file.write(beds[panel_version.id])
+    else:
+        sys.stdout.write(bed_export.combined_bed(panel_versions, design_id, remove_flank, merge))
 
 
 @db_cli.command('coverage_stats')
@@ -679,262 +901,522 @@ def print_panel_bed(remove_flank, panel, active_panels):
     default='measurement_percentage15'
 )
 @click.option('-a', '--archived_panels', 'active_panels', default=True, is_flag=True)
-def export_cov_stats_sample_set(sample_set_id, data_type, measurement_type, active_panels):
-    """Print tab delimited coverage statistics of panel or transcript as table."""
-    def retrieve_and_print_panel_measurements(ss_samples, query, measurement_type):
-        panels_measurements = OrderedDict()
-        # Retrieve panel measurements
-        for panel, transcript_measurement in query:
-            sample = transcript_measurement.sample
-            # Add new panel
-            if panel not in panels_measurements:
-                panels_measurements[panel] = OrderedDict()
-            # Add new sample or calculate weighted avg
-            if sample not in panels_measurements[panel]:
-                panels_measurements[panel][sample] = {
-                    'len': transcript_measurement.len,
-                    'measurement': transcript_measurement[measurement_type]
-                }
-            else:
-                panels_measurements[panel][sample]['measurement'] = utils.weighted_average(
-                    values=[panels_measurements[panel][sample]['measurement'], transcript_measurement[measurement_type]],
-                    weights=[panels_measurements[panel][sample]['len'], transcript_measurement.len]
-                )
-                panels_measurements[panel][sample]['len'] += transcript_measurement.len
-
-        # Print header
-        print("panel_version\tmeasurement_type\tmean\tmin\tmax")
-        for panel in panels_measurements:
-            panel_cov_stats = utils.get_summary_stats_multi_sample(
-                measurements=panels_measurements, keys=[panel], samples=ss_samples
-            )
-            print(
-                "{panel_version}\t{measurement_type}\t{mean}\t{min}\t{max}".format(
-                    panel_version=panel,
-                    measurement_type=measurement_type,
-                    mean=panel_cov_stats[panel]['mean'],
-                    min=panel_cov_stats[panel]['min'],
-                    max=panel_cov_stats[panel]['max']
-                )
-            )
+@click.option(
+    '-o', '--output_format', type=click.Choice(['tsv', 'json']), default='tsv',
+    help="Tab delimited table or one JSON object per line."
+)
+def export_cov_stats_sample_set(sample_set_id, data_type, measurement_type, active_panels, output_format):
+    """Print tab delimited coverage statistics of panel or transcript as table.
 
-    def retrieve_and_print_transcript_measurements(query, measurement_type):
-        panels_measurements = OrderedDict()
-
-        # Retrieve transcript measurements
-        for panel, transcript_measurement in query:
-            sample = transcript_measurement.sample
-            transcript = transcript_measurement.transcript
-
-            # Add new panel
-            if panel not in panels_measurements:
-                panels_measurements[panel] = OrderedDict()
-            # Add new transcript
-            if transcript not in panels_measurements[panel]:
-                panels_measurements[panel][transcript] = {}
-            # Add new sample
-            if sample not in panels_measurements[panel][transcript]:
-                panels_measurements[panel][transcript][sample] = transcript_measurement[measurement_type]
-
-        # Print header
-        print("panel_version\ttranscript_id\tgene_id\tmeasurement_type\tmean\tmin\tmax")
-        for panel in panels_measurements:
-            for transcript in panels_measurements[panel]:
-                transcript_cov_stats = utils.get_summary_stats_multi_sample(
-                    measurements=panels_measurements[panel], keys=[transcript]
-                )
-                # Print summary
-                print(
-                    "{panel_version}\t{transcript}\t{gene}\t{measurement_type}\t{mean}\t{min}\t{max}".format(
-                        panel_version=panel,
-                        transcript=transcript,
-                        gene=transcript.gene_id,
-                        measurement_type=measurement_type,
-                        mean=transcript_cov_stats[transcript]['mean'],
-                        min=transcript_cov_stats[transcript]['min'],
-                        max=transcript_cov_stats[transcript]['max']
-                    )
+    Measurements are streamed from the database sorted per group, memory use does not depend on the number of samples.
+    """
+    def summary_stats(groups):
+        """Calculate min, max and mean of (key, value) rows sorted on key, yields (key, stats)."""
+        key = None
+        for row_key, value in groups:
+            if row_key != key:
+                if key is not None:
+                    yield key, {'mean': float(total) / count, 'min': min_value, 'max': max_value}
+                key, min_value, max_value, total, count = row_key, value, value, 0, 0
+            min_value = min(min_value, value)
+            max_value = max(max_value, value)
+            total += value
+            count += 1
+        if key is not None:
+            yield key, {'mean': float(total) / count, 'min': min_value, 'max': max_value}
+
+    def panel_name_version(row):
+        return '{0}v{1}.{2}'.format(row.panel_name, row.version_year, row.version_revision)
+
+    def panel_sample_measurements(rows):
+        """Calculate weighted panel measurement per sample, rows sorted on panel and sample."""
+        key = None
+        for row in rows:
+            row_key = (row.panel_id, row.sample_id)
+            if row_key != key:
+                if key is not None:
+                    yield panel, measurement
+                key, measurement, measurement_len = row_key, row.measurement, row.len
+                panel = (row.panel_id, panel_name_version(row))
+            else:
+                measurement = utils.weighted_average(
+                    values=[measurement, row.measurement],
+                    weights=[measurement_len, row.len]
                 )
+                measurement_len += row.len
+        if key is not None:
+            yield panel, measurement
+
+    def print_stats(header, stats):
+        if output_format == 'tsv':
+            print('\t'.join(header))
+            for row in stats:
+                print('\t'.join(str(row[column]) for column in header))
+        else:
+            for row in stats:
+                print(json.dumps(row))
 
-    # Retrieve samples from sampleset
+    # Retrieve sample set
     try:
-        sample_set = SampleSet.query.options(joinedload(SampleSet.samples)).filter_by(id=sample_set_id).one()
+        sample_set = SampleSet.query.filter_by(id=sample_set_id).one()
     except NoResultFound as e:
         print("Sample set ID {id} does not exist in database.".format(id=sample_set_id))
         sys.exit(e)
-    sample_ids = [sample.id for sample in sample_set.samples]
 
-    # Retrieve panels, transcripts measurements per sample
+    # Stream panels, transcripts measurements per sample
     query = (
-        db.session.query(PanelVersion, TranscriptMeasurement)
-        .filter_by(active=active_panels, validated=True)
+        db.session.query(
+            PanelVersion.id.label('panel_id'),
+            PanelVersion.panel_name,
+            PanelVersion.version_year,
+            PanelVersion.version_revision,
+            TranscriptMeasurement.sample_id,
+            Transcript.name.label('transcript'),
+            Transcript.gene_id.label('gene'),
+            TranscriptMeasurement.len,
+            getattr(TranscriptMeasurement, measurement_type).label('measurement')
+        )
+        .filter(PanelVersion.active == active_panels, PanelVersion.validated.is_(True))
         .filter(PanelVersion.panel_name.notlike("%FULL%"))
         .join(Transcript, PanelVersion.transcripts)
         .join(TranscriptMeasurement)
-        .filter(TranscriptMeasurement.sample_id.in_(sample_ids))
-        .order_by(
-            PanelVersion.panel_name,
-            PanelVersion.id,
-            TranscriptMeasurement.transcript_id,
-            TranscriptMeasurement.sample_id)
-        .all()
+        .join(sample_sets_samples, sample_sets_samples.c.sample_id == TranscriptMeasurement.sample_id)
+        .filter(sample_sets_samples.c.sample_set_id == sample_set.id)
     )
 
     if data_type == "panel":
-        retrieve_and_print_panel_measurements(
-            ss_samples=sample_set.samples, query=query, measurement_type=measurement_type
+        query = query.order_by(
+            PanelVersion.panel_name,
+            PanelVersion.id,
+            TranscriptMeasurement.sample_id,
+            TranscriptMeasurement.transcript_id
+        )
+        print_stats(
+            ['panel_version', 'measurement_type', 'mean', 'min', 'max'],
+            (
+                dict(panel_version=panel, measurement_type=measurement_type, **stats)
+                for (panel_id, panel), stats in summary_stats(panel_sample_measurements(query.yield_per(1000)))
+            )
         )
     elif data_type == "transcript":
-        retrieve_and_print_transcript_measurements(query=query, measurement_type=measurement_type)
-
-# Disabled, can be used to setup a new database from scratch
-# Needs imports:
-# import re
-# import time
-# @db_cli.command('load_design')
-# def load_design():
-#     """Load design files to database."""
-#     # files
-#     exon_file = app.config['EXON_BED_FILE']
-#     gene_transcript_file = app.config['GENE_TRANSCRIPT_FILE']
-#     preferred_transcripts_file = app.config['PREFERRED_TRANSCRIPTS_FILE']
-#     gene_panel_file = app.config['GENE_PANEL_FILE']
-
-#     # Filled during parsing.
-#     transcripts = {}
-#     exons = []
-
-#     # Parse Exon file
-#     with open(exon_file, 'r') as f:
-#         print("Loading exon file: {0}".format(exon_file))
-#         for line in f:
-#             data = line.rstrip().split('\t')
-#             chr, start, end = data[:3]
-#             # Create exon
-#             exon = Exon(
-#                 id='{0}_{1}_{2}'.format(chr, start, end),
-#                 chr=chr,
-#                 start=int(start),
-#                 end=int(end)
-#             )
-
-#             try:
-#                 transcript_data = set(data[6].split(':'))
-#             except IndexError:
-#                 print("Warning: No transcripts for exon: {0}.".format(exon))
-#                 transcript_data = []
-
-#             # Create transcripts
-#             for transcript_name in transcript_data:
-#                 if transcript_name != 'NA':
-#                     if transcript_name in transcripts:
-#                         transcript = transcripts[transcript_name]
-
-#                         # Set start / end positions
-#                         if transcript.start > exon.start:
-#                             transcript.start = exon.start
-#                         if transcript.end < exon.end:
-#                             transcript.end = exon.end
-
-#                         # Sanity check chromosome
-#                         if transcript.chr != exon.chr:
-#                             print("Warning: Different chromosomes for {0} and {1}".format(transcript, exon))
-
-#                     else:
-#                         transcript = Transcript(
-#                             name=transcript_name,
-#                             chr=exon.chr,
-#                             start=exon.start,
-#                             end=exon.end
-#                         )
-#                         transcripts[transcript_name] = transcript
-#                     exon.transcripts.append(transcript)
-#             exons.append(exon)
-
-#     # Bulk insert exons and transcript
-#     bulk_insert_n = 5000
-#     for i in range(0, len(exons), bulk_insert_n):
-#         db.session.add_all(exons[i:i+bulk_insert_n])
-#         db.session.commit()
-
-#     db.session.add_all(list(transcripts.values()))
-#     db.session.commit()
-
-#     # Load gene and transcript file
-#     genes = {}
-#     with open(gene_transcript_file, 'r') as f:
-#         print("Loading gene transcript file: {0}".format(gene_transcript_file))
-#         for line in f:
-#             if not line.startswith('#'):
-#                 data = line.rstrip().split('\t')
-#                 gene_id = data[0].rstrip()
-#                 transcript_name = data[1].rstrip()
-
-#                 if transcript_name in transcripts:
-#                     if gene_id in genes:
-#                         gene = genes[gene_id]
-#                     else:
-#                         gene = Gene(id=gene_id)
-#                         genes[gene_id] = gene
-#                     gene.transcripts.append(transcripts[transcript_name])
-#                     db.session.add(gene)
-#                 else:
-#                     print("Warning: Unkown transcript {0} for gene {1}".format(transcript_name, gene_id))
-#         db.session.commit()
-
-#     # Setup preferred transcript dictonary
-#     preferred_transcripts = {}  # key = gene, value = transcript
-#     with open(preferred_transcripts_file, 'r') as f:
-#         print("Loading preferred transcripts file: {0}".format(preferred_transcripts_file))
-#         for line in f:
-#             if not line.startswith('#'):
-#                 # Parse data
-#                 data = line.rstrip().split('\t')
-#                 gene = genes[data[0]]
-#                 transcript = transcripts[data[1]]
-
-#                 # Set default transcript
-#                 gene.default_transcript = transcript
-#                 preferred_transcripts[gene.id] = transcript.name
-#                 db.session.add(gene)
-#         db.session.commit()
-
-#     # Setup gene panel
-#     with open(gene_panel_file, 'r') as f:
-#         print("Loading gene panel file: {0}".format(gene_panel_file))
-#         panels = {}
-#         for line in f:
-#             data = line.rstrip().split('\t')
-#             panel = data[0]
-
-#             if 'elid' not in panel:  # Skip old elid panel designs
-#                 panels[panel] = data[2]
-
-#         for panel in sorted(panels.keys()):
-#             panel_match = re.search('(\w+)v(1\d).(\d)', panel)  # look for [panel_name]v[version] pattern
-#             genes = panels[panel].split(',')
-#             if panel_match:
-#                 panel_name = panel_match.group(1)
-#                 panel_version_year = panel_match.group(2)
-#                 panel_version_revision = panel_match.group(3)
-#             else:
-#                 panel_name = panel
-#                 panel_version_year = time.strftime('%y')
-#                 panel_version_revision = 1
-
-#             panel = utils.get_one_or_create(
-#                 db.session,
-#                 Panel,
-#                 name=panel_name,
-#             )[0]
-
-#             panel_version = PanelVersion(panel_name=panel_name, version_year=panel_version_year, version_revision=panel_version_revision, active=True, validated=True, user_id=1)
-
-#             for gene in set(genes):
-#                 if gene in preferred_transcripts:
-#                     transcript = transcripts[preferred_transcripts[gene]]
-#                     panel_version.transcripts.append(transcript)
-#                 else:
-#                     print("WARNING: Unkown gene: {0}".format(gene))
-#             db.session.add(panel_version)
-#         db.session.commit()
+        query = query.order_by(
+            PanelVersion.panel_name,
+            PanelVersion.id,
+            TranscriptMeasurement.transcript_id,
+            TranscriptMeasurement.sample_id
+        )
+        print_stats(
+            ['panel_version', 'transcript_id', 'gene_id', 'measurement_type', 'mean', 'min', 'max'],
+            (
+                dict(panel_version=panel, transcript_id=transcript, gene_id=gene, measurement_type=measurement_type, **stats)
+                for (panel_id, panel, transcript, gene), stats in summary_stats(
+                    ((row.panel_id, panel_name_version(row), row.transcript, row.gene), row.measurement)
+                    for row in query.yield_per(1000)
+                )
+            )
+        )
+
+
+@db_cli.command('build_low_coverage_index')
+@click.option('-s', '--samples', 'sample_ids', multiple=True, help="Sample ID(s), default all samples without index.")
+@click.option('-f', '--overwrite', is_flag=True, help="Rebuild index for samples with an existing index.")
+def build_low_coverage_index(sample_ids, overwrite):
+    """Build low coverage index from exon measurement files for existing samples."""
+    samples = Sample.query.order_by(Sample.id)
+    if sample_ids:
+        samples = samples.filter(Sample.id.in_(sample_ids))
+    if not overwrite:
+        samples = samples.filter(~Sample.low_coverage_index.any())
+
+    for sample in samples.all():
+        try:
+            low_coverage.index_sample(sample)
+        except IOError as e:
+            print("ERROR: Can not read exon measurement file for sample {0}: {1}".format(sample.id, e))
+        else:
+            print("Indexed sample {0}".format(sample.id))
+
+
+@db_cli.command('low_coverage')
+@click.option('-e', '--exon', 'exons', multiple=True, help="Exon id (chr_start_end).")
+@click.option('-t', '--transcript', 'transcripts', multiple=True, help="Transcript name.")
+@click.option('-g', '--gene', 'genes', multiple=True, help="Gene id, uses all gene transcripts.")
+@click.option('-p', '--panel', 'panels', multiple=True, help="Panel name including version, for example AMY01v19.1.")
+@click.option('-c', '--threshold', type=click.Choice([str(threshold) for threshold in low_coverage.THRESHOLDS]), default='15')
+@click.option('--project', help="Filter on project name.")
+@click.option('--min_date', type=click.DateTime(formats=['%Y-%m-%d']), help="Minimal import date.")
+@click.option('--max_date', type=click.DateTime(formats=['%Y-%m-%d']), help="Maximal import date.")
+def print_low_coverage(exons, transcripts, genes, panels, threshold, project, min_date, max_date):
+    """Print samples with less than 100% coverage at threshold for exons, transcripts, genes or panels."""
+    exon_ids, transcript_ids, errors = low_coverage.resolve_targets(exons, transcripts, genes, panels)
+    if errors:
+        sys.exit('\n'.join(errors))
+    if not exon_ids and not transcript_ids:
+        sys.exit("Provide at least one exon, transcript, gene or panel.")
+
+    design = reference_data.design()
+    print("sample_id\tsample\tproject\timport_date\texons\ttranscripts")
+    for sample_id, sample_name, project_name, import_date, low_exon_ids, low_transcript_ids in low_coverage.query_low_coverage(
+        int(threshold), exon_ids, transcript_ids, project,
+        min_date.date() if min_date else None, max_date.date() if max_date else None
+    ):
+        print("{sample_id}\t{sample}\t{project}\t{import_date}\t{exons}\t{transcripts}".format(
+            sample_id=sample_id,
+            sample=sample_name,
+            project=project_name,
+            import_date=import_date,
+            exons=','.join(low_exon_ids),
+            transcripts=','.join(design.transcripts[transcript_id].name for transcript_id in low_transcript_ids)
+        ))
+
+
+@db_cli.command('region_coverage')
+@click.argument('regions_file', type=click.File('r'))
+@click.option('-s', '--sample', 'sample_ids', multiple=True, type=int, help="Sample id.")
+@click.option('-ss', '--sample_set', 'sample_set_ids', multiple=True, type=int, help="Sample set id.")
+@click.option(
+    '-m', '--measurement_type', 'measurement_types', multiple=True, type=click.Choice(region_query.MEASUREMENT_TYPES),
+    help="Measurement type, default all."
+)
+def print_region_coverage(regions_file, sample_ids, sample_set_ids, measurement_types):
+    """Print exon measurements for regions (bed file or chr:start-end lines, - for stdin) in samples."""
+    regions, errors = region_query.parse_regions(regions_file.read())
+    if errors:
+        sys.exit('\n'.join(errors))
+
+    sample_ids = set(sample_ids)
+    sample_sets = reference_data.sample_sets().sample_sets
+    for sample_set_id in sample_set_ids:
+        if sample_set_id not in sample_sets:
+            sys.exit("ERROR: Unknown sample set: {0}.".format(sample_set_id))
+        sample_ids.update(sample_sets[sample_set_id].sample_ids)
+    samples = Sample.query.filter(Sample.id.in_(sample_ids)).order_by(Sample.name).all()
+    if not samples:
+        sys.exit("Provide at least one sample or sample set.")
+
+    measurement_types = measurement_types or region_query.MEASUREMENT_TYPES
+    region_exons, sample_measurements = region_query.query_regions(regions, samples, measurement_types)
+    for sample in samples:
+        if sample_measurements[sample.id] is None:
+            print("WARNING: Can not read exon measurement file for sample {0}.".format(sample.id))
+
+    print("region\texon\tsample_id\tsample\t{0}".format('\t'.join(measurement_types)))
+    for region in regions:
+        for exon_id in region_exons[region]:
+            for sample in samples:
+                measurements = (sample_measurements[sample.id] or {}).get(exon_id)
+                print("{region}\t{exon}\t{sample_id}\t{sample}\t{measurements}".format(
+                    region='{0}:{1}-{2}'.format(*region),
+                    exon=exon_id,
+                    sample_id=sample.id,
+                    sample=sample.name,
+                    measurements='\t'.join(
+                        str(measurements[measurement_type]) if measurements else 'NA'
+                        for measurement_type in measurement_types
+                    )
+                ))
+
+
+@db_cli.command('gaps')
+@click.argument('panel')
+@click.option('-s', '--sample', 'sample_ids', multiple=True, type=int, help="Sample id.")
+@click.option('-ss', '--sample_set', 'sample_set_ids', multiple=True, type=int, help="Sample set id.")
+@click.option(
+    '-c', '--threshold', type=int, default=15,
+    help="Coverage threshold, one of the gap file thresholds (COVERAGE_GAP_THRESHOLDS at import)."
+)
+def print_gaps(panel, sample_ids, sample_set_ids, threshold):
+    """Print coverage gaps of panel (name including version, for example AMY01v19.1) exons in samples."""
+    panel_versions = {
+        panel_version.name_version: panel_version for panel_version in reference_data.panels().panel_versions.values()
+    }
+    if panel not in panel_versions:
+        sys.exit("ERROR: Unknown panel: {0}.".format(panel))
+
+    sample_ids = set(sample_ids)
+    sample_sets = reference_data.sample_sets().sample_sets
+    for sample_set_id in sample_set_ids:
+        if sample_set_id not in sample_sets:
+            sys.exit("ERROR: Unknown sample set: {0}.".format(sample_set_id))
+        sample_ids.update(sample_sets[sample_set_id].sample_ids)
+    samples = Sample.query.filter(Sample.id.in_(sample_ids)).order_by(Sample.name).all()
+    if not samples:
+        sys.exit("Provide at least one sample or sample set.")
+
+    print("sample_id\tsample\tchr\tstart\tend\tgenes\ttranscripts\tmin_coverage")
+    for sample in samples:
+        if not sample.gap_file:
+            print("WARNING: No gap file for sample {0}.".format(sample.id))
+            continue
+        try:
+            sample_gaps = gaps.panel_gaps(sample, panel_versions[panel], threshold)
+        except IOError as e:
+            print("ERROR: Can not read gap file for sample {0}: {1}".format(sample.id, e))
+            continue
+        except ValueError as e:
+            print("WARNING: Sample {0}: {1}".format(sample.id, e))
+            continue
+        for gap in sample_gaps:
+            print("{sample_id}\t{sample}\t{chr}\t{start}\t{end}\t{genes}\t{transcripts}\t{min_coverage}".format(
+                sample_id=sample.id,
+                sample=sample.name,
+                chr=gap['chr'],
+                start=gap['start'],
+                end=gap['end'],
+                genes=','.join(sorted(set(transcript.gene_id for transcript in gap['transcripts']))),
+                transcripts=','.join(transcript.name for transcript in gap['transcripts']),
+                min_coverage=gap['min_coverage']
+            ))
+
+
+@db_cli.command('threshold_coverage')
+@click.argument('panel')
+@click.option('-s', '--sample', 'sample_ids', multiple=True, type=int, help="Sample id.")
+@click.option('-ss', '--sample_set', 'sample_set_ids', multiple=True, type=int, help="Sample set id.")
+@click.option('-a', '--all_samples', is_flag=True, help="All samples.")
+@click.option(
+    '-c', '--threshold', 'thresholds', multiple=True, type=int, required=True,
+    help="Coverage threshold, one of the depth histogram bins (DEPTH_HISTOGRAM_BINS at import)."
+)
+@click.option('-l', '--level', type=click.Choice(['panel', 'transcript', 'exon']), default='panel')
+def print_threshold_coverage(panel, sample_ids, sample_set_ids, all_samples, thresholds, level):
+    """Print percentage of bases at or above coverage thresholds, derived from the sample depth histograms.
+
+    Coverage is printed per panel (name including version, for example AMY01v19.1), panel transcript or exon.
+    """
+    panel_versions = {
+        panel_version.name_version: panel_version for panel_version in reference_data.panels().panel_versions.values()
+    }
+    if panel not in panel_versions:
+        sys.exit("ERROR: Unknown panel: {0}.".format(panel))
+    design = reference_data.design()
+    transcripts = sorted(
+        (design.transcripts[transcript_id] for transcript_id in panel_versions[panel].transcript_ids),
+        key=lambda transcript: (transcript.gene_id, transcript.name)
+    )
+
+    sample_ids = set(sample_ids)
+    sample_sets = reference_data.sample_sets().sample_sets
+    for sample_set_id in sample_set_ids:
+        if sample_set_id not in sample_sets:
+            sys.exit("ERROR: Unknown sample set: {0}.".format(sample_set_id))
+        sample_ids.update(sample_sets[sample_set_id].sample_ids)
+    samples = Sample.query
+    if not all_samples:
+        samples = samples.filter(Sample.id.in_(sample_ids))
+    samples = samples.order_by(Sample.name).all()
+    if not samples:
+        sys.exit("Provide at least one sample or sample set.")
+
+    columns = {
+        'panel': ['panel'],
+        'transcript': ['gene', 'transcript'],
+        'exon': ['gene', 'transcript', 'exon'],
+    }
+    print("sample_id\tsample\t{0}\t{1}".format(
+        '\t'.join(columns[level]), '\t'.join('percentage{0}'.format(threshold) for threshold in thresholds)
+    ))
+
+    def print_row(sample, names, percentages):
+        print("{sample_id}\t{sample}\t{names}\t{percentages}".format(
+            sample_id=sample.id,
+            sample=sample.name,
+            names='\t'.join(names),
+            percentages='\t'.join(
+                'NA' if not percentages or percentages[threshold] is None else '{0:.2f}'.format(percentages[threshold])
+                for threshold in thresholds
+            )
+        ))
+
+    for sample in samples:
+        try:
+            percentages = depth_histograms.sample_percentages(sample, transcripts, thresholds)
+        except IOError as e:
+            print("ERROR: Can not read exon measurement file for sample {0}: {1}".format(sample.id, e))
+            continue
+        except ValueError as e:
+            print("ERROR: Sample {0}: {1}".format(sample.id, e))
+            continue
+        if percentages is None:
+            print("WARNING: No depth histograms for sample {0}.".format(sample.id))
+            continue
+
+        if level == 'panel':
+            print_row(sample, [panel], percentages['total'])
+        else:
+            for transcript in transcripts:
+                names = [transcript.gene_id, transcript.name]
+                if level == 'transcript':
+                    print_row(sample, names, percentages['transcripts'].get(transcript.id))
+                else:
+                    for exon in design.transcript_exons(transcript, sample.design_id):
+                        print_row(sample, names + [exon.id], percentages['exons'].get(exon.id))
+
+
+@db_cli.command('load_design')
+@click.option('--exon_file', default=lambda: app.config['EXON_BED_FILE'], help="Default EXON_BED_FILE.")
+@click.option(
+    '--gene_transcript_file', default=lambda: app.config['GENE_TRANSCRIPT_FILE'], help="Default GENE_TRANSCRIPT_FILE."
+)
+@click.option(
+    '--preferred_transcripts_file', default=lambda: app.config['PREFERRED_TRANSCRIPTS_FILE'],
+    help="Default PREFERRED_TRANSCRIPTS_FILE."
+)
+@click.option('--gene_panel_file', default=lambda: app.config['GENE_PANEL_FILE'], help="Default GENE_PANEL_FILE.")
+@click.option('--no_panels', is_flag=True, help="Skip gene panel file.")
+@click.option('-d', '--design', 'design_name', default='default', help="Design name, created if it does not exist.")
+@click.option('-u', '--user_id', type=int, default=1, help="User id for new panel versions, the user must exist.")
+@click.option('-n', '--dry_run', is_flag=True, help="Only report changes.")
+@click.option('-f', '--force', is_flag=True, help="Remove exons and transcripts from a design with samples.")
+def load_design(
+    exon_file, gene_transcript_file, preferred_transcripts_file, gene_panel_file, no_panels, design_name, user_id,
+    dry_run, force
+):
+    """Load design files to an empty database or add design changes to an existing database."""
+    print("Loading design files.")
+    design = design_loader.DesignFiles().parse(
+        exon_file, gene_transcript_file, preferred_transcripts_file, None if no_panels else gene_panel_file
+    )
+    for warning in design.warnings:
+        print(warning)
+    print("Parsed {0} exons, {1} transcripts, {2} genes and {3} panels.".format(
+        len(design.exons), len(design.transcripts), len(design.genes), len(design.panels)
+    ))
+    try:
+        design_loader.load_design(design, design_name, user_id, dry_run=dry_run, force=force)
+    except ValueError as e:
+        db.session.rollback()
+        sys.exit("ERROR: {0}".format(e))
+    if dry_run:
+        print("Dry run, database not changed.")
+
+
+@db_cli.command('designs')
+def print_designs():
+    """Print tab delimited design table."""
+    design = reference_data.design()
+    sample_counts = dict(db.session.query(Sample.design_id, func.count(Sample.id)).group_by(Sample.design_id))
+    print("id\tname\tactive\texons\ttranscripts\tsamples\texon_bed_file")
+    for design_record in design.designs.values():
+        print("{id}\t{name}\t{active}\t{exons}\t{transcripts}\t{samples}\t{exon_bed_file}".format(
+            id=design_record.id,
+            name=design_record.name,
+            active=design_record.active,
+            exons=len(design_record.exon_ids),
+            transcripts=len(design_record.transcript_ids),
+            samples=sample_counts.get(design_record.id, 0),
+            exon_bed_file=design_record.exon_bed_file or app.config['EXON_BED_FILE']
+        ))
+
+
+@db_cli.command('set_design_active')
+@click.argument('design_name')
+@click.option('--inactive', is_flag=True, help="Deactivate design.")
+def set_design_active(design_name, inactive):
+    """(De)activate a design for new imports, import_bam uses the newest active design by default."""
+    design = Design.query.filter_by(name=design_name).first()
+    if not design:
+        sys.exit("ERROR: Unknown design: {0}.".format(design_name))
+    design.active = not inactive
+    db.session.commit()
+
+
+@db_cli.command('backfill_design')
+@click.argument('design_name')
+@click.option('-n', '--number', type=int, help="Maximum number of samples.")
+@click.option('-t', '--threads', default=1)
+def print_backfill_design(design_name, number, threads):
+    """Print import_bam commands to re-import samples measured against other designs, newest samples first.
+
+    The commands can be run in the background, samples keep their current design until re-imported.
+    """
+    design = Design.query.filter_by(name=design_name).first()
+    if not design:
+        sys.exit("ERROR: Unknown design: {0}.".format(design_name))
+    samples = (
+        db.session.query(Sample.file_name, Sample.type, SampleProject.name)
+        .join(SampleProject, Sample.project_id == SampleProject.id)
+        .filter(Sample.design_id != design.id)
+        .order_by(Sample.import_date.desc(), Sample.id.desc())
+        .limit(number)
+    )
+    for bam, sample_type, project_name in samples:
+        print("flask --app ExonCov import_bam {project} {type} {bam} --design {design} --threads {threads} --overwrite".format(
+            project=shlex.quote(project_name),
+            type=sample_type,
+            bam=shlex.quote(bam),
+            design=shlex.quote(design.name),
+            threads=threads
+        ))
+
+
+@db_cli.command('create_tables')
+def create_tables():
+    """Create all tables in an empty database and stamp the latest migration, use for new SQLite databases."""
+    if db.inspect(db.engine).get_table_names():
+        sys.exit("ERROR: Database is not empty.")
+    if not os.path.isdir(migrations_path):
+        sys.exit("ERROR: Migrations directory not found: {0}.".format(migrations_path))
+    db.create_all()
+    setup_migrate()
+    import flask_migrate
+    flask_migrate.stamp()
+
+
+@db_cli.command('export_sqlite')
+@click.argument('sqlite_file', type=click.Path(dir_okay=False))
+@click.option('-s', '--sample', 'sample_ids', multiple=True, type=int, help="Sample id.")
+@click.option('-ss', '--sample_set', 'sample_set_ids', multiple=True, type=int, help="Sample set id.")
+@click.option('-p', '--panel', 'panels', multiple=True, help="Panel name (without version), default all panels.")
+@click.option('-e', '--exon_file_dir', help="Copy sample exon measurement files to directory.")
+def export_sqlite(sqlite_file, sample_ids, sample_set_ids, panels, exon_file_dir):
+    """Export reference data and selected samples, sample sets and panels to a new SQLite file."""
+    if os.path.exists(sqlite_file):
+        sys.exit("ERROR: {0} exists.".format(sqlite_file))
+    sample_count = sqlite_export.export(sqlite_file, sample_ids, sample_set_ids, panels, exon_file_dir)
+    print("Exported {0} samples to {1}.".format(sample_count, sqlite_file))
+
+
+@db_cli.command('report_worker')
+@click.option('--once', is_flag=True, help="Exit when no reports are queued.")
+def report_worker(once):
+    """Compute queued sample set and custom panel reports, run one or more workers next to the webserver."""
+    reports.run_worker(once=once)
+
+
+@db_cli.command('queue_reports')
+@click.option('-r', '--retry_failed', is_flag=True, help="Queue failed reports again.")
+def queue_reports(retry_failed):
+    """Queue (or compute small) reports for all active sample sets, reports with current results are skipped."""
+    for sample_set in reference_data.sample_sets().active():
+        report = reports.get_report('sample_set', sample_set.id, retry_failed=retry_failed)
+        print("{0}\t{1}".format(sample_set.name, report.status))
+
+
+@db_cli.command('freeze_custom_panels')
+@click.option('-c', '--custom_panel', 'custom_panel_ids', multiple=True, type=int, help="Custom panel id.")
+def freeze_custom_panels(custom_panel_ids):
+    """Freeze pages of validated custom panels without snapshot, existing snapshots are not overwritten."""
+    custom_panels = CustomPanel.query.filter_by(validated=True).order_by(CustomPanel.id)
+    if custom_panel_ids:
+        custom_panels = custom_panels.filter(CustomPanel.id.in_(custom_panel_ids))
+
+    for custom_panel in custom_panels.all():
+        report = reports.queue_custom_panel_snapshot(custom_panel.id)
+        if not report:
+            if custom_panel_ids:
+                print("WARNING: Custom panel {0} already has a snapshot, skipped.".format(custom_panel.id))
+            continue
+        if reports.claim_report(report.id):
+            reports.compute_report(report)
+        if report.status == 'done':
+            print("{0}\t{1} pages".format(custom_panel.id, json.loads(report.result)['pages']))
+        else:
+            print("{0}\t{1}\t{2}".format(custom_panel.id, report.status, report.error or ''))
+
+
+@db_cli.command('rebuild_sketches')
+@click.option('-t', '--sample_type', type=click.Choice(['WES', 'WGS', 'RNA']), help="Sample type, default all types.")
+def rebuild_sketches(sample_type):
+    """Rebuild coverage sketches from transcript measurements, run when no samples are imported or removed."""
+    sketches.rebuild(sample_type=sample_type)
@@ -0,0 +1,169 @@
+"""Per exon depth histograms, derive the percentage of bases at or above any binned coverage threshold.
+
+import_bam counts the exon bases at or above each of DEPTH_HISTOGRAM_BINS coverage (sambamba depth base) and stores
+these cumulative counts in the depth_histogram column of the sample exon measurement file, comma separated without
+trailing zeros. The bins are stored in a second header line: #depth_histogram_bins=1,5,10,...
+Derived percentages are exact for thresholds in the bins and match the percentageN columns of sambamba depth region.
+Transcript and panel percentages are length weighted averages, like the transcript measurements.
+"""
+from bisect import bisect_right
+
+from . import metrics
+from .reference_data import reference_data
+from .region_query import exon_blocks
+
+COLUMN = 'depth_histogram'
+BINS_HEADER = '#depth_histogram_bins='
+
+
+class ExonDepthHistogram(object):
+    """Depth histogram of one exon, add base coverage in position order."""
+
+    def __init__(self, chr, start, end, bins):
+        self.start = start
+        self.end = end
+        self.bins = bins
+        self.position = start  # Next base
+        self.bin_counts = [0] * (len(bins) + 1)  # Bases per number of bins at or below coverage
+
+    def add(self, position, coverage):
+        """Add coverage of the base at position, skipped bases have coverage 0."""
+        if position < self.position or position >= self.end:
+            return
+        self.bin_counts[bisect_right(self.bins, coverage)] += 1
+        self.position = position + 1
+
+    def finish(self):
+        """Return cumulative counts, bases with coverage at or above each bin."""
+        counts = []
+        bases = 0
+        for bin_count in reversed(self.bin_counts[1:]):
+            bases += bin_count
+            counts.append(bases)
+        return counts[::-1]
+
+
+def format_histogram(counts):
+    """Format cumulative counts as comma separated string without trailing zeros."""
+    counts = list(counts)
+    while counts and not counts[-1]:
+        counts.pop()
+    return ','.join(str(count) for count in counts) or '0'
+
+
+def parse_histogram(value, bins):
+    """Parse comma separated cumulative counts, padded with zeros to the number of bins."""
+    counts = [int(count) for count in value.split(',')]
+    return counts + [0] * (len(bins) - len(counts))
+
+
+def add_to_exon_file(exon_measurement_file_path, bins, histograms):
+    """Add depth histogram column and bins header line to an uncompressed exon measurement file.
+
+    histograms: {exon_id: cumulative counts}, exons without histogram get zero counts.
+    """
+    with open(exon_measurement_file_path) as exon_measurement_file:
+        lines = exon_measurement_file.readlines()
+
+    with open(exon_measurement_file_path, 'w') as exon_measurement_file:
+        for line in lines:
+            if line.startswith('#'):
+                exon_measurement_file.write('{0}\t{1}\n'.format(line.rstrip('\n'), COLUMN))
+                exon_measurement_file.write('{0}{1}\n'.format(BINS_HEADER, ','.join(str(bin) for bin in bins)))
+            else:
+                exon_id = '_'.join(line.split('\t', 3)[:3])
+                exon_measurement_file.write('{0}\t{1}\n'.format(
+                    line.rstrip('\n'), format_histogram(histograms.get(exon_id, []))
+                ))
+
+
+def read_histograms(exon_measurement_file, exons):
+    """Read depth histograms of exons (sorted ExonRecords) from a sample exon measurement file.
+
+    Returns bins and {exon_id: cumulative counts}, bins is None if the file has no depth histograms.
+    """
+    exon_ids = set(exon.id for exon in exons)
+    histograms = {}
+    with metrics.tabix_file(exon_measurement_file) as sample_tabix:
+        header = list(sample_tabix.header)
+        columns = header[0].lstrip('#').split('\t')
+        bins = [
+            [int(bin) for bin in line[len(BINS_HEADER):].split(',')]
+            for line in header[1:] if line.startswith(BINS_HEADER)
+        ]
+        if COLUMN not in columns or not bins:
+            return None, {}
+        bins = bins[0]
+        index = columns.index(COLUMN)
+        for chr, start, end in exon_blocks(exons):
+            for row in sample_tabix.fetch(chr, start, end):
+                row = row.split('\t')
+                exon_id = '{0}_{1}_{2}'.format(row[0], row[1], row[2])
+                if exon_id in exon_ids:
+                    histograms[exon_id] = parse_histogram(row[index], bins)
+    return bins, histograms
+
+
+def bin_indices(bins, thresholds):
+    """Return {threshold: bin index}, raises ValueError for thresholds not in bins."""
+    missing_thresholds = [threshold for threshold in thresholds if threshold not in bins]
+    if missing_thresholds:
+        raise ValueError('Thresholds not in depth histogram bins ({0}): {1}.'.format(
+            ','.join(str(bin) for bin in bins), ','.join(str(threshold) for threshold in missing_thresholds)
+        ))
+    return {threshold: bins.index(threshold) for threshold in thresholds}
+
+
+def percentage(bases, length):
+    if not length:
+        return None
+    return 100.0 * bases / length
+
+
+def sample_percentages(sample, transcripts, thresholds):
+    """Derive percentage of bases at or above thresholds in a sample for transcripts (TranscriptRecords).
+
+    Exons are limited to the sample design. Returns {'exons': {exon_id: {threshold: percentage}},
+    'transcripts': {transcript_id: {threshold: percentage}}, 'total': {threshold: percentage}}, the total is the
+    transcript length weighted average. Returns None if the sample has no depth histograms.
+    """
+    design = reference_data.design()
+    transcript_exons = {
+        transcript.id: design.transcript_exons(transcript, sample.design_id) for transcript in transcripts
+    }
+    exons = sorted(
+        set(exon for exons in transcript_exons.values() for exon in exons),
+        key=lambda exon: (exon.chr, exon.start, exon.end)
+    )
+    bins, histograms = read_histograms(sample.exon_measurement_file, exons)
+    if bins is None:
+        return None
+    indices = bin_indices(bins, thresholds)
+
+    exon_bases = {
+        exon_id: {threshold: counts[index] for threshold, index in indices.items()}
+        for exon_id, counts in histograms.items()
+    }
+    result = {
+        'exons': {
+            exon.id: {threshold: percentage(bases, exon.len) for threshold, bases in exon_bases[exon.id].items()}
+            for exon in exons if exon.id in exon_bases
+        },
+        'transcripts': {},
+    }
+    total_bases = dict.fromkeys(thresholds, 0)
+    total_length = 0
+    for transcript_id, exons in transcript_exons.items():
+        exons = [exon for exon in exons if exon.id in exon_bases]
+        length = sum(exon.len for exon in exons)
+        if not length:
+            continue
+        bases = {threshold: sum(exon_bases[exon.id][threshold] for exon in exons) for threshold in thresholds}
+        result['transcripts'][transcript_id] = {
+            threshold: percentage(bases[threshold], length) for threshold in thresholds
+        }
+        for threshold in thresholds:
+            total_bases[threshold] += bases[threshold]
+        total_length += length
+    result['total'] = {threshold: percentage(total_bases[threshold], total_length) for threshold in thresholds}
+    return result
@@ -0,0 +1,371 @@
+"""Bulk design loader.
+
+Parses the exon bed, gene transcript, preferred transcript and gene panel files and loads them with Core bulk
+statements. The parsed design is compared to the database, only new rows are inserted and changed rows updated,
+which makes the loader usable for an empty database as well as for updating an existing design.
+Rows missing from the design files are reported but never deleted, measurements and panels may refer to them.
+Exons and transcripts are linked to a named design, the design membership always matches the design files.
+Exon, transcript and exon transcript rows are shared by all designs: exon transcript links of all loaded designs are
+kept and transcript coordinates span the transcript exons of all designs (only widened by a new design). The exons of
+a transcript in a design are the linked exons in the design membership.
+"""
+import re
+import time
+
+from sqlalchemy import bindparam
+
+from . import db
+from .models import (
+    Design, Exon, Transcript, Gene, Panel, PanelVersion, Sample, User, designs_exons, designs_transcripts,
+    exons_transcripts, panels_transcripts
+)
+from .reference_data import bump_generations
+
+CHUNK_SIZE = 10000
+
+
+class DesignFiles(object):
+    """Design parsed from design files."""
+
+    def __init__(self):
+        self.exon_file = None
+        self.exons = {}  # exon_id -> (chr, start, end)
+        self.transcripts = {}  # transcript name -> [chr, start, end, gene_id]
+        self.exons_transcripts = set()  # (exon_id, transcript name)
+        self.genes = {}  # gene_id -> preferred transcript name
+        self.panels = {}  # (panel_name, version_year, version_revision) -> set(gene_id)
+        self.warnings = []
+
+    def parse_exon_file(self, exon_file):
+        self.exon_file = exon_file
+        with open(exon_file, 'r') as f:
+            for line in f:
+                data = line.rstrip().split('\t')
+                chr, start, end = data[0], int(data[1]), int(data[2])
+                exon_id = '{0}_{1}_{2}'.format(chr, start, end)
+                self.exons[exon_id] = (chr, start, end)
+
+                try:
+                    transcript_names = set(data[6].split(':'))
+                except IndexError:
+                    self.warnings.append("Warning: No transcripts for exon: {0}:{1}-{2}.".format(chr, start, end))
+                    transcript_names = []
+
+                for transcript_name in transcript_names:
+                    if transcript_name == 'NA':
+                        continue
+                    if transcript_name in self.transcripts:
+                        transcript = self.transcripts[transcript_name]
+                        transcript[1] = min(transcript[1], start)
+                        transcript[2] = max(transcript[2], end)
+                        if transcript[0] != chr:
+                            self.warnings.append("Warning: Different chromosomes for {0} and {1}:{2}-{3}".format(
+                                transcript_name, chr, start, end
+                            ))
+                    else:
+                        self.transcripts[transcript_name] = [chr, start, end, None]
+                    self.exons_transcripts.add((exon_id, transcript_name))
+
+    def parse_gene_transcript_file(self, gene_transcript_file):
+        with open(gene_transcript_file, 'r') as f:
+            for line in f:
+                if not line.startswith('#'):
+                    data = line.rstrip().split('\t')
+                    gene_id = data[0].rstrip()
+                    transcript_name = data[1].rstrip()
+
+                    if transcript_name in self.transcripts:
+                        self.genes.setdefault(gene_id, None)
+                        self.transcripts[transcript_name][3] = gene_id
+                    else:
+                        self.warnings.append("Warning: Unkown transcript {0} for gene {1}".format(transcript_name, gene_id))
+
+    def parse_preferred_transcripts_file(self, preferred_transcripts_file):
+        with open(preferred_transcripts_file, 'r') as f:
+            for line in f:
+                if not line.startswith('#'):
+                    gene_id, transcript_name = line.rstrip().split('\t')[:2]
+                    if gene_id in self.genes and transcript_name in self.transcripts:
+                        self.genes[gene_id] = transcript_name
+                    else:
+                        self.warnings.append("Warning: Unknown preferred transcript {0} for gene {1}".format(
+                            transcript_name, gene_id
+                        ))
+
+    def parse_gene_panel_file(self, gene_panel_file):
+        with open(gene_panel_file, 'r') as f:
+            for line in f:
+                data = line.rstrip().split('\t')
+                panel = data[0]
+                if 'elid' in panel:  # Skip old elid panel designs
+                    continue
+
+                panel_match = re.search(r'(\w+)v(\d{2})\.(\d+)', panel)  # look for [panel_name]v[version] pattern
+                if panel_match:
+                    key = (panel_match.group(1), int(panel_match.group(2)), int(panel_match.group(3)))
+                else:
+                    key = (panel, int(time.strftime('%y')), 1)
+                self.panels[key] = set(gene_id for gene_id in data[2].split(',') if gene_id)
+
+    def parse(self, exon_file, gene_transcript_file, preferred_transcripts_file, gene_panel_file):
+        """Parse all design files."""
+        self.parse_exon_file(exon_file)
+        self.parse_gene_transcript_file(gene_transcript_file)
+        self.parse_preferred_transcripts_file(preferred_transcripts_file)
+        if gene_panel_file:
+            self.parse_gene_panel_file(gene_panel_file)
+        return self
+
+
+def execute_chunks(connection, statement, rows):
+    """Execute statement for rows in executemany chunks, returns number of rows."""
+    for index in range(0, len(rows), CHUNK_SIZE):
+        connection.execute(statement, rows[index:index + CHUNK_SIZE])
+    return len(rows)
+
+
+def load_design(design, design_name, user_id, dry_run=False, force=False, log=print):
+    """Load parsed design, returns {table: (inserted, updated)}.
+
+    All changes are applied in one transaction in dependency order: genes, transcripts, exons, exons_transcripts,
+    default transcripts, design membership, panels, panel_versions and panels_transcripts.
+    Raises ValueError before any change if the user for new panel versions does not exist, or if exons or transcripts
+    would be removed from a design with samples (unless force is set).
+    """
+    connection = db.session.connection()
+    stats = {}
+
+    def stage(name, inserted=0, updated=0, start_time=None):
+        stats[name] = (inserted, updated)
+        seconds = time.monotonic() - start_time
+        log("{name}: {inserted} inserted, {updated} updated in {seconds:.2f}s ({rate:.0f} rows/s)".format(
+            name=name, inserted=inserted, updated=updated, seconds=seconds,
+            rate=(inserted + updated) / seconds if seconds else 0
+        ))
+
+    # Existing design
+    existing_genes = dict(connection.execute(db.select(Gene.id, Gene.default_transcript_id)).all())
+    existing_transcripts = {
+        row.name: row for row in connection.execute(
+            db.select(Transcript.id, Transcript.name, Transcript.chr, Transcript.start, Transcript.end, Transcript.gene_id)
+        )
+    }
+    existing_exons = set(exon_id for exon_id, in connection.execute(db.select(Exon.id)))
+    existing_exons_transcripts = set(connection.execute(
+        db.select(exons_transcripts.c.exon_id, exons_transcripts.c.transcript_id)
+    ).all())
+    existing_panels = set(name for name, in connection.execute(db.select(Panel.name)))
+    existing_panel_versions = set(connection.execute(
+        db.select(PanelVersion.panel_name, PanelVersion.version_year, PanelVersion.version_revision)
+    ).all())
+    design_id = connection.execute(db.select(Design.id).where(Design.name == design_name)).scalar()
+    existing_design_exons = set(exon_id for exon_id, in connection.execute(
+        db.select(designs_exons.c.exon_id).where(designs_exons.c.design_id == design_id)
+    ))
+    existing_design_transcripts = set(transcript_id for transcript_id, in connection.execute(
+        db.select(designs_transcripts.c.transcript_id).where(designs_transcripts.c.design_id == design_id)
+    ))
+
+    # Check user of new panel versions and samples of a design that loses exons or transcripts
+    new_panel_versions = set(design.panels) - existing_panel_versions
+    if new_panel_versions and connection.execute(db.select(User.id).where(User.id == user_id)).scalar() is None:
+        raise ValueError(
+            'User {0} for new panel versions does not exist, create the user first or set --user_id.'.format(user_id)
+        )
+    design_transcript_names = set(design.transcripts)
+    removed_exon_count = len(existing_design_exons - set(design.exons))
+    removed_transcript_count = sum(
+        1 for row in existing_transcripts.values()
+        if row.id in existing_design_transcripts and row.name not in design_transcript_names
+    )
+    if removed_exon_count or removed_transcript_count:
+        sample_count = connection.execute(
+            db.select(db.func.count(Sample.id)).where(Sample.design_id == design_id)
+        ).scalar()
+        if sample_count and not force:
+            raise ValueError((
+                'Design {0} has {1} samples, loading would remove {2} exons and {3} transcripts from it. '
+                'Load the design files as a new design (--design <new_name>) or use --force.'
+            ).format(design_name, sample_count, removed_exon_count, removed_transcript_count))
+
+    # Report rows not in design files
+    missing_exon_count = len(existing_exons - set(design.exons))
+    missing_transcript_count = len(set(existing_transcripts) - set(design.transcripts))
+    if missing_exon_count or missing_transcript_count:
+        log("Not in design files (kept): {0} exons, {1} transcripts.".format(missing_exon_count, missing_transcript_count))
+
+    # Genes, default transcripts are set after inserting transcripts.
+    start_time = time.monotonic()
+    gene_rows = [{'id': gene_id} for gene_id in sorted(design.genes) if gene_id not in existing_genes]
+    if not dry_run:
+        execute_chunks(connection, Gene.__table__.insert(), gene_rows)
+    stage('genes', len(gene_rows), start_time=start_time)
+
+    # Transcripts
+    start_time = time.monotonic()
+    transcript_rows = []
+    transcript_updates = []
+    for name, (chr, start, end, gene_id) in sorted(design.transcripts.items()):
+        existing_transcript = existing_transcripts.get(name)
+        if not existing_transcript:
+            transcript_rows.append({'name': name, 'chr': chr, 'start': start, 'end': end, 'gene_id': gene_id})
+            continue
+        if existing_transcript.chr == chr:  # Span exons of all designs
+            start = min(start, existing_transcript.start)
+            end = max(end, existing_transcript.end)
+        if (existing_transcript.chr, existing_transcript.start, existing_transcript.end, existing_transcript.gene_id) != (
+            chr, start, end, gene_id
+        ):
+            transcript_updates.append({
+                'transcript_id': existing_transcript.id, 'chr': chr, 'start': start, 'end': end, 'gene_id': gene_id
+            })
+    if not dry_run:
+        execute_chunks(connection, Transcript.__table__.insert(), transcript_rows)
+        execute_chunks(
+            connection,
+            Transcript.__table__.update().where(Transcript.id == bindparam('transcript_id')),
+            transcript_updates
+        )
+    stage('transcripts', len(transcript_rows), len(transcript_updates), start_time=start_time)
+
+    if dry_run:
+        transcript_ids = {name: row.id for name, row in existing_transcripts.items()}
+    else:
+        transcript_ids = dict(connection.execute(db.select(Transcript.name, Transcript.id)).all())
+
+    # Exons
+    start_time = time.monotonic()
+    exon_rows = [
+        {'id': exon_id, 'chr': chr, 'start': start, 'end': end}
+        for exon_id, (chr, start, end) in sorted(design.exons.items()) if exon_id not in existing_exons
+    ]
+    if not dry_run:
+        execute_chunks(connection, Exon.__table__.insert(), exon_rows)
+    stage('exons', len(exon_rows), start_time=start_time)
+
+    # Exons transcripts
+    start_time = time.monotonic()
+    exon_transcript_rows = []
+    for exon_id, transcript_name in sorted(design.exons_transcripts):
+        transcript_id = transcript_ids.get(transcript_name)
+        if transcript_id is None or (exon_id, transcript_id) not in existing_exons_transcripts:
+            exon_transcript_rows.append({'exon_id': exon_id, 'transcript_id': transcript_id})
+    if not dry_run:
+        execute_chunks(connection, exons_transcripts.insert(), exon_transcript_rows)
+    stage('exons_transcripts', len(exon_transcript_rows), start_time=start_time)
+
+    # Default transcripts
+    start_time = time.monotonic()
+    gene_updates = []
+    for gene_id, transcript_name in sorted(design.genes.items()):
+        default_transcript_id = transcript_ids.get(transcript_name) if transcript_name else None
+        if transcript_name and (default_transcript_id is None or existing_genes.get(gene_id) != default_transcript_id):
+            gene_updates.append({'gene_id': gene_id, 'default_transcript_id': default_transcript_id})
+    if not dry_run:
+        execute_chunks(
+            connection,
+            Gene.__table__.update().where(Gene.id == bindparam('gene_id')),
+            gene_updates
+        )
+    stage('default transcripts', updated=len(gene_updates), start_time=start_time)
+
+    # Design exons and transcripts, new designs are active if no other design exists.
+    if design_id is None and not dry_run:
+        first_design = connection.execute(db.select(Design.id)).first() is None
+        design_id = connection.execute(Design.__table__.insert().values(
+            name=design_name, exon_bed_file=design.exon_file, active=first_design
+        )).inserted_primary_key[0]
+        log("Created design {0}, active: {1}.".format(design_name, first_design))
+
+    start_time = time.monotonic()
+    design_exon_rows = [
+        {'design_id': design_id, 'exon_id': exon_id} for exon_id in sorted(set(design.exons) - existing_design_exons)
+    ]
+    removed_design_exons = [
+        {'remove_exon_id': exon_id} for exon_id in sorted(existing_design_exons - set(design.exons))
+    ]
+    if not dry_run:
+        execute_chunks(connection, designs_exons.insert(), design_exon_rows)
+        execute_chunks(
+            connection,
+            designs_exons.delete()
+            .where(designs_exons.c.design_id == design_id)
+            .where(designs_exons.c.exon_id == bindparam('remove_exon_id')),
+            removed_design_exons
+        )
+    stage('designs_exons', len(design_exon_rows), start_time=start_time)
+
+    start_time = time.monotonic()
+    design_transcripts = set(transcript_ids.get(transcript_name) for transcript_name in design.transcripts)
+    design_transcript_rows = [
+        {'design_id': design_id, 'transcript_id': transcript_id}
+        for transcript_id in sorted(design_transcripts - existing_design_transcripts, key=lambda id: id or 0)
+    ]
+    removed_design_transcripts = [
+        {'remove_transcript_id': transcript_id}
+        for transcript_id in sorted(existing_design_transcripts - design_transcripts)
+    ]
+    if not dry_run:
+        execute_chunks(connection, designs_transcripts.insert(), design_transcript_rows)
+        execute_chunks(
+            connection,
+            designs_transcripts.delete()
+            .where(designs_transcripts.c.design_id == design_id)
+            .where(designs_transcripts.c.transcript_id == bindparam('remove_transcript_id')),
+            removed_design_transcripts
+        )
+    stage('designs_transcripts', len(design_transcript_rows), start_time=start_time)
+    if removed_design_exons or removed_design_transcripts:
+        log("Removed from design {0}: {1} exons, {2} transcripts.".format(
+            design_name, len(removed_design_exons), len(removed_design_transcripts)
+        ))
+
+    # Panels, panel versions and panel transcripts
+    start_time = time.monotonic()
+    panel_rows = [
+        {'name': panel_name} for panel_name in sorted(set(key[0] for key in design.panels))
+        if panel_name not in existing_panels
+    ]
+    if not dry_run:
+        execute_chunks(connection, Panel.__table__.insert(), panel_rows)
+    stage('panels', len(panel_rows), start_time=start_time)
+
+    start_time = time.monotonic()
+    panel_version_rows = [
+        {
+            'panel_name': panel_name, 'version_year': version_year, 'version_revision': version_revision,
+            'active': True, 'validated': True, 'user_id': user_id
+        }
+        for panel_name, version_year, version_revision in sorted(new_panel_versions)
+    ]
+    if not dry_run:
+        execute_chunks(connection, PanelVersion.__table__.insert(), panel_version_rows)
+        panel_version_ids = {
+            (row.panel_name, row.version_year, row.version_revision): row.id for row in connection.execute(
+                db.select(PanelVersion.id, PanelVersion.panel_name, PanelVersion.version_year, PanelVersion.version_revision)
+            )
+        }
+    stage('panel_versions', len(panel_version_rows), start_time=start_time)
+
+    start_time = time.monotonic()
+    panel_transcript_rows = []
+    for panel_version in panel_version_rows:
+        key = (panel_version['panel_name'], panel_version['version_year'], panel_version['version_revision'])
+        for gene_id in sorted(design.panels[key]):
+            if design.genes.get(gene_id):
+                panel_transcript_rows.append({
+                    'panel_id': None if dry_run else panel_version_ids[key],
+                    'transcript_id': transcript_ids.get(design.genes[gene_id])
+                })
+            else:
+                log("WARNING: Unkown gene: {0}".format(gene_id))
+    if not dry_run:
+        execute_chunks(connection, panels_transcripts.insert(), panel_transcript_rows)
+    stage('panels_transcripts', len(panel_transcript_rows), start_time=start_time)
+
+    if dry_run:
+        db.session.rollback()
+    else:
+        bump_generations(connection, ['design', 'panels'])
+        db.session.commit()
+    return stats
@@ -1,24 +1,25 @@
 """Flask app forms."""
-import re
-
 from flask_wtf import FlaskForm
 from flask_security.forms import RegisterForm
 from wtforms.ext.sqlalchemy.fields import QuerySelectField
 from wtforms.fields import SelectField, TextAreaField, StringField, BooleanField, FloatField, SelectMultipleField
 from wtforms import validators
 
-from .models import Sample, SampleSet, Gene, GeneAlias, PanelVersion, Panel
+from . import db
+from .models import Sample, Gene, Panel, Transcript
+from .gene_resolver import gene_resolver
+from .reference_data import reference_data
 
 
 # Query factories
 def active_sample_sets():
     """Query factory for active sample sets."""
-    return SampleSet.query.filter_by(active=True).all()
+    return reference_data.sample_sets().active()
 
 
 def all_panels():
     """Query factory for all panels."""
-    return PanelVersion.query.filter_by(active=True).filter_by(validated=True).all()
+    return reference_data.panels().filter(active=True, validated=True)
 
 
 def get_id(object):
@@ -31,62 +32,59 @@ def get_sample(sample_id):
 
 def get_gene(gene_id):
     """Find gene or gene aliases."""
-    error = ''
-    gene = Gene.query.get(gene_id)
-
-    # Find possible gene alias if gene not found
-    if not gene:
-        gene_aliases = GeneAlias.query.filter_by(id=gene_id).all()
-        gene_case_differences = Gene.query.filter(Gene.id.ilike(gene_id)).all()
-        if gene_aliases:
-            error = 'Unkown gene: {0}. Possible aliases: {1}. Please check before using alias.'.format(
-                gene_id,
-                ', '.join([gene_alias.gene_id for gene_alias in gene_aliases])
-            )
-        elif gene_case_differences:
-            error = 'Unkown gene: {0}. Possible case difference: {1}. Please check before using suggestion.'.format(
-                gene_id,
-                ', '.join([gene.id for gene in gene_case_differences])
-            )
-        else:
-            try:
-                error = 'Unknown gene: {0}.'.format(gene_id)
-            except UnicodeEncodeError:
-                error = 'Unparsable gene in list, please remove special characters (e.g. alpha or beta).'
-
+    gene = None
+    resolved_gene_id, error = gene_resolver.resolve(gene_id)
+    if resolved_gene_id:
+        gene = db.session.get(Gene, resolved_gene_id)
     return gene, error
 
 
 def parse_gene_list(gene_list, transcripts=[]):
     """Parse data from gene_list form field"""
-    errors = []
-    for gene_id in re.split('[\n\r,;\t ]+', gene_list):
-        gene_id = gene_id.strip()
-        if gene_id:
-            gene, error = get_gene(gene_id)
-
-            if not gene:
-                errors.append(error)
-            elif gene.default_transcript in transcripts:
-                errors.append('Multiple entries for gene: {0}.'.format(gene_id))
-            else:
-                transcripts.append(gene.default_transcript)
+    errors, genes = gene_resolver.resolve_list(gene_list)
+    transcript_ids = set(transcript.id for transcript in transcripts)
+
+    # Load all default transcripts in one query
+    default_transcripts = {}
+    default_transcript_ids = [transcript_id for gene_id, transcript_id in genes if transcript_id]
+    if default_transcript_ids:
+        default_transcripts = {
+            transcript.id: transcript
+            for transcript in Transcript.query.filter(Transcript.id.in_(default_transcript_ids))
+        }
+
+    for gene_id, transcript_id in genes:
+        if transcript_id not in default_transcripts:
+            errors.append('No default transcript for gene: {0}.'.format(gene_id))
+        elif transcript_id in transcript_ids:
+            errors.append('Multiple entries for gene: {0}.'.format(gene_id))
+        else:
+            transcript_ids.add(transcript_id)
+            transcripts.append(default_transcripts[transcript_id])
     return errors, transcripts
 
 
 def parse_core_gene_list(gene_list, genes=[]):
     """Parse data from gene_list form field"""
-    errors = []
-    for gene_id in re.split('[\n\r,;\t ]+', gene_list):
-        gene_id = gene_id.strip()
-        if gene_id:
-            gene, error = get_gene(gene_id)
-            if not gene:
-                errors.append(error)
-            elif gene in genes:
-                errors.append('Multiple entries for gene: {0}.'.format(gene_id))
-            else:
-                genes.append(gene)
+    errors, resolved_genes = gene_resolver.resolve_list(gene_list)
+    gene_ids = set(gene.id for gene in genes)
+
+    # Load all genes in one query
+    resolved_gene_ids = [gene_id for gene_id, transcript_id in resolved_genes if gene_id not in gene_ids]
+    if resolved_gene_ids:
+        db_genes = {gene.id: gene for gene in Gene.query.filter(Gene.id.in_(resolved_gene_ids))}
+    else:
+        db_genes = {}
+
+    for gene_id, transcript_id in resolved_genes:
+        if gene_id in gene_ids:
+            errors.append('Multiple entries for gene: {0}.'.format(gene_id))
+        elif gene_id not in db_genes:
+            # Resolved from cached design data that is no longer in the database
+            errors.append('Unknown gene: {0}.'.format(gene_id))
+        else:
+            gene_ids.add(gene_id)
+            genes.append(db_genes[gene_id])
     return errors, genes
 
 
@@ -147,9 +145,9 @@ class CustomPanelNewForm(FlaskForm):
             self.sample_set.errors.append(message)
             return False
         elif self.samples.data and self.sample_set.data:
-            sample_ids = [sample.id for sample in self.samples.data]
-            for sample in self.sample_set.data.samples:
-                if sample.id in sample_ids:
+            sample_set_sample_ids = set(self.sample_set.data.sample_ids)
+            for sample in self.samples.data:
+                if sample.id in sample_set_sample_ids:
                     message = 'Sample {0} is already present in sample set.'.format(sample.name)
                     self.samples.errors.append(message)
                     return False
@@ -162,8 +160,8 @@ class CustomPanelNewForm(FlaskForm):
             return False
         else:
             if self.panel.data:
-                # Get panel transcript_ids
-                self.transcripts.extend([transcript for transcript in self.panel.data.transcripts])
+                # Get panel transcripts
+                self.transcripts.extend(Transcript.query.filter(Transcript.id.in_(self.panel.data.transcript_ids)).all())
 
             if self.gene_list.data:
                 # Parse gene_list
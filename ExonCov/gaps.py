@@ -0,0 +1,202 @@
+"""Coverage gaps, contiguous intervals of exon bases below coverage thresholds.
+
+import_bam computes gaps for COVERAGE_GAP_THRESHOLDS from per base coverage (sambamba depth base) and stores them per
+sample in a bgzipped, tabix indexed gap file (Sample.gap_file) with columns:
+    chr, start, end (0-based, half open), threshold, exon start, exon end, minimal coverage.
+The thresholds used at import are stored in a second header line: #thresholds=15,30
+Bases without coverage output have coverage 0. Gaps of one exon at a lower threshold lie within gaps at higher
+thresholds.
+"""
+from itertools import groupby
+from operator import itemgetter
+
+from . import metrics
+from .reference_data import reference_data
+from .region_query import exon_blocks
+
+HEADER = ['chr', 'start', 'end', 'threshold', 'exon_start', 'exon_end', 'min_coverage']
+THRESHOLDS_HEADER = '#thresholds='
+
+
+class ExonGaps(object):
+    """Gaps of one exon, add base coverage in position order."""
+
+    def __init__(self, chr, start, end, thresholds):
+        self.chr = chr
+        self.start = start
+        self.end = end
+        self.thresholds = thresholds
+        self.position = start  # Next base
+        self.open_gaps = {}  # threshold -> [gap start, minimal coverage]
+        self.gaps = []
+
+    def add_run(self, end, coverage):
+        """Add bases from the next base up to end with equal coverage."""
+        for threshold in self.thresholds:
+            if coverage < threshold:
+                if threshold in self.open_gaps:
+                    self.open_gaps[threshold][1] = min(self.open_gaps[threshold][1], coverage)
+                else:
+                    self.open_gaps[threshold] = [self.position, coverage]
+            elif threshold in self.open_gaps:
+                self.close_gap(threshold)
+        self.position = end
+
+    def close_gap(self, threshold):
+        gap_start, min_coverage = self.open_gaps.pop(threshold)
+        self.gaps.append((self.chr, gap_start, self.position, threshold, self.start, self.end, min_coverage))
+
+    def add(self, position, coverage):
+        """Add coverage of the base at position, skipped bases have coverage 0."""
+        if position < self.position or position >= self.end:
+            return
+        if position > self.position:
+            self.add_run(position, 0)
+        self.add_run(position + 1, coverage)
+
+    def finish(self):
+        """Return gaps, bases after the last added base have coverage 0."""
+        if self.position < self.end:
+            self.add_run(self.end, 0)
+        for threshold in sorted(self.open_gaps):
+            self.close_gap(threshold)
+        return self.gaps
+
+
+def stream_exons(exons, base_coverage, collectors):
+    """Feed per base coverage to the collectors of every exon in one pass.
+
+    exons: (chr, start, end) tuples, base_coverage: (chr, position, coverage) tuples in position order per chromosome,
+    collectors: {name: function(chr, start, end)} returning objects with add(position, coverage) and finish().
+    Yields ((chr, start, end), {name: finish() result}) per exon.
+    """
+    def start(exon):
+        return exon, {name: collector(*exon) for name, collector in collectors.items()}
+
+    def finish(exon, exon_collectors):
+        return exon, {name: collector.finish() for name, collector in exon_collectors.items()}
+
+    chromosome_exons = {}
+    for exon in sorted(set(exons), key=lambda exon: (exon[0], exon[1], exon[2])):
+        chromosome_exons.setdefault(exon[0], []).append(exon)
+
+    for chr, bases in groupby(base_coverage, key=itemgetter(0)):
+        chr_exons = chromosome_exons.pop(chr, [])
+        next_exon = 0
+        active_exons = []
+        for chr, position, coverage in bases:
+            while next_exon < len(chr_exons) and chr_exons[next_exon][1] <= position:
+                active_exons.append(start(chr_exons[next_exon]))
+                next_exon += 1
+            if any(exon[2] <= position for exon, exon_collectors in active_exons):
+                for exon, exon_collectors in active_exons:
+                    if exon[2] <= position:
+                        yield finish(exon, exon_collectors)
+                active_exons = [active_exon for active_exon in active_exons if active_exon[0][2] > position]
+            for exon, exon_collectors in active_exons:
+                for collector in exon_collectors.values():
+                    collector.add(position, coverage)
+        for active_exon in active_exons + [start(exon) for exon in chr_exons[next_exon:]]:
+            yield finish(*active_exon)
+
+    for chr_exons in chromosome_exons.values():  # Chromosomes without coverage output
+        for exon in chr_exons:
+            yield finish(*start(exon))
+
+
+def sort_gaps(gaps):
+    """Sort gap rows on chr, position and threshold."""
+    return sorted(gaps, key=lambda gap: (gap[0], gap[1], gap[2], gap[3]))
+
+
+def exon_gaps(exons, base_coverage, thresholds):
+    """Return gap rows sorted on chr and position.
+
+    exons: (chr, start, end) tuples, base_coverage: (chr, position, coverage) tuples in position order per chromosome.
+    """
+    collectors = {'gaps': lambda chr, start, end: ExonGaps(chr, start, end, thresholds)}
+    return sort_gaps(
+        gap for exon, results in stream_exons(exons, base_coverage, collectors) for gap in results['gaps']
+    )
+
+
+def read_depth_base(lines):
+    """Yield (chr, position, coverage) from sambamba depth base output."""
+    for line in lines:
+        if line.startswith(('REF', '#')):
+            continue
+        chr, position, coverage = line.split('\t', 3)[:3]
+        yield chr, int(position), int(coverage)
+
+
+def write_gap_file(path, gaps, thresholds):
+    """Write gap rows as tab delimited file with header and thresholds header line."""
+    with open(path, 'w') as gap_file:
+        gap_file.write('#{0}\n'.format('\t'.join(HEADER)))
+        gap_file.write('{0}{1}\n'.format(THRESHOLDS_HEADER, ','.join(str(threshold) for threshold in thresholds)))
+        for gap in gaps:
+            gap_file.write('{0}\n'.format('\t'.join(str(value) for value in gap)))
+
+
+def header_thresholds(gap_tabix):
+    """Return thresholds of an opened gap file, empty list if the file has no thresholds header line."""
+    for line in gap_tabix.header:
+        if line.startswith(THRESHOLDS_HEADER):
+            return [int(threshold) for threshold in line[len(THRESHOLDS_HEADER):].split(',') if threshold]
+    return []
+
+
+def read_thresholds(gap_file):
+    """Return thresholds the sample gap file was computed for."""
+    with metrics.tabix_file(gap_file) as gap_tabix:
+        return header_thresholds(gap_tabix)
+
+
+def read_gaps(gap_file, exons, threshold):
+    """Read gaps at threshold of exons (sorted ExonRecords) from a sample gap file.
+
+    Returns [gap dict with HEADER keys and exon_id] sorted on position, raises ValueError if the gap file was not
+    computed for threshold.
+    """
+    exon_ids = set(exon.id for exon in exons)
+    gaps = []
+    with metrics.tabix_file(gap_file) as gap_tabix:
+        thresholds = header_thresholds(gap_tabix)
+        if threshold not in thresholds:
+            raise ValueError('Threshold not in gap file thresholds ({0}): {1}.'.format(
+                ','.join(str(gap_threshold) for gap_threshold in thresholds), threshold
+            ))
+        contigs = set(gap_tabix.contigs)  # Chromosomes with gaps
+        for chr, start, end in exon_blocks(exons):
+            if chr not in contigs:
+                continue
+            for row in gap_tabix.fetch(chr, start, end):
+                row = row.split('\t')
+                exon_id = '{0}_{1}_{2}'.format(row[0], row[4], row[5])
+                if int(row[3]) == threshold and exon_id in exon_ids:
+                    gap = dict(zip(HEADER, [row[0]] + [int(value) for value in row[1:]]))
+                    gap['exon_id'] = exon_id
+                    gaps.append(gap)
+    return gaps
+
+
+def panel_gaps(sample, panel_version, threshold):
+    """Return gaps at threshold of the panel exons in the sample design, gaps list the panel transcripts of the exon.
+
+    Returns [gap dict (see read_gaps) with transcripts: [TranscriptRecord]] sorted on position, raises ValueError if
+    the sample gap file was not computed for threshold.
+    """
+    design = reference_data.design()
+    exon_transcripts = {}
+    for transcript_id in panel_version.transcript_ids:
+        transcript = design.transcripts[transcript_id]
+        for exon in design.transcript_exons(transcript, sample.design_id):
+            exon_transcripts.setdefault(exon.id, []).append(transcript)
+
+    exons = sorted(
+        (design.exons[exon_id] for exon_id in exon_transcripts), key=lambda exon: (exon.chr, exon.start, exon.end)
+    )
+    gaps = read_gaps(sample.gap_file, exons, threshold)
+    for gap in gaps:
+        gap['transcripts'] = exon_transcripts[gap['exon_id']]
+    return gaps
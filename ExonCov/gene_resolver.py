@@ -0,0 +1,57 @@
+"""In-memory gene and gene alias resolver, used to validate gene lists without per gene queries."""
+import re
+
+from .reference_data import reference_data
+
+
+class GeneResolver(object):
+    """Resolve gene ids using the exact, alias and case-folded lookup tables of the reference data cache."""
+
+    def resolve(self, gene_id):
+        """Find gene id, returns gene_id and error message."""
+        design = reference_data.design()
+        if gene_id in design.genes:
+            return gene_id, ''
+
+        # Find possible gene alias if gene not found
+        gene_aliases = design.aliases.get(gene_id)
+        gene_case_differences = design.case_folded.get(gene_id.casefold())
+        if gene_aliases:
+            error = 'Unkown gene: {0}. Possible aliases: {1}. Please check before using alias.'.format(
+                gene_id,
+                ', '.join(gene_aliases)
+            )
+        elif gene_case_differences:
+            error = 'Unkown gene: {0}. Possible case difference: {1}. Please check before using suggestion.'.format(
+                gene_id,
+                ', '.join(gene_case_differences)
+            )
+        else:
+            error = 'Unknown gene: {0}.'.format(gene_id)
+        return None, error
+
+    def resolve_list(self, gene_list):
+        """Resolve all genes in gene_list form field data.
+
+        Returns errors and list of (gene_id, default_transcript_id) tuples in input order.
+        """
+        design = reference_data.design()
+        errors = []
+        genes = []
+        seen = set()
+
+        for gene_id in re.split('[\n\r,;\t ]+', gene_list):
+            gene_id = gene_id.strip()
+            if gene_id:
+                resolved_gene_id, error = self.resolve(gene_id)
+                if not resolved_gene_id:
+                    errors.append(error)
+                elif resolved_gene_id in seen:
+                    errors.append('Multiple entries for gene: {0}.'.format(gene_id))
+                else:
+                    seen.add(resolved_gene_id)
+                    genes.append((resolved_gene_id, design.genes[resolved_gene_id].default_transcript_id))
+        return errors, genes
+
+
+gene_resolver = GeneResolver()
@@ -0,0 +1,227 @@
+"""Cohort wide low coverage index.
+
+For every sample and coverage threshold the exons and transcripts with less than 100% of bases covered at the
+threshold are stored as sorted fixed width binary arrays:
+    exons: chromosome (2 bytes, space padded, like Exon.chr), start and end (unsigned 32 bit big endian), zlib
+    compressed. Exons with longer chromosome names are not indexed (pack_exon raises ValueError) instead of truncated.
+    transcripts: transcript id (unsigned 32 bit big endian), zlib compressed.
+Big endian packing keeps byte order equal to sort order, lookups are binary searches on the decompressed array.
+"""
+from bisect import bisect_left
+import struct
+import zlib
+
+from . import db, metrics
+from .models import LowCoverageIndex, Sample, SampleProject, TranscriptMeasurement
+from .reference_data import reference_data
+
+THRESHOLDS = (10, 15, 20, 30, 50, 100)
+
+exon_struct = struct.Struct('>2sII')
+transcript_struct = struct.Struct('>I')
+
+
+def measurement_type(threshold):
+    """Return measurement column name for threshold."""
+    return 'measurement_percentage{0}'.format(threshold)
+
+
+def indexable_exon(exon_id):
+    """Return True if the exon chromosome name fits the index (2 characters)."""
+    return len(exon_id.rsplit('_', 2)[0]) <= 2
+
+
+def pack_exon(exon_id):
+    """Pack chr_start_end exon id, raises ValueError for chromosome names longer than 2 characters."""
+    chr, start, end = exon_id.rsplit('_', 2)
+    if len(chr) > 2:
+        raise ValueError('Chromosome name longer than 2 characters, can not index exon: {0}.'.format(exon_id))
+    return exon_struct.pack(chr.rjust(2).encode('ascii'), int(start), int(end))
+
+
+def unpack_exon(packed_exon):
+    """Unpack exon to chr_start_end exon id."""
+    chr, start, end = exon_struct.unpack(packed_exon)
+    return '{0}_{1}_{2}'.format(chr.decode('ascii').strip(), start, end)
+
+
+def pack_exons(exon_ids):
+    return zlib.compress(b''.join(sorted(pack_exon(exon_id) for exon_id in exon_ids)))
+
+
+def pack_transcripts(transcript_ids):
+    return zlib.compress(b''.join(transcript_struct.pack(transcript_id) for transcript_id in sorted(transcript_ids)))
+
+
+class PackedArray(object):
+    """Sorted fixed width binary array supporting binary search."""
+
+    def __init__(self, data, record_size):
+        self.data = zlib.decompress(data)
+        self.record_size = record_size
+
+    def __len__(self):
+        return len(self.data) // self.record_size
+
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self):
+            raise IndexError(index)
+        return self.data[index * self.record_size:(index + 1) * self.record_size]
+
+    def __contains__(self, record):
+        index = bisect_left(self, record)
+        return index < len(self) and self[index] == record
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def build_index_rows(sample_id, exon_measurements, transcript_measurements, log=print):
+    """Build low coverage index rows for a sample, exons with chromosome names longer than 2 characters are skipped.
+
+    exon_measurements: {exon_id: {measurement_type: value}}
+    transcript_measurements: {transcript_id: {measurement_type: value}}
+    """
+    skipped_exon_ids = sorted(exon_id for exon_id in exon_measurements if not indexable_exon(exon_id))
+    if skipped_exon_ids:
+        log("WARNING: {0} exons with chromosome names longer than 2 characters not in low coverage index: {1}".format(
+            len(skipped_exon_ids), ', '.join(skipped_exon_ids[:5]) + (', ...' if len(skipped_exon_ids) > 5 else '')
+        ))
+    rows = []
+    for threshold in THRESHOLDS:
+        key = measurement_type(threshold)
+        exon_ids = [
+            exon_id for exon_id, exon in exon_measurements.items() if exon[key] < 100 and indexable_exon(exon_id)
+        ]
+        transcript_ids = [
+            transcript_id for transcript_id, transcript in transcript_measurements.items() if transcript[key] < 100
+        ]
+        rows.append({
+            'sample_id': sample_id,
+            'threshold': threshold,
+            'exon_count': len(exon_ids),
+            'transcript_count': len(transcript_ids),
+            'exons': pack_exons(exon_ids),
+            'transcripts': pack_transcripts(transcript_ids),
+        })
+    return rows
+
+
+def read_exon_measurements(exon_measurement_file):
+    """Read exon measurements from sample tabix file."""
+    exon_measurements = {}
+    with metrics.tabix_file(exon_measurement_file) as sample_tabix:
+        header = sample_tabix.header[0].lstrip('#').split('\t')
+        for row in sample_tabix.fetch():
+            row = dict(zip(header, row.split('\t')))
+            exon_id = '{0}_{1}_{2}'.format(row['chr'], row['start'], row['end'])
+            exon_measurements[exon_id] = {
+                measurement_type(threshold): float(row[measurement_type(threshold)]) for threshold in THRESHOLDS
+            }
+    return exon_measurements
+
+
+def index_sample(sample):
+    """(Re)build low coverage index for an imported sample using the exon file and transcript measurements."""
+    exon_measurements = read_exon_measurements(sample.exon_measurement_file)
+    transcript_measurements = {
+        row.transcript_id: {measurement_type(threshold): getattr(row, measurement_type(threshold)) for threshold in THRESHOLDS}
+        for row in db.session.query(
+            TranscriptMeasurement.transcript_id,
+            *[getattr(TranscriptMeasurement, measurement_type(threshold)) for threshold in THRESHOLDS]
+        ).filter(TranscriptMeasurement.sample_id == sample.id)
+    }
+
+    LowCoverageIndex.query.filter_by(sample_id=sample.id).delete()
+    db.session.bulk_insert_mappings(
+        LowCoverageIndex, build_index_rows(sample.id, exon_measurements, transcript_measurements)
+    )
+    db.session.commit()
+
+
+def query_low_coverage(threshold, exon_ids=None, transcript_ids=None, project=None, min_date=None, max_date=None):
+    """Find samples with low coverage for exons and/or transcripts at threshold.
+
+    Yields (sample_id, sample_name, project_name, import_date, low_exon_ids, low_transcript_ids) for samples with at
+    least one matching exon or transcript.
+    """
+    packed_exons = {pack_exon(exon_id): exon_id for exon_id in exon_ids or []}
+    packed_transcripts = {transcript_struct.pack(transcript_id): transcript_id for transcript_id in transcript_ids or []}
+
+    query = (
+        db.session.query(
+            Sample.id, Sample.name, SampleProject.name, Sample.import_date,
+            LowCoverageIndex.exons if packed_exons else LowCoverageIndex.exon_count,
+            LowCoverageIndex.transcripts if packed_transcripts else LowCoverageIndex.transcript_count,
+        )
+        .join(LowCoverageIndex, LowCoverageIndex.sample_id == Sample.id)
+        .join(SampleProject, Sample.project_id == SampleProject.id)
+        .filter(LowCoverageIndex.threshold == threshold)
+        .order_by(Sample.import_date.desc(), Sample.name)
+    )
+    if project:
+        query = query.filter(SampleProject.name.like('%{0}%'.format(project)))
+    if min_date:
+        query = query.filter(Sample.import_date >= min_date)
+    if max_date:
+        query = query.filter(Sample.import_date <= max_date)
+
+    for sample_id, sample_name, project_name, import_date, exons, transcripts in query.yield_per(500):
+        low_exon_ids = []
+        low_transcript_ids = []
+        if packed_exons:
+            exons = PackedArray(exons, exon_struct.size)
+            low_exon_ids = [exon_id for packed_exon, exon_id in packed_exons.items() if packed_exon in exons]
+        if packed_transcripts:
+            transcripts = PackedArray(transcripts, transcript_struct.size)
+            low_transcript_ids = [
+                transcript_id for packed_transcript, transcript_id in packed_transcripts.items()
+                if packed_transcript in transcripts
+            ]
+        if low_exon_ids or low_transcript_ids:
+            yield sample_id, sample_name, project_name, import_date, low_exon_ids, low_transcript_ids
+
+
+def resolve_targets(exons=(), transcripts=(), genes=(), panels=()):
+    """Resolve exon ids (chr_start_end), transcript names, gene ids and panels (name_version) to index keys.
+
+    Returns exon_ids, transcript_ids and errors.
+    """
+    design = reference_data.design()
+    exon_ids = []
+    transcript_ids = []
+    errors = []
+
+    for exon_id in exons:
+        if exon_id not in design.exons:
+            errors.append('Unknown exon: {0}.'.format(exon_id))
+        elif not indexable_exon(exon_id):
+            errors.append('Exon not indexed, chromosome name longer than 2 characters: {0}.'.format(exon_id))
+        else:
+            exon_ids.append(exon_id)
+
+    for transcript_name in transcripts:
+        transcript = design.transcript_by_name(transcript_name)
+        if transcript:
+            transcript_ids.append(transcript.id)
+        else:
+            errors.append('Unknown transcript: {0}.'.format(transcript_name))
+
+    for gene_id in genes:
+        gene = design.genes.get(gene_id)
+        if gene:
+            transcript_ids.extend(gene.transcript_ids)
+        else:
+            errors.append('Unknown gene: {0}.'.format(gene_id))
+
+    panel_versions = {
+        panel_version.name_version: panel_version for panel_version in reference_data.panels().panel_versions.values()
+    }
+    for panel_name_version in panels:
+        if panel_name_version in panel_versions:
+            transcript_ids.extend(panel_versions[panel_name_version].transcript_ids)
+        else:
+            errors.append('Unknown panel: {0}.'.format(panel_name_version))
+
+    return exon_ids, sorted(set(transcript_ids)), errors
@@ -0,0 +1,195 @@
+"""Prometheus style metrics.
+
+Every process (gunicorn worker or CLI command) keeps counters, gauges and histograms in memory. Workers write their
+values to <METRICS_PATH>/<pid>.json at most every METRICS_FLUSH_INTERVAL seconds, CLI commands (import_bam) add their
+values to <METRICS_PATH>/cli.json under a file lock. The metrics endpoint sums all files, gauges are only read from
+files written in the last 3 flush intervals. Clear METRICS_PATH when the service starts.
+"""
+import fcntl
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy.pool import QueuePool
+
+REQUEST_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+POOL_BUCKETS = (0.0001, 0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+IMPORT_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'exoncov_request_duration_seconds': ('histogram', 'Request duration per endpoint.', REQUEST_BUCKETS),
+    'exoncov_db_pool_checkout_seconds': ('histogram', 'Database pool connection checkout duration.', POOL_BUCKETS),
+    'exoncov_db_pool_checked_out': ('gauge', 'Checked out database connections per worker.', None),
+    'exoncov_tabix_open_total': ('counter', 'Opened sample tabix files.', None),
+    'exoncov_cache_requests_total': ('counter', 'Cache lookups per cache and result (hit or miss).', None),
+    'exoncov_import_stage_seconds': ('histogram', 'import_bam stage duration.', IMPORT_BUCKETS),
+    'exoncov_imports_total': ('counter', 'Imported samples.', None),
+}
+
+
+class Registry(object):
+    """Metric values of this process, {(name, labels): value}, histogram values are [bucket counts, sum, count]."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.flush_time = time.monotonic()
+
+    def increment(self, name, labels=(), value=1):
+        key = (name, tuple(sorted(labels)))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, labels=()):
+        with self.lock:
+            self.values[(name, tuple(sorted(labels)))] = value
+
+    def observe(self, name, value, labels=()):
+        key = (name, tuple(sorted(labels)))
+        buckets = METRICS[name][2]
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(buckets), 0.0, 0]
+            histogram = self.values[key]
+            for index, bucket in enumerate(buckets):
+                if value <= bucket:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def entries(self):
+        """Return [[name, labels, value]], json serializable."""
+        with self.lock:
+            return json.loads(json.dumps([[name, labels, value] for (name, labels), value in self.values.items()]))
+
+    def clear(self):
+        with self.lock:
+            self.values = {}
+
+
+registry = Registry()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording connection checkout duration, includes waiting for a free connection."""
+
+    def connect(self):
+        start_time = time.perf_counter()
+        connection = super().connect()
+        registry.observe('exoncov_db_pool_checkout_seconds', time.perf_counter() - start_time)
+        return connection
+
+
+def tabix_file(exon_measurement_file):
+    """Open sample tabix file and count opened files."""
+    import pysam  # Not needed by most CLI commands
+    registry.increment('exoncov_tabix_open_total')
+    return pysam.TabixFile(exon_measurement_file)
+
+
+def cache_lookup(cache, hit):
+    """Count cache hit or miss."""
+    registry.increment('exoncov_cache_requests_total', [('cache', cache), ('result', 'hit' if hit else 'miss')])
+
+
+def write_json(path, data):
+    """Write json to path using a temporary file and rename."""
+    file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(file_descriptor, 'w') as temp_file:
+        json.dump(data, temp_file)
+    os.replace(temp_path, path)
+
+
+def read_json(path):
+    """Read json list from path, returns [] for missing or incomplete files."""
+    try:
+        with open(path) as metrics_file:
+            return json.load(metrics_file)
+    except (OSError, ValueError):
+        return []
+
+
+def flush(metrics_path, pool=None):
+    """Write metrics of this worker process to metrics_path."""
+    if pool is not None:
+        registry.set('exoncov_db_pool_checked_out', pool.checkedout(), [('worker', str(os.getpid()))])
+    os.makedirs(metrics_path, exist_ok=True)
+    write_json(os.path.join(metrics_path, '{0}.json'.format(os.getpid())), registry.entries())
+    registry.flush_time = time.monotonic()
+
+
+def flush_cli(metrics_path):
+    """Add metrics of this CLI process to the shared CLI metrics file and clear them."""
+    os.makedirs(metrics_path, exist_ok=True)
+    with open(os.path.join(metrics_path, 'cli.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        path = os.path.join(metrics_path, 'cli.json')
+        write_json(path, aggregate([read_json(path), registry.entries()]))
+    registry.clear()
+
+
+def aggregate(entry_lists):
+    """Sum counters and histograms of entry lists, returns [[name, labels, value]]."""
+    values = {}
+    for entries in entry_lists:
+        for name, labels, value in entries:
+            key = (name, tuple(tuple(label) for label in labels))
+            if key not in values:
+                values[key] = value
+            elif isinstance(value, list):
+                values[key] = [
+                    [count + other_count for count, other_count in zip(values[key][0], value[0])],
+                    values[key][1] + value[1],
+                    values[key][2] + value[2],
+                ]
+            else:
+                values[key] += value
+    return [[name, labels, value] for (name, labels), value in sorted(values.items())]
+
+
+def read_metrics(metrics_path, gauge_timeout):
+    """Read and aggregate metrics files, gauges are skipped for files older than gauge_timeout seconds."""
+    entry_lists = []
+    for path in glob.glob(os.path.join(metrics_path, '*.json')):
+        entries = read_json(path)
+        try:
+            stale = time.time() - os.path.getmtime(path) > gauge_timeout
+        except OSError:
+            continue
+        if stale:
+            entries = [entry for entry in entries if METRICS.get(entry[0], ('gauge',))[0] != 'gauge']
+        entry_lists.append(entries)
+    return aggregate(entry_lists)
+
+
+def format_labels(labels, extra_labels=()):
+    labels = list(labels) + list(extra_labels)
+    if not labels:
+        return ''
+    return '{{{0}}}'.format(','.join(
+        '{0}="{1}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels
+    ))
+
+
+def render(entries):
+    """Return prometheus text exposition format for aggregated entries."""
+    lines = []
+    for name, (metric_type, help, buckets) in sorted(METRICS.items()):
+        metric_entries = [entry for entry in entries if entry[0] == name]
+        lines.append('# HELP {0} {1}'.format(name, help))
+        lines.append('# TYPE {0} {1}'.format(name, metric_type))
+        for entry_name, labels, value in metric_entries:
+            if metric_type == 'histogram':
+                bucket_counts, total, count = value
+                for bucket, bucket_count in zip(buckets, bucket_counts):
+                    lines.append('{0}_bucket{1} {2}'.format(name, format_labels(labels, [('le', bucket)]), bucket_count))
+                lines.append('{0}_bucket{1} {2}'.format(name, format_labels(labels, [('le', '+Inf')]), count))
+                lines.append('{0}_sum{1} {2}'.format(name, format_labels(labels), total))
+                lines.append('{0}_count{1} {2}'.format(name, format_labels(labels), count))
+            else:
+                lines.append('{0}{1} {2}'.format(name, format_labels(labels), value))
+    return '\n'.join(lines) + '\n'
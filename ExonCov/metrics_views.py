@@ -0,0 +1,37 @@
+"""ExonCov metrics route and request instrumentation, see metrics.py."""
+import time
+
+from flask import Response, g, request
+from flask_security import auth_required, roles_required
+
+from . import app, db, metrics
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start_time = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    if 'request_start_time' in g:
+        metrics.registry.observe(
+            'exoncov_request_duration_seconds',
+            time.perf_counter() - g.request_start_time,
+            [('endpoint', request.endpoint or 'unknown'), ('method', request.method)]
+        )
+    if app.config['METRICS_PATH'] and time.monotonic() - metrics.registry.flush_time > app.config['METRICS_FLUSH_INTERVAL']:
+        metrics.flush(app.config['METRICS_PATH'], db.engine.pool)
+    return response
+
+
+@app.route('/metrics')
+@auth_required('token', 'session')
+@roles_required('site_admin')
+def metrics_text():
+    """Prometheus text endpoint, aggregated over all workers and CLI imports. Scrapers can use an authentication token."""
+    if not app.config['METRICS_PATH']:
+        return Response("Metrics disabled, set METRICS_PATH.\n", status=404, mimetype='text/plain')
+    metrics.flush(app.config['METRICS_PATH'], db.engine.pool)
+    entries = metrics.read_metrics(app.config['METRICS_PATH'], 3 * app.config['METRICS_FLUSH_INTERVAL'])
+    return Response(metrics.render(entries), mimetype='text/plain; version=0.0.4')
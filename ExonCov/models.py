@@ -5,10 +5,24 @@ import datetime
 from flask_security import UserMixin, RoleMixin
 from sqlalchemy import UniqueConstraint
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.dialects.mysql import BIGINT
+from sqlalchemy.dialects.mysql import BIGINT, VARCHAR
 
 from . import db
 
+# Portable column types, MySQL types are used as dialect variants so the schema can also be created in SQLite.
+unsigned_bigint = db.BigInteger().with_variant(BIGINT(unsigned=True), 'mysql').with_variant(db.Integer(), 'sqlite')
+
+
+def case_sensitive_string(length):
+    """String with utf8_bin collation on MySQL, SQLite compares strings binary by default."""
+    return db.String(length).with_variant(VARCHAR(length, collation='utf8_bin'), 'mysql')
+
+
+def count_rows(table, where):
+    """Correlated scalar subquery counting table rows matching where, SQL counterpart of len(relationship)."""
+    return db.select(db.func.count()).select_from(table).where(where).scalar_subquery()
+
+
 # Association tables
 exons_transcripts = db.Table(
     'exons_transcripts',
@@ -52,6 +66,18 @@ roles_users = db.Table(
     db.Column('role_id', db.ForeignKey('role.id'), primary_key=True)
 )
 
+designs_exons = db.Table(
+    'designs_exons',
+    db.Column('design_id', db.ForeignKey('designs.id'), primary_key=True),
+    db.Column('exon_id', db.ForeignKey('exons.id'), primary_key=True)
+)
+
+designs_transcripts = db.Table(
+    'designs_transcripts',
+    db.Column('design_id', db.ForeignKey('designs.id'), primary_key=True),
+    db.Column('transcript_id', db.ForeignKey('transcripts.id'), primary_key=True)
+)
+
 samples_sequencingRun = db.Table(
     'samples_sequencingRun',
     db.Column('sample_id', db.ForeignKey('samples.id'), primary_key=True),
@@ -59,6 +85,29 @@ samples_sequencingRun = db.Table(
 )
 
 
+class Design(db.Model):
+    """Exon design class, samples are measured against the exons (bed file) of one design."""
+
+    __tablename__ = 'designs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False, unique=True)
+    exon_bed_file = db.Column(db.String(255))  # Uses EXON_BED_FILE if empty
+    active = db.Column(db.Boolean, index=True, default=False)  # Used for new imports
+    created_date = db.Column(db.Date(), default=datetime.date.today)
+    comments = db.Column(db.Text())
+
+    exons = db.relationship('Exon', secondary=designs_exons)
+    transcripts = db.relationship('Transcript', secondary=designs_transcripts)
+    samples = db.relationship('Sample', back_populates='design')
+
+    def __repr__(self):
+        return "Design({0})".format(self.name)
+
+    def __str__(self):
+        return self.name
+
+
 class Exon(db.Model):
     """Exon class."""
 
@@ -90,10 +139,11 @@ class Transcript(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False, index=True, unique=True)
+    # Design independent, spans the transcript exons of all designs (see design_loader.py)
     chr = db.Column(db.String(2), nullable=False)  # Based on exon.chr
     start = db.Column(db.Integer(), nullable=False)  # Based on smallest exon.start
     end = db.Column(db.Integer(), nullable=False)  # Based on largest exon.end
-    gene_id = db.Column(db.String(50, collation='utf8_bin'), db.ForeignKey('genes.id'), index=True)
+    gene_id = db.Column(case_sensitive_string(50), db.ForeignKey('genes.id'), index=True)
 
     exons = db.relationship('Exon', secondary=exons_transcripts, back_populates='transcripts')
     gene = db.relationship('Gene', backref='transcripts', foreign_keys=[gene_id])
@@ -112,13 +162,18 @@ class Transcript(db.Model):
         """Count number of exons."""
         return len(self.exons)
 
+    @exon_count.expression
+    def exon_count(cls):
+        """Count number of exons in SQL, use in list queries without loading exons."""
+        return count_rows(exons_transcripts, exons_transcripts.c.transcript_id == cls.id)
+
 
 class Gene(db.Model):
     """Gene class."""
 
     __tablename__ = 'genes'
 
-    id = db.Column(db.String(50, collation='utf8_bin'), primary_key=True)  # HGNC
+    id = db.Column(case_sensitive_string(50), primary_key=True)  # HGNC
     default_transcript_id = db.Column(
         db.Integer(),
         db.ForeignKey('transcripts.id', name='default_transcript_foreign_key'),
@@ -139,8 +194,8 @@ class GeneAlias(db.Model):
 
     __tablename__ = 'gene_aliases'
 
-    id = db.Column(db.String(50, collation='utf8_bin'), primary_key=True)  # HGNC
-    gene_id = db.Column(db.String(50, collation='utf8_bin'), db.ForeignKey('genes.id'), primary_key=True)
+    id = db.Column(case_sensitive_string(50), primary_key=True)  # HGNC
+    gene_id = db.Column(case_sensitive_string(50), db.ForeignKey('genes.id'), primary_key=True)
 
     gene = db.relationship('Gene', backref='aliases', foreign_keys=[gene_id])
 
@@ -222,6 +277,11 @@ class PanelVersion(db.Model):
         """Calculate number of genes."""
         return len(self.transcripts)
 
+    @gene_count.expression
+    def gene_count(cls):
+        """Count number of genes in SQL, use in list queries without loading transcripts."""
+        return count_rows(panels_transcripts, panels_transcripts.c.panel_id == cls.id)
+
 
 class CustomPanel(db.Model):
     """Custom panel class."""
@@ -253,11 +313,39 @@ class CustomPanel(db.Model):
         """Calculate number of genes."""
         return len(self.transcripts)
 
+    @gene_count.expression
+    def gene_count(cls):
+        """Count number of genes in SQL, use in list queries without loading transcripts."""
+        return count_rows(custom_panels_transcripts, custom_panels_transcripts.c.custom_panel_id == cls.id)
+
     @hybrid_property
     def sample_count(self):
-        """Calculate number of genes."""
+        """Calculate number of samples."""
         return len(self.samples)
 
+    @sample_count.expression
+    def sample_count(cls):
+        """Count number of samples in SQL, use in list queries without loading samples."""
+        return count_rows(custom_panels_samples, custom_panels_samples.c.custom_panel_id == cls.id)
+
+
+class CustomPanelSnapshot(db.Model):
+    """Page of a validated custom panel, frozen at validation (see reports.py).
+
+    page: panel, gene or transcript, name: gene id or transcript name ('' for the panel page).
+    """
+
+    __tablename__ = 'custom_panel_snapshots'
+
+    custom_panel_id = db.Column(db.Integer, db.ForeignKey('custom_panels.id'), primary_key=True)
+    page = db.Column(db.String(50), primary_key=True)
+    name = db.Column(case_sensitive_string(255), primary_key=True)
+    created_date = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False)
+    data = db.Column(db.LargeBinary(length=2**24), nullable=False)  # zlib compressed json
+
+    def __repr__(self):
+        return "CustomPanelSnapshot({0}-{1}-{2})".format(self.custom_panel_id, self.page, self.name)
+
 
 class Sample(db.Model):
     """Sample class."""
@@ -271,13 +359,24 @@ class Sample(db.Model):
     import_command = db.Column(db.Text(), nullable=False)
     project_id = db.Column(db.Integer(), db.ForeignKey('sample_projects.id'), nullable=False, index=True)
     exon_measurement_file = db.Column(db.Text(), nullable=False)
+    gap_file = db.Column(db.Text())  # Coverage gaps (see gaps.py), None if not computed at import
     type = db.Column(db.String(255), nullable=False)
+    design_id = db.Column(
+        db.Integer(), db.ForeignKey('designs.id', name='samples_design_foreign_key'), nullable=False, index=True
+    )
 
     transcript_measurements = db.relationship('TranscriptMeasurement', cascade="all,delete", back_populates='sample')
+    design = db.relationship('Design', back_populates='samples')
     project = db.relationship('SampleProject', back_populates='samples')
     sequencing_runs = db.relationship('SequencingRun', secondary=samples_sequencingRun, backref=db.backref('samples'))
     custom_panels = db.relationship('CustomPanel', secondary=custom_panels_samples, back_populates='samples')
     sets = db.relationship('SampleSet', secondary=sample_sets_samples, back_populates='samples')
+    low_coverage_index = db.relationship('LowCoverageIndex', cascade="all,delete", back_populates='sample')
+
+    __table_args__ = (
+        # Sample overview keyset pagination, ordered as the overview (import_date DESC, name, id)
+        db.Index('ix_samples_import_date_name_id', db.desc('import_date'), 'name', 'id'),
+    )
 
     def __repr__(self):
         return "Sample({0})".format(self.name)
@@ -307,9 +406,14 @@ class SampleSet(db.Model):
 
     @hybrid_property
     def sample_count(self):
-        """Calculate number of genes."""
+        """Calculate number of samples."""
         return len(self.samples)
 
+    @sample_count.expression
+    def sample_count(cls):
+        """Count number of samples in SQL, use in list queries without loading samples."""
+        return count_rows(sample_sets_samples, sample_sets_samples.c.sample_set_id == cls.id)
+
 
 class SampleProject(db.Model):
     """Sample Project"""
@@ -357,7 +461,7 @@ class TranscriptMeasurement(db.Model):
 
     __tablename__ = 'transcript_measurements'
 
-    id = db.Column(BIGINT(unsigned=True), primary_key=True)
+    id = db.Column(unsigned_bigint, primary_key=True)
     len = db.Column(db.Integer)  # Store length used to calculate weighted average
     measurement_mean_coverage = db.Column(db.Float)
     measurement_percentage10 = db.Column(db.Float)
@@ -387,6 +491,88 @@ class TranscriptMeasurement(db.Model):
         return getattr(self, item)
 
 
+class LowCoverageIndex(db.Model):
+    """Low coverage index, stores exons and transcripts with less than 100% coverage at threshold per sample.
+
+    exons: sorted packed exon positions, transcripts: sorted packed transcript ids (see low_coverage.py).
+    """
+
+    __tablename__ = 'low_coverage_index'
+
+    sample_id = db.Column(db.Integer, db.ForeignKey('samples.id'), primary_key=True)
+    threshold = db.Column(db.Integer, primary_key=True, index=True)
+    exon_count = db.Column(db.Integer, nullable=False)
+    transcript_count = db.Column(db.Integer, nullable=False)
+    exons = db.Column(db.LargeBinary(length=2**24), nullable=False)
+    transcripts = db.Column(db.LargeBinary(length=2**24), nullable=False)
+
+    sample = db.relationship('Sample', back_populates='low_coverage_index')
+
+    def __repr__(self):
+        return "LowCoverageIndex({0}-{1})".format(self.sample_id, self.threshold)
+
+
+class CoverageSketch(db.Model):
+    """Quantile sketch of a transcript measurement for all samples of a type imported in one year.
+
+    bins: sorted packed (bin, count) pairs (see sketches.py), sketches of several years are merged on use.
+    mean, m2: running mean and sum of squared differences from the mean (Welford), for cohort z-scores.
+    """
+
+    __tablename__ = 'coverage_sketches'
+
+    transcript_id = db.Column(db.Integer, db.ForeignKey('transcripts.id'), primary_key=True)
+    sample_type = db.Column(db.String(255), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    measurement_type = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+    bins = db.Column(db.LargeBinary(length=2**16), nullable=False)
+    mean = db.Column(db.Double)
+    m2 = db.Column(db.Double)
+
+    def __repr__(self):
+        return "CoverageSketch({0}-{1}-{2}-{3})".format(
+            self.transcript_id, self.sample_type, self.year, self.measurement_type
+        )
+
+
+class CacheGeneration(db.Model):
+    """Cache generation counters, incremented on reference data changes to invalidate worker caches."""
+    __tablename__ = 'cache_generations'
+
+    name = db.Column(db.String(50), primary_key=True)  # design, panels or sample_sets
+    generation = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return "CacheGeneration({0}={1})".format(self.name, self.generation)
+
+
+class Report(db.Model):
+    """Precomputed sample set or custom panel report, computed by the report worker (see reports.py).
+
+    input_key: hash of the report inputs (samples, panels or transcripts), reports are reused until it changes.
+    """
+    __tablename__ = 'reports'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)  # sample_set, custom_panel or custom_panel_snapshot
+    object_id = db.Column(db.Integer, nullable=False)
+    input_key = db.Column(db.String(40), nullable=False)
+    status = db.Column(db.String(20), nullable=False, index=True)  # queued, running, done or failed
+    progress = db.Column(db.Float, nullable=False, default=0)
+    result = db.Column(db.Text(length=2**24))  # json
+    error = db.Column(db.Text())
+    created_date = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False)
+    updated_date = db.Column(db.DateTime, default=datetime.datetime.now, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('kind', 'object_id'),  # Reports contain all measurement types
+    )
+
+    def __repr__(self):
+        return "Report({0}-{1})".format(self.kind, self.object_id)
+
+
 class EventLog(db.Model):
     """Store database events"""
     __tablename__ = 'event_logs'
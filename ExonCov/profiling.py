@@ -0,0 +1,131 @@
+"""Per request SQL profiling.
+
+A fraction (SQL_PROFILE_SAMPLE_RATE) of requests is profiled: every statement is timed and grouped on its normalized
+text (literals and placeholder lists replaced). Profiles exceeding a threshold are written as one json line to the
+sql_profile child of the flask app logger, SQL_PROFILE_LOG_FILE adds a file handler. Statement shapes executed at least
+SQL_PROFILE_REPEATED_STATEMENTS times in one request are reported as repeated (N+1) statements.
+"""
+import json
+import logging
+import random
+import re
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy.engine import Engine
+
+from . import app, db
+
+logger = app.logger.getChild('sql_profile')
+logger.setLevel(logging.INFO)
+if app.config.get('SQL_PROFILE_LOG_FILE'):
+    log_handler = logging.FileHandler(app.config['SQL_PROFILE_LOG_FILE'])
+    log_handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(log_handler)
+
+NORMALIZE_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),  # String literals
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),  # Numbers
+    (re.compile(r'%\(\w+\)s|%s|:\w+'), '?'),  # Placeholders
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?)'),  # IN lists
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def normalize_statement(statement):
+    """Return statement with literals, placeholders and IN lists replaced by ?."""
+    for pattern, replacement in NORMALIZE_PATTERNS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+class RequestProfile(object):
+    """SQL statements executed during one request, grouped on normalized statement."""
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.query_count = 0
+        self.sql_time = 0.0
+        self.statements = {}  # normalized statement -> [count, total time, max time]
+
+    def add(self, statement, duration):
+        self.query_count += 1
+        self.sql_time += duration
+        shape = normalize_statement(statement)
+        if shape not in self.statements:
+            self.statements[shape] = [0, 0.0, 0.0]
+        shape_stats = self.statements[shape]
+        shape_stats[0] += 1
+        shape_stats[1] += duration
+        shape_stats[2] = max(shape_stats[2], duration)
+
+    def slowest(self, number):
+        """Return slowest statement shapes, sorted on max duration."""
+        return sorted(self.statements.items(), key=lambda statement: statement[1][2], reverse=True)[:number]
+
+    def repeated(self, min_count):
+        """Return statement shapes executed at least min_count times, sorted on count."""
+        return sorted(
+            [statement for statement in self.statements.items() if statement[1][0] >= min_count],
+            key=lambda statement: statement[1][0], reverse=True
+        )
+
+
+def current_profile():
+    """Return profile of current request or None."""
+    if has_request_context():
+        return g.get('sql_profile')
+    return None
+
+
+@db.event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_profile():
+        conn.info.setdefault('sql_profile_start', []).append(time.perf_counter())
+
+
+@db.event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = current_profile()
+    if profile and conn.info.get('sql_profile_start'):
+        profile.add(statement, time.perf_counter() - conn.info['sql_profile_start'].pop())
+
+
+@app.before_request
+def start_sql_profile():
+    if random.random() < app.config['SQL_PROFILE_SAMPLE_RATE']:
+        g.sql_profile = RequestProfile()
+
+
+@app.after_request
+def log_sql_profile(response):
+    profile = current_profile()
+    if not profile:
+        return response
+
+    slowest = profile.slowest(app.config['SQL_PROFILE_SLOWEST_STATEMENTS'])
+    repeated = profile.repeated(app.config['SQL_PROFILE_REPEATED_STATEMENTS'])
+    if (
+        profile.query_count >= app.config['SQL_PROFILE_QUERY_COUNT'] or
+        profile.sql_time >= app.config['SQL_PROFILE_SQL_TIME'] or
+        (slowest and slowest[0][1][2] >= app.config['SQL_PROFILE_SLOW_STATEMENT']) or
+        repeated
+    ):
+        logger.info(json.dumps({
+            'endpoint': request.endpoint,
+            'method': request.method,
+            'path': request.full_path,
+            'status': response.status_code,
+            'duration': round(time.perf_counter() - profile.start_time, 4),
+            'query_count': profile.query_count,
+            'sql_time': round(profile.sql_time, 4),
+            'slowest': [
+                {'statement': statement, 'count': count, 'max_time': round(max_time, 4)}
+                for statement, (count, total_time, max_time) in slowest
+            ],
+            'repeated': [
+                {'statement': statement, 'count': count, 'total_time': round(total_time, 4)}
+                for statement, (count, total_time, max_time) in repeated
+            ],
+        }))
+    return response
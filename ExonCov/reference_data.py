@@ -0,0 +1,385 @@
+"""Worker level reference data cache.
+
+Genes, transcripts, exons, panels and sample sets change rarely. They are loaded once per worker process into
+compact immutable records and reloaded lazily when the matching generation counter in the cache_generations table
+changes. Generation counters are incremented in the same transaction as the change (see bump_generations).
+"""
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+from flask import g, has_app_context
+from sqlalchemy import inspect
+
+from . import db, metrics
+from .models import (
+    CacheGeneration, Design, Exon, Gene, GeneAlias, Transcript, Panel, PanelVersion, Sample, SampleSet,
+    designs_exons, designs_transcripts, exons_transcripts, panels_transcripts, panels_core_genes, sample_sets_samples
+)
+
+
+# Records
+class ExonRecord(namedtuple('ExonRecord', ['id', 'chr', 'start', 'end'])):
+    """Immutable exon record."""
+    __slots__ = ()
+
+    @property
+    def len(self):
+        """Calculate exon length."""
+        return self.end - self.start
+
+    def __str__(self):
+        return "{0}:{1}-{2}".format(self.chr, self.start, self.end)
+
+
+class TranscriptRecord(namedtuple('TranscriptRecord', ['id', 'name', 'chr', 'start', 'end', 'gene_id', 'exon_ids'])):
+    """Immutable transcript record, exon_ids sorted on exon start."""
+    __slots__ = ()
+
+    @property
+    def exon_count(self):
+        """Count number of exons."""
+        return len(self.exon_ids)
+
+    def __str__(self):
+        return self.name
+
+
+class GeneRecord(namedtuple('GeneRecord', ['id', 'default_transcript_id', 'transcript_ids'])):
+    """Immutable gene record."""
+    __slots__ = ()
+
+    def __str__(self):
+        return self.id
+
+
+class DesignRecord(namedtuple('DesignRecord', ['id', 'name', 'exon_bed_file', 'active', 'exon_ids', 'transcript_ids'])):
+    """Immutable design record, exon_ids and transcript_ids are frozensets."""
+    __slots__ = ()
+
+    def __str__(self):
+        return self.name
+
+
+class PanelVersionRecord(namedtuple('PanelVersionRecord', [
+    'id', 'panel_name', 'version_year', 'version_revision', 'active', 'validated', 'comments',
+    'coverage_requirement_15', 'created_date', 'release_date', 'disease_description_nl', 'transcript_ids',
+    'core_gene_ids'
+])):
+    """Immutable panel version record."""
+    __slots__ = ()
+
+    @property
+    def version(self):
+        """Return version."""
+        return "{0}.{1}".format(self.version_year, self.version_revision)
+
+    @property
+    def name_version(self):
+        """Return panel and version."""
+        return "{0}v{1}".format(self.panel_name, self.version)
+
+    @property
+    def gene_count(self):
+        """Calculate number of genes."""
+        return len(self.transcript_ids)
+
+    def __str__(self):
+        return self.name_version
+
+
+class SampleSetRecord(namedtuple('SampleSetRecord', ['id', 'name', 'date', 'description', 'active', 'sample_ids'])):
+    """Immutable sample set record."""
+    __slots__ = ()
+
+    @property
+    def sample_count(self):
+        """Calculate number of samples."""
+        return len(self.sample_ids)
+
+    def __str__(self):
+        return self.name
+
+
+# Interval index
+class ExonIntervalIndex(object):
+    """Exon interval index, per chromosome exons sorted on start with running maximum end.
+
+    Overlap queries bisect on start and walk back while the running maximum end overlaps the query, which only
+    visits exons that can overlap.
+    """
+
+    def __init__(self, exons):
+        self.chromosomes = {}  # chr -> (starts, ends, max_ends, exon_ids)
+        chromosome_exons = {}
+        for exon in exons:
+            chromosome_exons.setdefault(exon.chr, []).append(exon)
+
+        for chr, chr_exons in chromosome_exons.items():
+            chr_exons.sort(key=lambda exon: (exon.start, exon.end))
+            starts = array('l', (exon.start for exon in chr_exons))
+            ends = array('l', (exon.end for exon in chr_exons))
+            max_ends = array('l', ends)
+            for index in range(1, len(max_ends)):
+                max_ends[index] = max(max_ends[index], max_ends[index - 1])
+            self.chromosomes[chr] = (starts, ends, max_ends, tuple(exon.id for exon in chr_exons))
+
+    def overlap(self, chr, start, end):
+        """Return exon ids overlapping half open interval [start, end) sorted on start."""
+        if chr not in self.chromosomes:
+            return []
+        starts, ends, max_ends, exon_ids = self.chromosomes[chr]
+        overlap = []
+        index = bisect_left(starts, end) - 1
+        while index >= 0 and max_ends[index] > start:
+            if ends[index] > start:
+                overlap.append(exon_ids[index])
+            index -= 1
+        overlap.reverse()
+        return overlap
+
+
+# Reference data
+class DesignData(object):
+    """Designs, genes, gene aliases, transcripts and exons."""
+
+    def __init__(self):
+        self.designs = {}  # design_id -> DesignRecord
+        self.exons = {}  # exon_id -> ExonRecord
+        self.transcripts = {}  # transcript_id -> TranscriptRecord
+        self.transcript_names = {}  # transcript name -> transcript_id
+        self.genes = {}  # gene_id -> GeneRecord
+        self.aliases = {}  # alias -> (gene_id, ...)
+        self.case_folded = {}  # casefolded gene_id -> (gene_id, ...)
+        self.exon_index = None  # ExonIntervalIndex
+
+        for exon_id, chr, start, end in db.session.query(Exon.id, Exon.chr, Exon.start, Exon.end):
+            self.exons[exon_id] = ExonRecord(exon_id, chr, start, end)
+
+        transcript_exons = {}
+        for exon_id, transcript_id in db.session.query(exons_transcripts.c.exon_id, exons_transcripts.c.transcript_id):
+            transcript_exons.setdefault(transcript_id, []).append(exon_id)
+
+        gene_transcripts = {}
+        transcript_query = db.session.query(
+            Transcript.id, Transcript.name, Transcript.chr, Transcript.start, Transcript.end, Transcript.gene_id
+        )
+        for transcript_id, name, chr, start, end, gene_id in transcript_query:
+            exon_ids = tuple(sorted(transcript_exons.get(transcript_id, []), key=lambda exon_id: self.exons[exon_id].start))
+            self.transcripts[transcript_id] = TranscriptRecord(transcript_id, name, chr, start, end, gene_id, exon_ids)
+            self.transcript_names[name] = transcript_id
+            gene_transcripts.setdefault(gene_id, []).append(transcript_id)
+
+        case_folded = {}
+        for gene_id, default_transcript_id in db.session.query(Gene.id, Gene.default_transcript_id):
+            self.genes[gene_id] = GeneRecord(gene_id, default_transcript_id, tuple(gene_transcripts.get(gene_id, [])))
+            case_folded.setdefault(gene_id.casefold(), []).append(gene_id)
+        self.case_folded = {key: tuple(value) for key, value in case_folded.items()}
+
+        aliases = {}
+        for alias_id, gene_id in db.session.query(GeneAlias.id, GeneAlias.gene_id):
+            aliases.setdefault(alias_id, []).append(gene_id)
+        self.aliases = {key: tuple(value) for key, value in aliases.items()}
+
+        self.exon_index = ExonIntervalIndex(self.exons.values())
+
+        design_exons = {}
+        for design_id, exon_id in db.session.query(designs_exons.c.design_id, designs_exons.c.exon_id):
+            design_exons.setdefault(design_id, []).append(exon_id)
+        design_transcripts = {}
+        for design_id, transcript_id in db.session.query(
+            designs_transcripts.c.design_id, designs_transcripts.c.transcript_id
+        ):
+            design_transcripts.setdefault(design_id, []).append(transcript_id)
+        for row in db.session.query(Design.id, Design.name, Design.exon_bed_file, Design.active):
+            self.designs[row.id] = DesignRecord(
+                *row,
+                exon_ids=frozenset(design_exons.get(row.id, [])),
+                transcript_ids=frozenset(design_transcripts.get(row.id, []))
+            )
+
+    def transcript_by_name(self, name):
+        """Return TranscriptRecord or None."""
+        transcript_id = self.transcript_names.get(name)
+        if transcript_id is not None:
+            return self.transcripts[transcript_id]
+
+    def transcript_exons(self, transcript, design_id=None):
+        """Return ExonRecords for a transcript, limited to the exons of a design if design_id is given."""
+        if design_id is None:
+            return [self.exons[exon_id] for exon_id in transcript.exon_ids]
+        design_exon_ids = self.designs[design_id].exon_ids
+        return [self.exons[exon_id] for exon_id in transcript.exon_ids if exon_id in design_exon_ids]
+
+
+class PanelData(object):
+    """Panel versions including transcript and core gene membership."""
+
+    def __init__(self):
+        self.panel_versions = {}  # panel_version_id -> PanelVersionRecord
+
+        panel_transcripts = {}
+        for panel_id, transcript_id in db.session.query(panels_transcripts.c.panel_id, panels_transcripts.c.transcript_id):
+            panel_transcripts.setdefault(panel_id, []).append(transcript_id)
+
+        panel_core_genes = {}
+        for panel_id, gene_id in db.session.query(panels_core_genes.c.panel_id, panels_core_genes.c.gene_id):
+            panel_core_genes.setdefault(panel_id, []).append(gene_id)
+
+        panel_query = (
+            db.session.query(
+                PanelVersion.id, PanelVersion.panel_name, PanelVersion.version_year, PanelVersion.version_revision,
+                PanelVersion.active, PanelVersion.validated, PanelVersion.comments, PanelVersion.coverage_requirement_15,
+                PanelVersion.created_date, PanelVersion.release_date, Panel.disease_description_nl
+            )
+            .join(Panel)
+            .order_by(PanelVersion.panel_name, PanelVersion.id)
+        )
+        for row in panel_query:
+            self.panel_versions[row.id] = PanelVersionRecord(
+                *row,
+                transcript_ids=tuple(sorted(panel_transcripts.get(row.id, []))),
+                core_gene_ids=frozenset(panel_core_genes.get(row.id, []))
+            )
+
+    def filter(self, active=None, validated=None):
+        """Return PanelVersionRecords sorted on panel name."""
+        return [
+            panel_version for panel_version in self.panel_versions.values()
+            if (active is None or panel_version.active == active)
+            and (validated is None or panel_version.validated == validated)
+        ]
+
+
+class SampleSetData(object):
+    """Sample sets including sample membership."""
+
+    def __init__(self):
+        self.sample_sets = {}  # sample_set_id -> SampleSetRecord
+
+        sample_set_samples = {}
+        for sample_set_id, sample_id in db.session.query(
+            sample_sets_samples.c.sample_set_id, sample_sets_samples.c.sample_id
+        ):
+            sample_set_samples.setdefault(sample_set_id, []).append(sample_id)
+
+        sample_set_query = db.session.query(
+            SampleSet.id, SampleSet.name, SampleSet.date, SampleSet.description, SampleSet.active
+        ).order_by(SampleSet.id)
+        for row in sample_set_query:
+            self.sample_sets[row.id] = SampleSetRecord(*row, sample_ids=tuple(sample_set_samples.get(row.id, [])))
+
+    def active(self):
+        """Return active SampleSetRecords."""
+        return [sample_set for sample_set in self.sample_sets.values() if sample_set.active]
+
+
+class ReferenceDataCache(object):
+    """Per worker cache, reloads data when the database generation counter changed."""
+
+    loaders = {
+        'design': DesignData,
+        'panels': PanelData,
+        'sample_sets': SampleSetData,
+    }
+
+    def __init__(self):
+        self.data = {}  # name -> (generation, data)
+
+    def get(self, name):
+        generation = get_generations().get(name, 0)
+        cached = self.data.get(name)
+        metrics.cache_lookup(name, cached and cached[0] == generation)
+        if not cached or cached[0] != generation:
+            cached = (generation, self.loaders[name]())
+            self.data[name] = cached  # Swap complete object, never expose partially loaded data.
+        return cached[1]
+
+    def design(self):
+        """Return DesignData."""
+        return self.get('design')
+
+    def panels(self):
+        """Return PanelData."""
+        return self.get('panels')
+
+    def sample_sets(self):
+        """Return SampleSetData."""
+        return self.get('sample_sets')
+
+
+reference_data = ReferenceDataCache()
+
+
+# Generation counters
+def get_generations():
+    """Return generation counters, queried at most once per request or app context."""
+    if 'cache_generations' not in g:
+        g.cache_generations = dict(db.session.query(CacheGeneration.name, CacheGeneration.generation))
+    return g.cache_generations
+
+
+def bump_generations(connection, names):
+    """Increment generation counters, use on the connection of the transaction that changes the data."""
+    table = CacheGeneration.__table__
+    for name in names:
+        result = connection.execute(
+            table.update().where(table.c.name == name).values(generation=table.c.generation + 1)
+        )
+        if not result.rowcount:
+            connection.execute(table.insert().values(name=name, generation=1))
+
+    if has_app_context():
+        g.pop('cache_generations', None)
+
+
+# Model -> (generation name, relationships that do not change reference data)
+generation_models = {
+    Design: ('design', ['samples']),
+    Exon: ('design', ['transcripts']),
+    Transcript: ('design', ['panels', 'custom_panels', 'transcript_measurements']),
+    Gene: ('design', []),
+    GeneAlias: ('design', []),
+    Panel: ('panels', []),
+    PanelVersion: ('panels', []),
+    SampleSet: ('sample_sets', []),
+}
+
+# Model -> {relationship: generation name}, relationships that change reference data of another generation
+generation_relationships = {
+    Transcript: {'panels': 'panels'},  # panels_transcripts changed from the transcript side
+    Sample: {'sets': 'sample_sets'},  # sample_sets_samples changed from the sample side
+}
+
+# Model -> generation name, deleting the model changes reference data of another generation
+generation_deletes = {
+    Sample: 'sample_sets',  # Removes sample_sets_samples rows
+}
+
+
+def changed_generations(session):
+    """Return generation names changed by pending session changes."""
+    names = set()
+    for obj in list(session.new) + list(session.deleted):
+        if type(obj) in generation_models:
+            names.add(generation_models[type(obj)][0])
+
+    for obj in session.deleted:
+        if type(obj) in generation_deletes:
+            names.add(generation_deletes[type(obj)])
+
+    for obj in session.dirty:
+        if type(obj) in generation_models:
+            name, ignore = generation_models[type(obj)]
+            if name not in names:
+                state = inspect(obj)
+                if any(attr.history.has_changes() for attr in state.attrs if attr.key not in ignore):
+                    names.add(name)
+
+    for obj in list(session.new) + list(session.dirty):
+        if type(obj) in generation_relationships:
+            state = inspect(obj)
+            for key, name in generation_relationships[type(obj)].items():
+                if name not in names and state.attrs[key].history.has_changes():
+                    names.add(name)
+    return names
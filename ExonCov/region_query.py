@@ -0,0 +1,105 @@
+"""Query exon measurements for genomic regions across samples.
+
+Regions are resolved to design exons with the in-memory exon interval index. Sample exon files are read in batches:
+per sample the requested exons are grouped in blocks and every block is fetched once from the tabix file.
+"""
+import re
+
+from . import metrics
+from .reference_data import reference_data
+
+BLOCK_GAP = 100000  # Merge exons closer than this into one tabix fetch.
+MEASUREMENT_TYPES = (
+    'measurement_mean_coverage', 'measurement_percentage10', 'measurement_percentage15', 'measurement_percentage20',
+    'measurement_percentage30', 'measurement_percentage50', 'measurement_percentage100'
+)
+
+
+def parse_regions(regions):
+    """Parse chr:start-end or tab/space separated bed lines.
+
+    Returns list of (chr, start, end) tuples and errors.
+    """
+    parsed_regions = []
+    errors = []
+    for line in re.split('[\n\r;]+', regions):
+        line = line.strip()
+        if not line or line.startswith(('#', 'track', 'browser')):
+            continue
+        fields = re.split(r'[:\-\t ]+', line.replace(',', ''))
+        try:
+            chr, start, end = fields[0], int(fields[1]), int(fields[2])
+        except (IndexError, ValueError):
+            errors.append('Invalid region: {0}.'.format(line))
+            continue
+        if start >= end:
+            errors.append('Invalid region: {0}.'.format(line))
+            continue
+        parsed_regions.append((re.sub('^chr', '', chr, flags=re.IGNORECASE), start, end))
+    return parsed_regions, errors
+
+
+def region_exons(regions):
+    """Return {(chr, start, end): [exon_id, ...]} for regions."""
+    exon_index = reference_data.design().exon_index
+    return {region: exon_index.overlap(*region) for region in regions}
+
+
+def exon_blocks(exons):
+    """Group sorted ExonRecords into fetch blocks, yields (chr, start, end)."""
+    block = None
+    for exon in exons:
+        if block and block[0] == exon.chr and exon.start - block[2] <= BLOCK_GAP:
+            block[2] = max(block[2], exon.end)
+        else:
+            if block:
+                yield tuple(block)
+            block = [exon.chr, exon.start, exon.end]
+    if block:
+        yield tuple(block)
+
+
+def read_sample_exons(exon_measurement_file, exons, measurement_types):
+    """Read measurements for exons (sorted ExonRecords) from a sample tabix file.
+
+    Returns {exon_id: {measurement_type: value}}.
+    """
+    exon_ids = set(exon.id for exon in exons)
+    measurements = {}
+    with metrics.tabix_file(exon_measurement_file) as sample_tabix:
+        header = sample_tabix.header[0].lstrip('#').split('\t')
+        columns = [(header.index(measurement_type), measurement_type) for measurement_type in measurement_types]
+        for chr, start, end in exon_blocks(exons):
+            for row in sample_tabix.fetch(chr, start, end):
+                row = row.split('\t')
+                exon_id = '{0}_{1}_{2}'.format(row[0], row[1], row[2])
+                if exon_id in exon_ids:
+                    measurements[exon_id] = {
+                        measurement_type: float(row[index]) for index, measurement_type in columns
+                    }
+    return measurements
+
+
+def query_regions(regions, samples, measurement_types):
+    """Query exon measurements for regions in samples.
+
+    Returns {(chr, start, end): [exon_id, ...]} and {sample_id: {exon_id: {measurement_type: value}}}, measurements
+    are None for samples with a missing or unreadable exon measurement file.
+    """
+    design = reference_data.design()
+    exons_per_region = region_exons(regions)
+    exons = sorted(
+        set(design.exons[exon_id] for exon_ids in exons_per_region.values() for exon_id in exon_ids),
+        key=lambda exon: (exon.chr, exon.start, exon.end)
+    )
+
+    sample_measurements = {}
+    for sample in samples:
+        if not exons:
+            sample_measurements[sample.id] = {}
+            continue
+        try:
+            sample_measurements[sample.id] = read_sample_exons(sample.exon_measurement_file, exons, measurement_types)
+        except IOError:
+            sample_measurements[sample.id] = None
+    return exons_per_region, sample_measurements
@@ -0,0 +1,551 @@
+"""Precomputed sample set and custom panel reports.
+
+Reports are stored in the reports table, one row per report kind and object. A report contains all measurement types,
+computed in one pass, pages switch measurement type client side. The table is also the job queue: pages queue a report
+and poll its progress, the report worker (flask --app ExonCov db report_worker) claims queued reports and stores the
+result as json. Small reports (REPORT_INLINE_SAMPLES) are computed in the request. A stored report is reused until its
+input key, a hash of the samples and panels or transcripts, changes.
+
+Validating a custom panel queues a custom_panel_snapshot job, the report worker freezes its panel, gene and transcript
+pages in the custom_panel_snapshots table. Pages of validated custom panels are served from the snapshot.
+"""
+import datetime
+import hashlib
+import json
+from operator import getitem
+import time
+import zlib
+
+from flask import g
+from sqlalchemy.exc import IntegrityError
+
+from . import app, db, metrics
+from .models import (
+    CustomPanel, CustomPanelSnapshot, Report, Sample, TranscriptMeasurement, custom_panels_samples,
+    custom_panels_transcripts, sample_sets_samples
+)
+from .reference_data import reference_data
+from .region_query import MEASUREMENT_TYPES
+from .utils import get_summary_stats, weighted_average
+
+
+def summary_stats(values):
+    """Return min, max and mean of values, missing (None) values are skipped."""
+    values = [value for value in values if value is not None]
+    if not values:
+        return None, None, None
+    return get_summary_stats(values)
+
+
+def sample_records(sample_ids):
+    """Return [{'id', 'name'}] sorted on sample id."""
+    samples = db.session.query(Sample.id, Sample.name).filter(Sample.id.in_(sample_ids)).order_by(Sample.id)
+    return [{'id': sample.id, 'name': sample.name} for sample in samples]
+
+
+def transcript_measurements(sample_ids, transcript_ids, progress):
+    """Yield (sample_id, transcript_id, len, measurement types...) rows per chunk of REPORT_SAMPLE_CHUNK samples.
+
+    Reports progress after every chunk.
+    """
+    chunk_size = app.config['REPORT_SAMPLE_CHUNK']
+    for index in range(0, len(sample_ids), chunk_size):
+        chunk = sample_ids[index:index + chunk_size]
+        yield from db.session.query(
+            TranscriptMeasurement.sample_id,
+            TranscriptMeasurement.transcript_id,
+            TranscriptMeasurement.len,
+            *[getattr(TranscriptMeasurement, measurement_type) for measurement_type in MEASUREMENT_TYPES]
+        ).filter(TranscriptMeasurement.sample_id.in_(chunk)).filter(TranscriptMeasurement.transcript_id.in_(transcript_ids))
+        progress(min(index + chunk_size, len(sample_ids)) / len(sample_ids))
+
+
+def weighted_measurement(measurements, measurement_type):
+    """Return length weighted average of transcript measurement rows, None without rows."""
+    if not measurements:
+        return None
+    return weighted_average(
+        values=[getattr(measurement, measurement_type) for measurement in measurements],
+        weights=[measurement.len for measurement in measurements]
+    )
+
+
+def summary(values):
+    """Return {'values', 'min', 'max', 'mean'}."""
+    summary_min, summary_max, summary_mean = summary_stats(values)
+    return {'values': values, 'min': summary_min, 'max': summary_max, 'mean': summary_mean}
+
+
+def measurement_summaries(samples, measurements, get_value=getattr):
+    """Return {measurement_type: summary} of {sample_id: measurement} in sample order, missing samples are None."""
+    return {
+        measurement_type: summary([
+            get_value(measurements[sample['id']], measurement_type) if sample['id'] in measurements else None
+            for sample in samples
+        ])
+        for measurement_type in MEASUREMENT_TYPES
+    }
+
+
+def no_progress(fraction):
+    pass
+
+
+# Sample set report
+def sample_set_inputs(sample_set_id):
+    """Return sample ids and active validated panel versions of a sample set report."""
+    sample_ids = sorted(
+        sample_id for sample_id, in
+        db.session.query(sample_sets_samples.c.sample_id).filter(sample_sets_samples.c.sample_set_id == sample_set_id)
+    )
+    panel_versions = sorted(
+        reference_data.panels().filter(active=True, validated=True), key=lambda panel_version: panel_version.name_version
+    )
+    return sample_ids, panel_versions
+
+
+def sample_set_key(sample_set_id):
+    sample_ids, panel_versions = sample_set_inputs(sample_set_id)
+    return sample_ids, [
+        [
+            panel_version.id, panel_version.disease_description_nl, panel_version.coverage_requirement_15,
+            sorted(panel_version.transcript_ids)
+        ]
+        for panel_version in panel_versions
+    ]
+
+
+def compute_sample_set(sample_set_id, progress):
+    """Weighted panel measurement per sample for all active validated panels and all measurement types."""
+    sample_ids, panel_versions = sample_set_inputs(sample_set_id)
+    transcript_ids = set()
+    for panel_version in panel_versions:
+        transcript_ids.update(panel_version.transcript_ids)
+
+    measurements = {}  # sample_id -> {transcript_id: measurement row}
+    for measurement in transcript_measurements(sample_ids, transcript_ids, progress):
+        measurements.setdefault(measurement.sample_id, {})[measurement.transcript_id] = measurement
+
+    samples = sample_records(sample_ids)
+    panels = []
+    for panel_version in panel_versions:
+        panel_measurements = [  # Per sample: transcript measurement rows of the panel
+            [
+                measurements[sample['id']][transcript_id] for transcript_id in panel_version.transcript_ids
+                if transcript_id in measurements.get(sample['id'], {})
+            ]
+            for sample in samples
+        ]
+        if not any(panel_measurements):
+            continue
+        panels.append({
+            'id': panel_version.id,
+            'name_version': panel_version.name_version,
+            'description': panel_version.disease_description_nl,
+            'coverage_requirement_15': panel_version.coverage_requirement_15,
+            'measurement_types': {
+                measurement_type: summary([
+                    weighted_measurement(sample_measurements, measurement_type)
+                    for sample_measurements in panel_measurements
+                ])
+                for measurement_type in MEASUREMENT_TYPES
+            },
+        })
+    return {'samples': samples, 'panels': panels}
+
+
+# Custom panel report
+def custom_panel_inputs(custom_panel_id):
+    """Return sample ids and transcript ids of a custom panel report."""
+    sample_ids = sorted(
+        sample_id for sample_id, in
+        db.session.query(custom_panels_samples.c.sample_id)
+        .filter(custom_panels_samples.c.custom_panel_id == custom_panel_id)
+    )
+    transcript_ids = sorted(
+        transcript_id for transcript_id, in
+        db.session.query(custom_panels_transcripts.c.transcript_id)
+        .filter(custom_panels_transcripts.c.custom_panel_id == custom_panel_id)
+    )
+    return sample_ids, transcript_ids
+
+
+def custom_panel_key(custom_panel_id):
+    return custom_panel_inputs(custom_panel_id)
+
+
+def compute_custom_panel(custom_panel_id, progress):
+    """Transcript measurements, weighted panel measurement and fully covered genes per sample, all measurement types."""
+    sample_ids, transcript_ids = custom_panel_inputs(custom_panel_id)
+    measurements = {}  # transcript_id -> {sample_id: measurement row}
+    panel_measurements = {}  # sample_id -> [measurement row]
+    for measurement in transcript_measurements(sample_ids, transcript_ids, progress):
+        measurements.setdefault(measurement.transcript_id, {})[measurement.sample_id] = measurement
+        panel_measurements.setdefault(measurement.sample_id, []).append(measurement)
+
+    samples = sample_records(sample_ids)
+    design_transcripts = reference_data.design().transcripts
+    transcripts = sorted(
+        (design_transcripts[transcript_id] for transcript_id in measurements),
+        key=lambda transcript: (transcript.gene_id, transcript.name)
+    )
+    report = {
+        'samples': samples,
+        'panel': {'measurement_types': {}},
+        'transcripts': [
+            {'name': transcript.name, 'gene_id': transcript.gene_id, 'measurement_types': {}}
+            for transcript in transcripts
+        ],
+        'sample_stats': {},  # Per measurement type and sample: complete genes, [incomplete gene, measurement]
+    }
+    for measurement_type in MEASUREMENT_TYPES:
+        sample_stats = [[[], []] for sample in samples]
+        for transcript, transcript_report in zip(transcripts, report['transcripts']):
+            values = [
+                getattr(measurements[transcript.id][sample['id']], measurement_type)
+                if sample['id'] in measurements[transcript.id] else None
+                for sample in samples
+            ]
+            transcript_report['measurement_types'][measurement_type] = summary(values)
+            label = '{0}({1})'.format(transcript.gene_id, transcript.name)
+            for index, value in enumerate(values):
+                if value == 100:
+                    sample_stats[index][0].append(label)
+                elif value is not None:
+                    sample_stats[index][1].append([label, value])
+        report['sample_stats'][measurement_type] = sample_stats
+        report['panel']['measurement_types'][measurement_type] = summary([
+            weighted_measurement(panel_measurements.get(sample['id']), measurement_type) for sample in samples
+        ])
+    return report
+
+
+# Custom panel gene and transcript pages
+def exon_measurements(sample_ids, transcripts, strict=False):
+    """Return {exon_id: {sample_id: {measurement_type: value}}} for transcript exons in the sample designs.
+
+    Measurements are read from the sample exon measurement files, returns {} if a file can not be opened or raises the
+    IOError if strict is set.
+    """
+    design = reference_data.design()
+    measurements = {}
+    samples = (
+        db.session.query(Sample.id, Sample.design_id, Sample.exon_measurement_file)
+        .filter(Sample.id.in_(sample_ids))
+        .order_by(Sample.id)
+    )
+    for sample in samples:
+        try:
+            sample_tabix = metrics.tabix_file(sample.exon_measurement_file)
+        except IOError:
+            if strict:
+                raise
+            return {}
+        with sample_tabix:
+            header = sample_tabix.header[0].lstrip('#').split('\t')
+            exons = {
+                exon.id: exon
+                for transcript in transcripts for exon in design.transcript_exons(transcript, sample.design_id)
+            }
+            for exon in exons.values():
+                sample_measurements = measurements.setdefault(exon.id, {})
+                for row in sample_tabix.fetch(exon.chr, exon.start, exon.end):
+                    row = dict(zip(header, row.split('\t')))
+                    if int(row['start']) == exon.start and int(row['end']) == exon.end:
+                        sample_measurements[sample.id] = {
+                            measurement_type: float(row[measurement_type]) for measurement_type in MEASUREMENT_TYPES
+                        }
+                        break
+    return measurements
+
+
+def transcript_page(samples, transcript, measurements, exon_measurements):
+    """Return transcript page: transcript and exon measurement summaries for all measurement types.
+
+    measurements: {sample_id: transcript measurement row}, exon_measurements: see exon_measurements.
+    """
+    design = reference_data.design()
+    return {
+        'samples': samples,
+        'name': transcript.name,
+        'gene_id': transcript.gene_id,
+        'measurement_types': measurement_summaries(samples, measurements),
+        'exons': [
+            {
+                'chr': exon.chr,
+                'start': exon.start,
+                'end': exon.end,
+                'measurement_types': measurement_summaries(samples, exon_measurements[exon.id], getitem),
+            }
+            for exon in design.transcript_exons(transcript) if exon.id in exon_measurements
+        ],
+    }
+
+
+def gene_page(samples, gene, measurements):
+    """Return gene page: measurement summaries of gene transcripts with measurements for all measurement types.
+
+    measurements: {transcript_id: {sample_id: transcript measurement row}}.
+    """
+    design = reference_data.design()
+    transcripts = sorted(
+        (design.transcripts[transcript_id] for transcript_id in gene.transcript_ids if transcript_id in measurements),
+        key=lambda transcript: transcript.name
+    )
+    default_transcript = design.transcripts.get(gene.default_transcript_id)
+    return {
+        'samples': samples,
+        'id': gene.id,
+        'default_transcript': default_transcript.name if default_transcript else None,
+        'transcripts': [
+            {'name': transcript.name, 'measurement_types': measurement_summaries(samples, measurements[transcript.id])}
+            for transcript in transcripts
+        ],
+    }
+
+
+def gene_measurements(sample_ids, transcript_ids):
+    """Return {transcript_id: {sample_id: transcript measurement row}}."""
+    measurements = {}
+    for measurement in transcript_measurements(sample_ids, transcript_ids, no_progress):
+        measurements.setdefault(measurement.transcript_id, {})[measurement.sample_id] = measurement
+    return measurements
+
+
+def compute_custom_panel_transcript(custom_panel_id, transcript):
+    """Custom panel transcript page, transcript: TranscriptRecord."""
+    sample_ids = custom_panel_inputs(custom_panel_id)[0]
+    measurements = gene_measurements(sample_ids, [transcript.id]).get(transcript.id, {})
+    return transcript_page(
+        sample_records(sample_ids), transcript, measurements, exon_measurements(sample_ids, [transcript])
+    )
+
+
+def compute_custom_panel_gene(custom_panel_id, gene):
+    """Custom panel gene page, gene: GeneRecord."""
+    sample_ids = custom_panel_inputs(custom_panel_id)[0]
+    return gene_page(sample_records(sample_ids), gene, gene_measurements(sample_ids, gene.transcript_ids))
+
+
+# Custom panel snapshot
+def freeze_custom_panel(custom_panel_id, progress=no_progress):
+    """Store panel, gene and transcript pages of a validated custom panel as snapshot, returns {'pages': count}.
+
+    The snapshot contains the gene pages of the panel genes and the transcript pages of all transcripts with
+    measurements of these genes. The stored report is reused if it is current. Raises ValueError if the custom panel is
+    not validated or already has a snapshot and IOError if an exon measurement file can not be opened. Not committed,
+    computed by the report worker as custom_panel_snapshot report.
+    """
+    if not db.session.query(CustomPanel.validated).filter(CustomPanel.id == custom_panel_id).scalar():
+        raise ValueError('Custom panel {0} is not validated.'.format(custom_panel_id))
+    if db.session.query(db.exists().where(CustomPanelSnapshot.custom_panel_id == custom_panel_id)).scalar():
+        raise ValueError('Custom panel {0} already has a snapshot.'.format(custom_panel_id))
+
+    report = Report.query.filter_by(
+        kind='custom_panel', object_id=custom_panel_id, status='done',
+        input_key=input_key('custom_panel', custom_panel_id)
+    ).first()
+    report = json.loads(report.result) if report else compute_custom_panel(custom_panel_id, progress)
+
+    design = reference_data.design()
+    samples = report['samples']
+    sample_ids = [sample['id'] for sample in samples]
+    gene_ids = sorted({transcript['gene_id'] for transcript in report['transcripts']})
+    genes = [design.genes[gene_id] for gene_id in gene_ids]
+    measurements = gene_measurements(
+        sample_ids, [transcript_id for gene in genes for transcript_id in gene.transcript_ids]
+    )
+    transcripts = [design.transcripts[transcript_id] for transcript_id in measurements]
+    transcript_exon_measurements = exon_measurements(sample_ids, transcripts, strict=True)
+
+    pages = [('panel', '', report)]
+    pages.extend(('gene', gene.id, gene_page(samples, gene, measurements)) for gene in genes)
+    pages.extend(
+        (
+            'transcript', transcript.name,
+            transcript_page(samples, transcript, measurements[transcript.id], transcript_exon_measurements)
+        )
+        for transcript in transcripts
+    )
+
+    created_date = datetime.datetime.now()
+    for page, name, data in pages:
+        db.session.add(CustomPanelSnapshot(
+            custom_panel_id=custom_panel_id, page=page, name=name, created_date=created_date,
+            data=zlib.compress(json.dumps(data).encode())
+        ))
+    return {'pages': len(pages)}
+
+
+def snapshot_page(custom_panel_id, page, name=''):
+    """Return frozen page data (panel: report, gene: gene page, transcript: transcript page) or None."""
+    data = db.session.query(CustomPanelSnapshot.data).filter_by(
+        custom_panel_id=custom_panel_id, page=page, name=name
+    ).scalar()
+    if data is not None:
+        return json.loads(zlib.decompress(data))
+
+
+def snapshot_pages(custom_panel_id):
+    """Return {'panel': report, 'genes': {gene_id: page}, 'transcripts': {name: page}} or None without snapshot."""
+    snapshot = {'panel': None, 'genes': {}, 'transcripts': {}}
+    for page, name, data in db.session.query(
+        CustomPanelSnapshot.page, CustomPanelSnapshot.name, CustomPanelSnapshot.data
+    ).filter_by(custom_panel_id=custom_panel_id):
+        data = json.loads(zlib.decompress(data))
+        if page == 'panel':
+            snapshot['panel'] = data
+        else:
+            snapshot['{0}s'.format(page)][name] = data
+    return snapshot if snapshot['panel'] else None
+
+
+# kind -> (input key function, compute function)
+REPORTS = {
+    'sample_set': (sample_set_key, compute_sample_set),
+    'custom_panel': (custom_panel_key, compute_custom_panel),
+    'custom_panel_snapshot': (custom_panel_key, freeze_custom_panel),
+}
+
+
+def input_key(kind, object_id):
+    """Return sha1 hash of the report inputs."""
+    return hashlib.sha1(json.dumps(REPORTS[kind][0](object_id)).encode()).hexdigest()
+
+
+def sample_count(kind, object_id):
+    if kind == 'sample_set':
+        table, column = sample_sets_samples, sample_sets_samples.c.sample_set_id
+    else:
+        table, column = custom_panels_samples, custom_panels_samples.c.custom_panel_id
+    return db.session.query(db.func.count()).select_from(table).filter(column == object_id).scalar()
+
+
+def get_report(kind, object_id, retry_failed=False, inline=True):
+    """Return current report, (re)queues reports without result for the current inputs and computes small reports.
+
+    Failed reports are queued again when their inputs change or with retry_failed. Small reports are only computed in
+    the request if inline is set.
+    """
+    key = input_key(kind, object_id)
+    report = Report.query.filter_by(kind=kind, object_id=object_id).first()
+    if report and report.input_key == key and not (retry_failed and report.status == 'failed'):
+        return report
+
+    if not report:
+        report = Report(kind=kind, object_id=object_id)
+        db.session.add(report)
+    report.input_key = key
+    report.status = 'queued'
+    report.progress = 0
+    report.result = None
+    report.error = None
+    report.updated_date = datetime.datetime.now()
+    try:
+        db.session.commit()
+    except IntegrityError:  # Queued by another request
+        db.session.rollback()
+        return Report.query.filter_by(kind=kind, object_id=object_id).one()
+
+    if inline and sample_count(kind, object_id) <= app.config['REPORT_INLINE_SAMPLES'] and claim_report(report.id):
+        compute_report(report)
+    return report
+
+
+def queue_custom_panel_snapshot(custom_panel_id):
+    """Queue freezing a validated custom panel without snapshot, returns the custom_panel_snapshot report.
+
+    Returns None if the custom panel already has a snapshot, existing snapshots are kept. Failed jobs and done jobs of
+    which the snapshot was removed are queued again.
+    """
+    if db.session.query(db.exists().where(CustomPanelSnapshot.custom_panel_id == custom_panel_id)).scalar():
+        return None
+    Report.query.filter_by(kind='custom_panel_snapshot', object_id=custom_panel_id, status='done').delete()
+    db.session.commit()
+    return get_report('custom_panel_snapshot', custom_panel_id, retry_failed=True, inline=False)
+
+
+def claim_report(report_id):
+    """Set report status to running if it is queued or stale, returns False if another worker claimed it."""
+    stale_date = datetime.datetime.now() - datetime.timedelta(seconds=app.config['REPORT_STALE_TIMEOUT'])
+    result = db.session.execute(
+        db.update(Report)
+        .where(Report.id == report_id)
+        .where(db.or_(
+            Report.status == 'queued',
+            db.and_(Report.status == 'running', Report.updated_date < stale_date)
+        ))
+        .values(status='running', progress=0, updated_date=datetime.datetime.now())
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def compute_report(report):
+    """Compute and store a claimed report, returns False if the result is discarded.
+
+    The result is stored with the input key computed at claim time, only if the inputs did not change (and the report
+    was not queued again by get_report) during the computation. Rows added by the compute function are committed with
+    the result.
+    """
+    def progress(fraction):
+        report.progress = fraction
+        report.updated_date = datetime.datetime.now()
+        db.session.commit()
+
+    db.session.refresh(report)
+    claimed_input_key = report.input_key
+    key = input_key(report.kind, report.object_id)
+    key_function, compute_function = REPORTS[report.kind]
+    try:
+        result = compute_function(report.object_id, progress)
+    except Exception as error:
+        db.session.rollback()
+        values = {'status': 'failed', 'error': repr(error)}
+        app.logger.exception("Report {0} failed.".format(report.id))
+    else:
+        values = {'status': 'done', 'progress': 1, 'result': json.dumps(result), 'error': None}
+    stored = db.session.execute(
+        db.update(Report)
+        .where(Report.id == report.id)
+        .where(Report.input_key == claimed_input_key)
+        .values(input_key=key, updated_date=datetime.datetime.now(), **values)
+    ).rowcount == 1
+    if stored:
+        db.session.commit()
+    else:
+        db.session.rollback()
+    db.session.refresh(report)
+    return stored
+
+
+def queued_report_ids(limit=10):
+    """Return ids of queued and stale running reports, oldest first."""
+    stale_date = datetime.datetime.now() - datetime.timedelta(seconds=app.config['REPORT_STALE_TIMEOUT'])
+    return [
+        report_id for report_id, in
+        db.session.query(Report.id)
+        .filter(db.or_(Report.status == 'queued', db.and_(Report.status == 'running', Report.updated_date < stale_date)))
+        .order_by(Report.updated_date, Report.id)
+        .limit(limit)
+    ]
+
+
+def run_worker(once=False, log=print):
+    """Compute queued reports, polls the reports table every REPORT_POLL_INTERVAL seconds unless once is set."""
+    while True:
+        g.pop('cache_generations', None)  # Reload changed reference data, the worker runs in one app context
+        report_ids = queued_report_ids()
+        db.session.commit()  # End read transaction, see new reports on the next poll
+        for report_id in report_ids:
+            if claim_report(report_id):
+                report = db.session.get(Report, report_id)
+                start_time = time.monotonic()
+                if compute_report(report):
+                    log("{0}: {1} in {2:.1f}s".format(report, report.status, time.monotonic() - start_time))
+                else:
+                    log("{0}: inputs changed, result discarded".format(report))
+        if once and not report_ids:
+            return
+        if not report_ids:
+            time.sleep(app.config['REPORT_POLL_INTERVAL'])
@@ -0,0 +1,345 @@
+"""Cohort coverage quantile sketches.
+
+For every transcript, sample type, import year and measurement type (COVERAGE_SKETCH_MEASUREMENT_TYPES) the sample
+measurements are counted in bins:
+    percentages: fixed bins of PERCENTAGE_BIN_WIDTH (0.1%).
+    mean coverage: logarithmic bins with relative error COVERAGE_RELATIVE_ERROR (1%, as in DDSketch) and a zero bin.
+Bins are stored as sorted (bin signed 32 bit, count unsigned 32 bit) big endian pairs, zlib compressed.
+Sketches merge exactly by adding bin counts, years are merged on use (date windows) and samples can be removed
+again. Each sketch row also stores running mean and sum of squared differences (Welford) for cohort z-scores.
+"""
+import datetime
+import math
+import struct
+import time
+import zlib
+
+from sqlalchemy import and_, bindparam
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from . import app, db
+from .models import CoverageSketch, Sample, TranscriptMeasurement
+
+PERCENTAGE_BIN_WIDTH = 0.1
+COVERAGE_RELATIVE_ERROR = 0.01
+COVERAGE_GAMMA = (1 + COVERAGE_RELATIVE_ERROR) / (1 - COVERAGE_RELATIVE_ERROR)
+COVERAGE_MIN = 0.01  # Mean coverage below COVERAGE_MIN is counted in ZERO_BIN
+ZERO_BIN = -2**31
+QUANTILES = (0.05, 0.5, 0.95)
+
+bin_struct = struct.Struct('>iI')
+sketch_table = CoverageSketch.__table__
+
+
+def value_bin(measurement_type, value):
+    """Return bin of a measurement value."""
+    if measurement_type == 'measurement_mean_coverage':
+        if value < COVERAGE_MIN:
+            return ZERO_BIN
+        return int(math.ceil(math.log(value, COVERAGE_GAMMA)))
+    return int(round(value / PERCENTAGE_BIN_WIDTH))
+
+
+def bin_value(measurement_type, bin_index):
+    """Return representative measurement value of a bin."""
+    if measurement_type == 'measurement_mean_coverage':
+        if bin_index == ZERO_BIN:
+            return 0.0
+        return 2 * COVERAGE_GAMMA ** bin_index / (COVERAGE_GAMMA + 1)
+    return bin_index * PERCENTAGE_BIN_WIDTH
+
+
+class QuantileSketch(object):
+    """Binned quantile sketch of one measurement type, bins: bin -> sample count."""
+
+    def __init__(self, measurement_type, bins=None):
+        self.measurement_type = measurement_type
+        self.bins = bins if bins is not None else {}
+
+    @classmethod
+    def unpack(cls, measurement_type, data):
+        return cls(measurement_type, dict(bin_struct.iter_unpack(zlib.decompress(data))))
+
+    def pack(self):
+        return zlib.compress(b''.join(
+            bin_struct.pack(bin_index, count) for bin_index, count in sorted(self.bins.items())
+        ))
+
+    @property
+    def count(self):
+        return sum(self.bins.values())
+
+    def add(self, value, count=1):
+        """Add count samples with value, a negative count removes samples."""
+        if value is None:
+            return
+        bin_index = value_bin(self.measurement_type, value)
+        bin_count = self.bins.get(bin_index, 0) + count
+        if bin_count > 0:
+            self.bins[bin_index] = bin_count
+        else:
+            self.bins.pop(bin_index, None)
+
+    def merge(self, other):
+        for bin_index, count in other.bins.items():
+            self.bins[bin_index] = self.bins.get(bin_index, 0) + count
+
+    def quantile(self, q):
+        """Return measurement value at quantile q (0 - 1), None for an empty sketch."""
+        rank = q * (self.count - 1)
+        cumulative_count = 0
+        for bin_index, count in sorted(self.bins.items()):
+            cumulative_count += count
+            if cumulative_count > rank:
+                return bin_value(self.measurement_type, bin_index)
+        return None
+
+
+class RunningStats(object):
+    """Running count, mean and sum of squared differences from the mean (m2), Welford's algorithm."""
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, value):
+        if value is None:
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def remove(self, value):
+        """Reverse add(value)."""
+        if value is None:
+            return
+        if self.count <= 1:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        mean = (self.count * self.mean - value) / (self.count - 1)
+        self.m2 = max(self.m2 - (value - mean) * (value - self.mean), 0.0)
+        self.mean = mean
+        self.count -= 1
+
+    def merge(self, other):
+        """Combine with statistics of other samples (Chan et al.)."""
+        count = self.count + other.count
+        if not count:
+            return
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+
+    @property
+    def stddev(self):
+        """Sample standard deviation, None for less than two samples."""
+        if self.count < 2:
+            return None
+        return math.sqrt(self.m2 / (self.count - 1))
+
+    def zscore(self, value):
+        """Return (value - mean) / stddev, None if undefined."""
+        stddev = self.stddev
+        if value is None or not stddev:
+            return None
+        return (value - self.mean) / stddev
+
+
+def sketch_values(sketch, stats):
+    """Return count, bins, mean and m2 column values, mean and m2 are None without running statistics."""
+    return {
+        'count': sketch.count, 'bins': sketch.pack(),
+        'mean': stats.mean if stats else None, 'm2': stats.m2 if stats else None,
+    }
+
+
+def update_sketches(sample_type, year, transcript_measurements, sign=1, chunk_size=1000):
+    """Add (sign=1) or remove (sign=-1) transcript measurements of one sample, in the current transaction.
+
+    transcript_measurements: [{'transcript_id', <measurement_type>: value}]. Sketch rows are locked (select for update)
+    in primary key order, concurrent imports of the same sample type wait for each other instead of losing updates.
+    """
+    measurement_types = app.config['COVERAGE_SKETCH_MEASUREMENT_TYPES']
+    transcript_measurements = sorted(transcript_measurements, key=lambda measurement: measurement['transcript_id'])
+    for index in range(0, len(transcript_measurements), chunk_size):
+        chunk = transcript_measurements[index:index + chunk_size]
+        rows = db.session.execute(
+            db.select(
+                sketch_table.c.transcript_id, sketch_table.c.measurement_type, sketch_table.c.count,
+                sketch_table.c.bins, sketch_table.c.mean, sketch_table.c.m2
+            )
+            .where(sketch_table.c.sample_type == sample_type)
+            .where(sketch_table.c.year == year)
+            .where(sketch_table.c.measurement_type.in_(measurement_types))
+            .where(sketch_table.c.transcript_id.in_([measurement['transcript_id'] for measurement in chunk]))
+            .order_by(sketch_table.c.transcript_id, sketch_table.c.measurement_type)
+            .with_for_update()
+        )
+        sketches = {  # Rows created before running statistics were added have no mean, fixed by rebuild
+            (row.transcript_id, row.measurement_type): (
+                QuantileSketch.unpack(row.measurement_type, row.bins),
+                RunningStats(row.count, row.mean, row.m2) if row.mean is not None else None
+            )
+            for row in rows
+        }
+
+        updates = []
+        inserts = []
+        for measurement in chunk:
+            for measurement_type in measurement_types:
+                key = (measurement['transcript_id'], measurement_type)
+                value = measurement[measurement_type]
+                if key in sketches:
+                    sketch, stats = sketches[key]
+                    sketch.add(value, sign)
+                    if stats and sign > 0:
+                        stats.add(value)
+                    elif stats:
+                        stats.remove(value)
+                    updates.append(dict(
+                        b_transcript_id=key[0], b_measurement_type=measurement_type, **sketch_values(sketch, stats)
+                    ))
+                elif sign > 0:
+                    sketch, stats = QuantileSketch(measurement_type), RunningStats()
+                    sketch.add(value)
+                    stats.add(value)
+                    inserts.append(dict(
+                        transcript_id=key[0], sample_type=sample_type, year=year, measurement_type=measurement_type,
+                        **sketch_values(sketch, stats)
+                    ))
+
+        if updates:
+            db.session.execute(
+                sketch_table.update()
+                .where(and_(
+                    sketch_table.c.transcript_id == bindparam('b_transcript_id'),
+                    sketch_table.c.sample_type == sample_type,
+                    sketch_table.c.year == year,
+                    sketch_table.c.measurement_type == bindparam('b_measurement_type'),
+                ))
+                .values(count=bindparam('count'), bins=bindparam('bins'), mean=bindparam('mean'), m2=bindparam('m2')),
+                updates
+            )
+        if inserts:
+            db.session.execute(sketch_table.insert(), inserts)
+
+
+def add_sample(sample_type, year, transcript_measurements, attempts=3):
+    """Add sample transcript measurements in a separate transaction, returns False if all attempts failed."""
+    for attempt in range(1, attempts + 1):
+        try:
+            update_sketches(sample_type, year, transcript_measurements)
+            db.session.commit()
+            return True
+        except (IntegrityError, OperationalError):  # Sketch inserted by a concurrent import or deadlock
+            db.session.rollback()
+            app.logger.warning("Coverage sketch update failed, attempt {0} of {1}.".format(attempt, attempts))
+            time.sleep(attempt)
+    return False
+
+
+def remove_sample(sample):
+    """Remove sample transcript measurements from the sketches, in the current transaction."""
+    measurement_types = app.config['COVERAGE_SKETCH_MEASUREMENT_TYPES']
+    transcript_measurements = [
+        row._asdict() for row in db.session.query(
+            TranscriptMeasurement.transcript_id,
+            *[getattr(TranscriptMeasurement, measurement_type) for measurement_type in measurement_types]
+        ).filter(TranscriptMeasurement.sample_id == sample.id)
+    ]
+    update_sketches(sample.type, sample.import_date.year, transcript_measurements, sign=-1)
+
+
+def rebuild(sample_type=None, chunk_size=50, log=print):
+    """Rebuild sketches from the transcript measurements of all samples (of sample_type), commits per type and year."""
+    measurement_types = app.config['COVERAGE_SKETCH_MEASUREMENT_TYPES']
+    delete = sketch_table.delete()
+    samples = db.session.query(Sample.id, Sample.type, Sample.import_date).order_by(Sample.id)
+    if sample_type:
+        delete = delete.where(sketch_table.c.sample_type == sample_type)
+        samples = samples.filter(Sample.type == sample_type)
+    db.session.execute(delete)
+
+    groups = {}  # (sample_type, year) -> [sample_id]
+    for sample in samples:
+        groups.setdefault((sample.type, sample.import_date.year), []).append(sample.id)
+
+    for (group_type, year), sample_ids in sorted(groups.items()):
+        sketches = {}  # (transcript_id, measurement_type) -> (QuantileSketch, RunningStats)
+        for index in range(0, len(sample_ids), chunk_size):
+            for measurement in db.session.query(
+                TranscriptMeasurement.transcript_id,
+                *[getattr(TranscriptMeasurement, measurement_type) for measurement_type in measurement_types]
+            ).filter(TranscriptMeasurement.sample_id.in_(sample_ids[index:index + chunk_size])):
+                for measurement_type in measurement_types:
+                    key = (measurement.transcript_id, measurement_type)
+                    if key not in sketches:
+                        sketches[key] = (QuantileSketch(measurement_type), RunningStats())
+                    sketch, stats = sketches[key]
+                    sketch.add(getattr(measurement, measurement_type))
+                    stats.add(getattr(measurement, measurement_type))
+
+        rows = [
+            dict(
+                transcript_id=transcript_id, sample_type=group_type, year=year, measurement_type=measurement_type,
+                **sketch_values(sketch, stats)
+            )
+            for (transcript_id, measurement_type), (sketch, stats) in sorted(sketches.items())
+        ]
+        for index in range(0, len(rows), 1000):
+            db.session.execute(sketch_table.insert(), rows[index:index + 1000])
+        db.session.commit()
+        log("{0} {1}: {2} samples, {3} sketches.".format(group_type, year, len(sample_ids), len(rows)))
+    db.session.commit()
+
+
+def window_years():
+    """Return import years merged in views (COVERAGE_SKETCH_WINDOW_YEARS), None for all years."""
+    if not app.config['COVERAGE_SKETCH_WINDOW_YEARS']:
+        return None
+    current_year = datetime.date.today().year
+    return list(range(current_year - app.config['COVERAGE_SKETCH_WINDOW_YEARS'] + 1, current_year + 1))
+
+
+def transcript_stats(transcript_ids, sample_type, years=None, quantiles=QUANTILES):
+    """Return {transcript_id: {measurement_type: {'count', 'quantiles', 'stats'}}}, sketches of years are merged.
+
+    years: list of import years, None merges all years. stats: RunningStats, None if a sketch has no running statistics.
+    """
+    query = (
+        db.select(
+            sketch_table.c.transcript_id, sketch_table.c.measurement_type, sketch_table.c.count, sketch_table.c.bins,
+            sketch_table.c.mean, sketch_table.c.m2
+        )
+        .where(sketch_table.c.sample_type == sample_type)
+        .where(sketch_table.c.measurement_type.in_(app.config['COVERAGE_SKETCH_MEASUREMENT_TYPES']))
+        .where(sketch_table.c.transcript_id.in_(transcript_ids))
+        .where(sketch_table.c.count > 0)
+    )
+    if years is not None:
+        query = query.where(sketch_table.c.year.in_(years))
+
+    sketches = {}
+    for row in db.session.execute(query):
+        sketch = QuantileSketch.unpack(row.measurement_type, row.bins)
+        stats = RunningStats(row.count, row.mean, row.m2) if row.mean is not None else None
+        key = (row.transcript_id, row.measurement_type)
+        if key in sketches:
+            merged_sketch, merged_stats = sketches[key]
+            merged_sketch.merge(sketch)
+            if merged_stats and stats:
+                merged_stats.merge(stats)
+            else:
+                sketches[key] = (merged_sketch, None)
+        else:
+            sketches[key] = (sketch, stats)
+
+    transcript_stats = {}
+    for (transcript_id, measurement_type), (sketch, stats) in sketches.items():
+        transcript_stats.setdefault(transcript_id, {})[measurement_type] = {
+            'count': sketch.count, 'quantiles': [sketch.quantile(q) for q in quantiles], 'stats': stats,
+        }
+    return transcript_stats
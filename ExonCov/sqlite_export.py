@@ -0,0 +1,145 @@
+"""Export a snapshot of the database to a self-contained SQLite file.
+
+Reference data (genes, transcripts, exons, designs and gene aliases) is copied completely, panels, samples and sample
+sets only for the selection. Rows are streamed from the source database in chunks and inserted in one transaction,
+foreign keys are checked afterwards. Sample exon measurement files can be copied to a directory next to the SQLite file.
+"""
+import os
+import shutil
+import time
+
+from sqlalchemy import create_engine, text
+
+from . import db
+from .models import (
+    Design, Exon, Gene, GeneAlias, Panel, PanelVersion, Sample, SampleProject, SampleSet, SequencingRun, Transcript,
+    TranscriptMeasurement, LowCoverageIndex, User, designs_exons, designs_transcripts, exons_transcripts,
+    panels_core_genes, panels_transcripts, sample_sets_samples, samples_sequencingRun
+)
+
+CHUNK_SIZE = 10000
+
+
+def copy_table(source, target, table, where=None, transform=None):
+    """Copy rows matching where from source to target connection, returns number of rows."""
+    query = db.select(table)
+    if where is not None:
+        query = query.where(where)
+    count = 0
+    for rows in source.execute(query, execution_options={'yield_per': CHUNK_SIZE}).mappings().partitions():
+        rows = [dict(row) for row in rows]
+        if transform:
+            rows = [transform(row) for row in rows]
+        target.execute(table.insert(), rows)
+        count += len(rows)
+    return count
+
+
+def copy_exon_measurement_file(exon_measurement_file, exon_file_dir):
+    """Copy tabix file and index to exon_file_dir, returns new path."""
+    path = os.path.join(exon_file_dir, os.path.basename(exon_measurement_file))
+    for extension in ['', '.tbi']:
+        shutil.copyfile(exon_measurement_file + extension, path + extension)
+    return path
+
+
+def export(sqlite_file, sample_ids, sample_set_ids, panel_names=None, exon_file_dir=None, log=print):
+    """Export selected samples, sample sets and panels (default all panels) to a new SQLite file."""
+    source = db.session.connection()
+    sample_ids = set(sample_ids)
+    sample_ids.update(
+        sample_id for sample_id, in source.execute(
+            db.select(sample_sets_samples.c.sample_id).where(sample_sets_samples.c.sample_set_id.in_(sample_set_ids))
+        )
+    )
+    panel_filters = {}
+    if panel_names:
+        panel_version_ids = db.select(PanelVersion.id).where(PanelVersion.panel_name.in_(panel_names))
+        panel_filters = {
+            Panel.__table__: Panel.name.in_(panel_names),
+            PanelVersion.__table__: PanelVersion.panel_name.in_(panel_names),
+            panels_transcripts: panels_transcripts.c.panel_id.in_(panel_version_ids),
+            panels_core_genes: panels_core_genes.c.panel_id.in_(panel_version_ids),
+        }
+    if exon_file_dir:
+        os.makedirs(exon_file_dir, exist_ok=True)
+
+    def sample_transform(row):
+        if exon_file_dir:
+            row['exon_measurement_file'] = os.path.abspath(
+                copy_exon_measurement_file(row['exon_measurement_file'], exon_file_dir)
+            )
+            if row['gap_file']:
+                row['gap_file'] = os.path.abspath(copy_exon_measurement_file(row['gap_file'], exon_file_dir))
+        return row
+
+    def user_transform(row):
+        row.update({'password': '', 'active': False})
+        return row
+
+    # Table, filter and row transform in dependency order
+    sample_filter = Sample.id.in_(sample_ids)
+    tables = [
+        (User.__table__, None, user_transform),
+        (Gene.__table__, None, None),
+        (Transcript.__table__, None, None),
+        (Exon.__table__, None, None),
+        (exons_transcripts, None, None),
+        (GeneAlias.__table__, None, None),
+        (Design.__table__, None, None),
+        (designs_exons, None, None),
+        (designs_transcripts, None, None),
+        (Panel.__table__, panel_filters.get(Panel.__table__), None),
+        (PanelVersion.__table__, panel_filters.get(PanelVersion.__table__), None),
+        (panels_transcripts, panel_filters.get(panels_transcripts), None),
+        (panels_core_genes, panel_filters.get(panels_core_genes), None),
+        (
+            SampleProject.__table__,
+            SampleProject.id.in_(db.select(Sample.project_id).where(sample_filter)),
+            None
+        ),
+        (
+            SequencingRun.__table__,
+            SequencingRun.id.in_(
+                db.select(samples_sequencingRun.c.sequencingRun_id)
+                .where(samples_sequencingRun.c.sample_id.in_(sample_ids))
+            ),
+            None
+        ),
+        (Sample.__table__, sample_filter, sample_transform),
+        (samples_sequencingRun, samples_sequencingRun.c.sample_id.in_(sample_ids), None),
+        (TranscriptMeasurement.__table__, TranscriptMeasurement.sample_id.in_(sample_ids), None),
+        (LowCoverageIndex.__table__, LowCoverageIndex.sample_id.in_(sample_ids), None),
+        (SampleSet.__table__, SampleSet.id.in_(sample_set_ids), None),
+        (sample_sets_samples, sample_sets_samples.c.sample_set_id.in_(sample_set_ids), None),
+    ]
+
+    engine = create_engine('sqlite:///{0}'.format(os.path.abspath(sqlite_file)))
+    db.metadata.create_all(engine)
+    with engine.connect() as target:
+        # Genes and transcripts reference each other, check foreign keys after copying all tables.
+        target.execute(text('PRAGMA foreign_keys = OFF'))
+        for table, where, transform in tables:
+            start_time = time.monotonic()
+            count = copy_table(source, target, table, where, transform)
+            log("{0}: {1} rows in {2:.2f}s".format(table.name, count, time.monotonic() - start_time))
+
+        # Alembic version, allows migrations on the export
+        if db.inspect(source).has_table('alembic_version'):
+            version = source.execute(text('SELECT version_num FROM alembic_version')).scalar()
+            target.execute(text('CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL PRIMARY KEY)'))
+            target.execute(text('INSERT INTO alembic_version VALUES (:version)'), {'version': version})
+        target.commit()
+
+        foreign_key_errors = target.execute(text('PRAGMA foreign_key_check')).all()
+        target.execute(text('PRAGMA foreign_keys = ON'))
+
+        # Query planner statistics
+        target.execute(text('ANALYZE'))
+        target.execute(text('PRAGMA optimize'))
+        target.commit()
+    engine.dispose()
+
+    for table, rowid, parent, foreign_key in foreign_key_errors:
+        log("WARNING: {0} row {1} references missing {2} row.".format(table, rowid, parent))
+    return len(sample_ids)
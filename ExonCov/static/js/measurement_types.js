@@ -0,0 +1,65 @@
+/*
+ * Client side measurement type switching for sample set and custom panel pages.
+ *
+ * measurementTables: {table id: {measurement type: [[mean, min, max, sample measurements...], ...]}}.
+ * Rows are matched on the data-row attribute of the table rows, values on the td.measurement cells of a row.
+ * Tables set data-measurement-kind to highlight measurements as the server side table macros:
+ *     gene: >15 below 100% for core genes (tr data-core-gene) or below 95% for other genes.
+ *     panel: >15 below the panel coverage requirement (tr data-coverage-requirement).
+ */
+function formatMeasurement(value) {
+    // Missing measurements are shown as 0.0, as measurement|float|round(2).
+    value = Math.round((value === null ? 0 : value) * 100) / 100;
+    return Number.isInteger(value) ? value.toFixed(1) : String(value);
+}
+
+function measurementClass(kind, measurementType, value, row) {
+    value = value === null ? 0 : value;
+    if (measurementType != 'measurement_percentage15') {
+        return 'measurement';
+    } else if (kind == 'gene') {
+        var requirement = $(row).data('core-gene') ? 100 : 95;
+        return value < requirement ? 'measurement danger' : 'measurement';
+    } else if (kind == 'panel') {
+        return value < parseFloat($(row).data('coverage-requirement')) ? 'measurement danger' : 'measurement';
+    }
+    return 'measurement';
+}
+
+function switchMeasurementType(measurementTables, measurementType, label) {
+    $.each(measurementTables, function(tableId, measurements) {
+        var table = $('#' + tableId);
+        var kind = table.data('measurement-kind');
+        var isDataTable = $.fn.dataTable.isDataTable(table);
+
+        // Datatables detaches filtered and paged rows from the table, use all row nodes of the datatable.
+        var rows = isDataTable ? $(table.DataTable().rows().nodes()) : table.find('tbody tr');
+        rows.filter('[data-row]').each(function() {
+            var row = this;
+            var values = measurements[measurementType][$(row).data('row')];
+            if (values === undefined) {
+                return;
+            }
+            $(row).find('td.measurement').each(function(index) {
+                $(this).text(formatMeasurement(values[index]));
+                $(this).attr('class', measurementClass(kind, measurementType, values[index], row));
+            });
+        });
+
+        // Update datatables sort and search data
+        if (isDataTable) {
+            table.DataTable().rows().invalidate('dom').draw(false);
+        }
+    });
+    $('.measurement-type-label').text(label);
+}
+
+function setupMeasurementTypeSwitch(measurementTables, onSwitch) {
+    $("select[name='measurement_type']").change(function() {
+        var label = $(this).find('option:selected').text();
+        switchMeasurementType(measurementTables, this.value, label);
+        if (onSwitch) {
+            onSwitch(this.value, label);
+        }
+    });
+}
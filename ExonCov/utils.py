@@ -1,12 +1,24 @@
 """Utility functions."""
+import base64
+import binascii
+import datetime
+import functools
 import json
+import os
+import random
+import subprocess
+import threading
+import time
 from builtins import str
 
 from flask import request, url_for
 from flask_login import current_user
+from sqlalchemy import and_, or_, select, func
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.exc import IntegrityError
 
+from ExonCov import metrics
+
 
 def get_one_or_create(session, model, create_method='', create_method_kwargs=None, **kwargs):
     """Get object from database or create if not exist.
@@ -47,6 +59,173 @@ def url_for_other_page(page):
     return url_for(request.endpoint, **args)
 
 
+def url_for_cursor(cursor, direction):
+    """Return url for current page with keyset pagination cursor."""
+    args = request.args.copy()
+    args.pop('after', None)
+    args.pop('before', None)
+    args[direction] = cursor
+    return url_for(request.endpoint, **args)
+
+
+def encode_cursor(values):
+    """Encode keyset values as url safe cursor string."""
+    values = [value.isoformat() if isinstance(value, datetime.date) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, columns):
+    """Decode cursor string to keyset values, returns None for invalid cursors."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (binascii.Error, ValueError, UnicodeError):
+        return None
+
+    if not isinstance(values, list) or len(values) != len(columns):
+        return None
+
+    try:
+        return [
+            datetime.date.fromisoformat(value) if column.type.python_type is datetime.date else value
+            for value, (column, descending) in zip(values, columns)
+        ]
+    except (TypeError, ValueError):
+        return None
+
+
+class KeysetPagination(object):
+    """Keyset (seek) pagination, avoids OFFSET queries on large tables.
+
+    columns: list of (column, descending) tuples, last column must be unique (primary key).
+    """
+
+    def __init__(self, query, columns, per_page, after=None, before=None):
+        self.columns = columns
+        self.per_page = per_page
+
+        direction = 'before' if before and not after else 'after'
+        cursor_values = decode_cursor(before if direction == 'before' else after, columns) if (after or before) else None
+
+        order_by = []
+        for column, descending in columns:
+            if direction == 'before':
+                descending = not descending
+            order_by.append(column.desc() if descending else column.asc())
+
+        if cursor_values:
+            query = query.filter(self._seek_filter(cursor_values, reverse=(direction == 'before')))
+
+        items = query.order_by(None).order_by(*order_by).limit(per_page + 1).all()
+        has_more = len(items) > per_page
+        items = items[:per_page]
+
+        if direction == 'before':
+            items.reverse()
+            self.has_prev = has_more
+            self.has_next = True
+        else:
+            self.has_prev = bool(cursor_values)
+            self.has_next = has_more
+
+        self.items = items
+
+    def _seek_filter(self, values, reverse=False):
+        """Build (a, b, c) > (x, y, z) style filter supporting mixed sort directions."""
+        clauses = []
+        for index, (column, descending) in enumerate(self.columns):
+            if reverse:
+                descending = not descending
+            comparison = column < values[index] if descending else column > values[index]
+            equal = [self.columns[i][0] == values[i] for i in range(index)]
+            clauses.append(and_(*equal, comparison))
+        return or_(*clauses)
+
+    def _cursor(self, item):
+        return encode_cursor([getattr(item, column.key) for column, descending in self.columns])
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.items:
+            return self._cursor(self.items[-1])
+
+    @property
+    def prev_cursor(self):
+        if self.has_prev and self.items:
+            return self._cursor(self.items[0])
+
+
+_count_cache = {}
+
+
+def cached_count(query, key, timeout):
+    """Return query count, cached per worker process for timeout seconds."""
+    cached = _count_cache.get(key)
+    metrics.cache_lookup('count', cached and time.monotonic() - cached[1] < timeout)
+    if cached and time.monotonic() - cached[1] < timeout:
+        return cached[0]
+
+    count = query.order_by(None).count()
+    _count_cache[key] = (count, time.monotonic())
+    return count
+
+
+def bounded_count(session, query, limit):
+    """Count query rows up to limit, returns (count, is_lower_bound)."""
+    subquery = query.order_by(None).limit(limit + 1).subquery()
+    count = session.execute(select(func.count()).select_from(subquery)).scalar()
+    if count > limit:
+        return limit, True
+    return count, False
+
+
+class StageTimer(object):
+    """Record durations of consecutive stages, stages are kept per thread."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def start(self):
+        self._local.stages = []
+        self._local.time = time.perf_counter()
+
+    def mark(self, stage):
+        """Close stage, duration is measured from the previous mark or start."""
+        now = time.perf_counter()
+        self._local.stages.append((stage, now - self._local.time))
+        self._local.time = now
+
+    @property
+    def stages(self):
+        """Return [(stage, seconds)] for the current thread."""
+        return list(getattr(self._local, 'stages', []))
+
+
+@functools.lru_cache(maxsize=None)
+def git_version():
+    """Return (version, commit) of the ExonCov git repository, computed once per process."""
+    git_command = ['git', '--git-dir', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.git')]
+    try:
+        version = subprocess.check_output(git_command + ['describe', '--tags', '--always'], stderr=subprocess.DEVNULL)
+        commit = subprocess.check_output(git_command + ['rev-parse', 'HEAD'], stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', 'unknown'
+    return version.decode('ascii').strip(), commit.decode('ascii').strip()
+
+
+def reservoir_sample(items, size, seed=None):
+    """Uniform random sample of size items from an iterable in one pass, reproducible for a seed."""
+    rng = random.Random(seed)
+    reservoir = []
+    for index, item in enumerate(items):
+        if index < size:
+            reservoir.append(item)
+        else:
+            replace_index = rng.randint(0, index)
+            if replace_index < size:
+                reservoir[replace_index] = item
+    return reservoir
+
+
 def weighted_average(values, weights):
     return sum(x * y for x, y in zip(values, weights)) / sum(weights)
 
@@ -91,3 +270,39 @@ def get_summary_stats_multi_sample(measurements, keys=None, samples=None):
             values = measurements[key].values()
         measurements[key]['min'], measurements[key]['max'], measurements[key]['mean'] = get_summary_stats(values)
     return measurements
+
+
+def get_summary_stats_measurement_types(measurements, measurement_types):
+    """Summary stats (as get_summary_stats_multi_sample) for all measurement types in one pass over the measurements.
+
+    measurements: {key: {sample: measurement}}, measurement supports [measurement_type] (TranscriptMeasurement or
+    exon row dict).
+    Returns {measurement_type: {key: {sample: value, 'min': min, 'max': max, 'mean': mean}}}.
+    """
+    summary = {measurement_type: {} for measurement_type in measurement_types}
+    for key, key_measurements in measurements.items():
+        values = {measurement_type: {} for measurement_type in measurement_types}
+        for sample, measurement in key_measurements.items():
+            for measurement_type in measurement_types:
+                values[measurement_type][sample] = measurement[measurement_type]
+        for measurement_type in measurement_types:
+            type_values = values[measurement_type]
+            stats = get_summary_stats(list(type_values.values()))
+            type_values['min'], type_values['max'], type_values['mean'] = stats
+            summary[measurement_type][key] = type_values
+    return summary
+
+
+def measurement_row(mean, min, max, values):
+    """Return [mean, min, max, values...] rounded to 2 decimals, row of a client side measurement type table."""
+    return [round(value, 2) if value is not None else None for value in [mean, min, max] + list(values)]
+
+
+def measurement_rows(measurements, samples):
+    """Return measurement_row per key of get_summary_stats_multi_sample measurements."""
+    return [
+        measurement_row(key_measurements['mean'], key_measurements['min'], key_measurements['max'], [
+            key_measurements.get(sample) for sample in samples
+        ])
+        for key_measurements in measurements.values()
+    ]
@@ -2,25 +2,72 @@
 
 import time
 import datetime
+import json
 from operator import attrgetter
 
-from flask import render_template, request, redirect, url_for
+from flask import render_template, request, redirect, url_for, abort, Response, jsonify
 from flask_security import login_required, roles_required
 from flask_login import current_user
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy import or_
-import pysam
 
-from . import app, db
+from . import app, db, bed_export, gaps, metrics, reports, sketches
 from .models import (
     Sample, SampleProject, SampleSet, SequencingRun, PanelVersion, Panel, CustomPanel, Gene, Transcript,
-    TranscriptMeasurement, panels_transcripts
+    TranscriptMeasurement, Report
 )
 from .forms import (
     MeasurementTypeForm, CustomPanelForm, CustomPanelNewForm, CustomPanelValidateForm, SampleForm,
     CreatePanelForm, PanelNewVersionForm, PanelEditForm, PanelVersionEditForm, SampleSetPanelGeneForm, SampleGeneForm
 )
-from .utils import get_summary_stats, get_summary_stats_multi_sample, weighted_average
+from .reference_data import reference_data
+from .utils import (
+    get_summary_stats_measurement_types, measurement_row, measurement_rows, weighted_average, KeysetPagination,
+    cached_count, bounded_count
+)
+
+
+def get_sample_panel_measurements(sample_id, measurement_types, active):
+    """Calculate weighted panel measurements for all validated (in)active panels of a sample."""
+    panel_versions = reference_data.panels().filter(active=active, validated=True)
+    transcript_ids = set()
+    for panel_version in panel_versions:
+        transcript_ids.update(panel_version.transcript_ids)
+
+    # Only sample specific measurements are queried, panels and transcripts are cached.
+    measurements = {}
+    if transcript_ids:
+        query = (
+            db.session.query(
+                TranscriptMeasurement.transcript_id,
+                TranscriptMeasurement.len,
+                *[getattr(TranscriptMeasurement, measurement_type) for measurement_type in measurement_types]
+            )
+            .filter(TranscriptMeasurement.sample_id == sample_id)
+            .filter(TranscriptMeasurement.transcript_id.in_(transcript_ids))
+        )
+        measurements = {row.transcript_id: row for row in query}
+
+    panels = {}
+    for panel_version in panel_versions:
+        panel_measurements = [
+            measurements[transcript_id] for transcript_id in panel_version.transcript_ids if transcript_id in measurements
+        ]
+        if not panel_measurements:
+            continue
+        panels[panel_version.id] = {
+            'description': panel_version.disease_description_nl,
+            'len': sum(measurement.len for measurement in panel_measurements),
+            'name_version': panel_version.name_version,
+            'coverage_requirement_15': panel_version.coverage_requirement_15
+        }
+        weights = [measurement.len for measurement in panel_measurements]
+        for measurement_type in measurement_types:
+            panels[panel_version.id][measurement_type] = weighted_average(
+                values=[getattr(measurement, measurement_type) for measurement in panel_measurements],
+                weights=weights
+            )
+    return panels
 
 
 @app.errorhandler(404)
@@ -34,22 +81,19 @@ def page_not_found(e):
 def samples():
     """Sample overview page."""
     sample_form = SampleForm(request.args, meta={'csrf': False})
-    page = request.args.get('page', default=1, type=int)
+    after = request.args.get('after')
+    before = request.args.get('before')
     sample = request.args.get('sample')
     sample_type = request.args.get('sample_type')
     project = request.args.get('project')
     run = request.args.get('run')
     samples_per_page = 10
 
-    samples = (
-        Sample.query
-        .order_by(Sample.import_date.desc())
-        .order_by(Sample.name.asc())
-        .options(joinedload(Sample.sequencing_runs))
-        .options(joinedload(Sample.project))
-    )
+    samples = Sample.query
+    filtered = False
 
     if (sample or project or run or sample_type) and sample_form.validate():
+        filtered = True
         if sample:
             samples = samples.filter(Sample.name.like('%{0}%'.format(sample)))
         if sample_type:
@@ -57,21 +101,38 @@ def samples():
         if project:
             samples = samples.join(SampleProject).filter(SampleProject.name.like('%{0}%'.format(project)))
         if run:
-            samples = (
-                samples
-                .join(SequencingRun, Sample.sequencing_runs)
-                .filter(
+            samples = samples.filter(
+                Sample.sequencing_runs.any(
                     or_(
                         SequencingRun.name.like('%{0}%'.format(run)),
                         SequencingRun.platform_unit.like('%{0}%'.format(run))
                     )
                 )
             )
-        samples = samples.paginate(page=page, per_page=samples_per_page)
+
+    # Count samples, unfiltered count is cached per worker, filtered count is capped.
+    if filtered:
+        sample_count, sample_count_capped = bounded_count(db.session, samples, app.config['SAMPLE_FILTER_COUNT_LIMIT'])
     else:
-        samples = samples.paginate(page=page, per_page=samples_per_page)
+        sample_count = cached_count(samples, 'samples', app.config['SAMPLE_COUNT_CACHE_TIMEOUT'])
+        sample_count_capped = False
+
+    # Keyset pagination on (import_date, name, id), eager load only samples on page
+    samples = KeysetPagination(
+        samples.options(selectinload(Sample.sequencing_runs), joinedload(Sample.project)),
+        columns=[(Sample.import_date, True), (Sample.name, False), (Sample.id, False)],
+        per_page=samples_per_page,
+        after=after,
+        before=before
+    )
 
-    return render_template('samples.html', form=sample_form, samples=samples)
+    return render_template(
+        'samples.html',
+        form=sample_form,
+        samples=samples,
+        sample_count=sample_count,
+        sample_count_capped=sample_count_capped
+    )
 
 
 @app.route('/sample/<int:id>', methods=['GET', 'POST'])
@@ -89,20 +150,12 @@ def sample(id):
     # Query Sample and panels
     sample = (
         Sample.query
-        .options(joinedload(Sample.sequencing_runs), joinedload(Sample.project), joinedload(Sample.custom_panels))
+        .options(
+            joinedload(Sample.sequencing_runs), joinedload(Sample.project), joinedload(Sample.custom_panels),
+            joinedload(Sample.design)
+        )
         .get_or_404(id)
     )
-    query = (
-        db.session.query(PanelVersion, TranscriptMeasurement)
-        .filter_by(active=True)
-        .filter_by(validated=True)
-        .join(Transcript, PanelVersion.transcripts)
-        .join(TranscriptMeasurement)
-        .filter_by(sample_id=sample.id)
-        .order_by(PanelVersion.panel_name)
-        .options(joinedload(PanelVersion.panel))
-        .all()
-    )
     measurement_types = {
         'measurement_mean_coverage': 'Mean coverage',
         'measurement_percentage10': '>10',
@@ -110,25 +163,7 @@ def sample(id):
         'measurement_percentage30': '>30',
         'measurement_percentage100': '>100',
     }
-    panels = {}
-
-    for panel, transcript_measurement in query:
-        if panel.id not in panels:
-            panels[panel.id] = {
-                'description': panel.panel.disease_description_nl,
-                'len': transcript_measurement.len,
-                'name_version': panel.name_version,
-                'coverage_requirement_15': panel.coverage_requirement_15
-            }
-            for measurement_type in measurement_types:
-                panels[panel.id][measurement_type] = transcript_measurement[measurement_type]
-        else:
-            for measurement_type in measurement_types:
-                panels[panel.id][measurement_type] = weighted_average(
-                    values=[panels[panel.id][measurement_type], transcript_measurement[measurement_type]],
-                    weights=[panels[panel.id]['len'], transcript_measurement.len]
-                )
-            panels[panel.id]['len'] += transcript_measurement.len
+    panels = get_sample_panel_measurements(sample.id, measurement_types, active=True)
     return render_template('sample.html', sample=sample, panels=panels, measurement_types=measurement_types, form=gene_form)
 
 
@@ -144,36 +179,7 @@ def sample_inactive_panels(id):
         'measurement_percentage30': '>30',
         'measurement_percentage100': '>100',
     }
-    query = (
-        db.session.query(PanelVersion, TranscriptMeasurement)
-        .filter_by(active=False)
-        .filter_by(validated=True)
-        .join(Transcript, PanelVersion.transcripts)
-        .join(TranscriptMeasurement)
-        .filter_by(sample_id=sample.id)
-        .order_by(PanelVersion.panel_name)
-        .options(joinedload(PanelVersion.panel))
-        .all()
-    )
-    panels = {}
-
-    for panel, transcript_measurement in query:
-        if panel.id not in panels:
-            panels[panel.id] = {
-                'description': panel.panel.disease_description_nl,
-                'len': transcript_measurement.len,
-                'name_version': panel.name_version,
-                'coverage_requirement_15': panel.coverage_requirement_15
-            }
-            for measurement_type in measurement_types:
-                panels[panel.id][measurement_type] = transcript_measurement[measurement_type]
-        else:
-            for measurement_type in measurement_types:
-                panels[panel.id][measurement_type] = weighted_average(
-                    values=[panels[panel.id][measurement_type], transcript_measurement[measurement_type]],
-                    weights=[panels[panel.id]['len'], transcript_measurement.len]
-                )
-            panels[panel.id]['len'] += transcript_measurement.len
+    panels = get_sample_panel_measurements(sample.id, measurement_types, active=False)
     return render_template('sample_inactive_panels.html', sample=sample, panels=panels, measurement_types=measurement_types)
 
 
@@ -182,7 +188,8 @@ def sample_inactive_panels(id):
 def sample_panel(sample_id, panel_id):
     """Sample panel page."""
     sample = Sample.query.options(joinedload(Sample.sequencing_runs)).options(joinedload(Sample.project)).get_or_404(sample_id)
-    panel = PanelVersion.query.options(joinedload(PanelVersion.core_genes)).get_or_404(panel_id)
+    panel = reference_data.panels().panel_versions.get(panel_id) or abort(404)
+    transcripts = reference_data.design().transcripts
 
     measurement_types = {
         'measurement_mean_coverage': 'Mean coverage',
@@ -192,17 +199,15 @@ def sample_panel(sample_id, panel_id):
         'measurement_percentage100': '>100',
     }
 
-    transcript_measurements = (
-        db.session.query(Transcript, TranscriptMeasurement)
-        .join(panels_transcripts)
-        .filter(panels_transcripts.columns.panel_id == panel.id)
-        .join(TranscriptMeasurement)
-        .filter_by(sample_id=sample.id)
-        .options(joinedload(Transcript.exons, innerjoin=True))
-        .options(joinedload(Transcript.gene))
-        .order_by(TranscriptMeasurement.measurement_percentage15.asc())
-        .all()
-    )
+    transcript_measurements = [
+        (transcripts[transcript_measurement.transcript_id], transcript_measurement)
+        for transcript_measurement in (
+            TranscriptMeasurement.query
+            .filter_by(sample_id=sample.id)
+            .filter(TranscriptMeasurement.transcript_id.in_(panel.transcript_ids))
+            .order_by(TranscriptMeasurement.measurement_percentage15.asc())
+        )
+    ]
 
     # Setup panel summary
     panel_summary = {
@@ -212,25 +217,70 @@ def sample_panel(sample_id, panel_id):
         ),
         'core_genes': ', '.join(
             [
-                '{}({}) = {:.2f}%'.format(tm[0].gene, tm[0], tm[1].measurement_percentage15)
-                for tm in transcript_measurements if tm[0].gene in panel.core_genes and tm[1].measurement_percentage15 < 100
+                '{}({}) = {:.2f}%'.format(tm[0].gene_id, tm[0], tm[1].measurement_percentage15)
+                for tm in transcript_measurements
+                if tm[0].gene_id in panel.core_gene_ids and tm[1].measurement_percentage15 < 100
             ]
         ),
         'genes_15': ', '.join(
             [
-                '{}({}) = {:.2f}%'.format(tm[0].gene, tm[0], tm[1].measurement_percentage15)
-                for tm in transcript_measurements if tm[0].gene not in panel.core_genes and tm[1].measurement_percentage15 < 95
+                '{}({}) = {:.2f}%'.format(tm[0].gene_id, tm[0], tm[1].measurement_percentage15)
+                for tm in transcript_measurements
+                if tm[0].gene_id not in panel.core_gene_ids and tm[1].measurement_percentage15 < 95
             ]
         )
     }
 
+    gap_thresholds = []
+    if sample.gap_file:
+        try:
+            gap_thresholds = gaps.read_thresholds(sample.gap_file)
+        except IOError:
+            pass
+
     return render_template(
         'sample_panel.html',
         sample=sample,
         panel=panel,
+        gap_thresholds=gap_thresholds,
         transcript_measurements=transcript_measurements,
         measurement_types=measurement_types,
-        panel_summary=panel_summary
+        panel_summary=panel_summary,
+        cohort_stats=sketches.transcript_stats(panel.transcript_ids, sample.type, sketches.window_years())
+    )
+
+
+@app.route('/sample/<int:sample_id>/panel/<int:panel_id>/gaps')
+@login_required
+def sample_panel_gaps(sample_id, panel_id):
+    """Sample panel coverage gaps page, use ?threshold=<one of the gap file thresholds> and ?bed=1 for a bed file."""
+    sample = Sample.query.options(joinedload(Sample.sequencing_runs)).options(joinedload(Sample.project)).get_or_404(sample_id)
+    panel = reference_data.panels().panel_versions.get(panel_id) or abort(404)
+    threshold = request.args.get('threshold', type=int)
+    if not sample.gap_file or threshold is None:
+        abort(404)
+    try:
+        panel_gaps = gaps.panel_gaps(sample, panel, threshold)
+    except (IOError, ValueError):
+        abort(404)
+
+    if request.args.get('bed', default=0, type=int) == 1:
+        bed = bed_export.format_bed(
+            (gap['chr'], gap['start'], gap['end'], ','.join(str(transcript) for transcript in gap['transcripts']))
+            for gap in panel_gaps
+        )
+        return Response(bed, mimetype='text/plain', headers={
+            'Content-Disposition': 'attachment; filename={0}_{1}_gaps{2}.bed'.format(
+                sample.name, panel.name_version, threshold
+            )
+        })
+
+    return render_template(
+        'sample_panel_gaps.html',
+        sample=sample,
+        panel=panel,
+        threshold=threshold,
+        gaps=panel_gaps
     )
 
 
@@ -239,18 +289,19 @@ def sample_panel(sample_id, panel_id):
 def sample_transcript(sample_id, transcript_name):
     """Sample transcript page."""
     sample = Sample.query.options(joinedload(Sample.sequencing_runs)).options(joinedload(Sample.project)).get_or_404(sample_id)
-    transcript = Transcript.query.filter_by(name=transcript_name).options(joinedload(Transcript.exons)).first()
+    design = reference_data.design()
+    transcript = design.transcript_by_name(transcript_name) or abort(404)
 
     exon_measurements = []
     try:
-        sample_tabix = pysam.TabixFile(sample.exon_measurement_file)
+        sample_tabix = metrics.tabix_file(sample.exon_measurement_file)
     except IOError:
         pass
     else:
         with sample_tabix:
             header = sample_tabix.header[0].lstrip('#').split('\t')
 
-            for exon in transcript.exons:
+            for exon in design.transcript_exons(transcript, sample.design_id):
                 for row in sample_tabix.fetch(exon.chr, exon.start, exon.end):
                     row = dict(zip(header, row.split('\t')))
                     if int(row['start']) == exon.start and int(row['end']) == exon.end:
@@ -279,7 +330,8 @@ def sample_transcript(sample_id, transcript_name):
 def sample_gene(sample_id, gene_id):
     """Sample gene page."""
     sample = Sample.query.options(joinedload(Sample.sequencing_runs)).options(joinedload(Sample.project)).get_or_404(sample_id)
-    gene = Gene.query.get_or_404(gene_id)
+    design = reference_data.design()
+    gene = design.genes.get(gene_id) or abort(404)
 
     measurement_types = {
         'measurement_mean_coverage': 'Mean coverage',
@@ -288,21 +340,23 @@ def sample_gene(sample_id, gene_id):
         'measurement_percentage30': '>30',
         'measurement_percentage100': '>100',
     }
-    transcript_measurements = (
-        db.session.query(Transcript, TranscriptMeasurement)
-        .filter(Transcript.gene_id == gene.id)
-        .join(TranscriptMeasurement)
-        .filter_by(sample_id=sample.id)
-        .options(joinedload(Transcript.exons, innerjoin=True))
-        .all()
-    )
+    transcript_measurements = [
+        (design.transcripts[transcript_measurement.transcript_id], transcript_measurement)
+        for transcript_measurement in (
+            TranscriptMeasurement.query
+            .filter_by(sample_id=sample.id)
+            .filter(TranscriptMeasurement.transcript_id.in_(gene.transcript_ids))
+        )
+    ]
 
     return render_template(
         'sample_gene.html',
         sample=sample,
         gene=gene,
+        default_transcript=design.transcripts.get(gene.default_transcript_id),
         transcript_measurements=transcript_measurements,
-        measurement_types=measurement_types
+        measurement_types=measurement_types,
+        cohort_stats=sketches.transcript_stats(gene.transcript_ids, sample.type, sketches.window_years())
     )
 
 
@@ -318,13 +372,11 @@ def panels():
 @login_required
 def panel(name):
     """Panel page."""
-    panel = (
-        Panel.query
-        .filter_by(name=name)
-        .options(joinedload(Panel.versions).joinedload(PanelVersion.transcripts))
-        .first_or_404()
+    panel = Panel.query.filter_by(name=name).options(joinedload(Panel.versions)).first_or_404()
+    gene_counts = dict(
+        db.session.query(PanelVersion.id, PanelVersion.gene_count).filter(PanelVersion.panel_name == panel.name)
     )
-    return render_template('panel.html', panel=panel)
+    return render_template('panel.html', panel=panel, gene_counts=gene_counts)
 
 
 @app.route('/panel/<string:name>/new_version', methods=['GET', 'POST'])
@@ -463,15 +515,29 @@ def panel_new():
 @login_required
 def panel_version(id):
     """PanelVersion page."""
-    panel = (
-        PanelVersion.query
-        .options(
-            joinedload(PanelVersion.transcripts).joinedload(Transcript.exons),
-            joinedload(PanelVersion.transcripts).joinedload(Transcript.gene)
-        )
-        .get_or_404(id)
+    panel = reference_data.panels().panel_versions.get(id) or abort(404)
+    transcripts = reference_data.design().transcripts
+    return render_template(
+        'panel_version.html',
+        panel=panel,
+        transcripts=[transcripts[transcript_id] for transcript_id in panel.transcript_ids]
     )
-    return render_template('panel_version.html', panel=panel)
+
+
+@app.route('/panel_version/<int:id>/bed')
+@login_required
+def panel_version_bed(id):
+    """PanelVersion bed file, use ?remove_flank=1 and/or ?merge=1, ?design=<design_id> (default active design)."""
+    panel = reference_data.panels().panel_versions.get(id) or abort(404)
+    remove_flank = request.args.get('remove_flank', default=0, type=int) == 1
+    merge = request.args.get('merge', default=0, type=int) == 1
+    design_id = request.args.get('design', type=int) or bed_export.default_design_id()
+    if design_id not in reference_data.design().designs:
+        abort(404)
+    bed = bed_export.panel_beds([panel], design_id, remove_flank, merge)[panel.id]
+    return Response(bed, mimetype='text/plain', headers={
+        'Content-Disposition': 'attachment; filename={0}.bed'.format(panel.name_version)
+    })
 
 
 @app.route('/panel_version/<int:id>/edit', methods=['GET', 'POST'])
@@ -516,7 +582,12 @@ def custom_panels():
     page = request.args.get('page', default=1, type=int)
     search = request.args.get('search')
 
-    custom_panels = CustomPanel.query.order_by(CustomPanel.id.desc())
+    custom_panels = (
+        CustomPanel.query
+        .add_columns(CustomPanel.gene_count, CustomPanel.sample_count)
+        .options(joinedload(CustomPanel.created_by))
+        .order_by(CustomPanel.id.desc())
+    )
 
     if search and custom_panel_form.validate():
         custom_panels = custom_panels.filter(or_(
@@ -541,7 +612,7 @@ def custom_panel_new():
         if custom_panel_form.data['samples']:
             samples += custom_panel_form.data['samples']
         if custom_panel_form.data['sample_set']:
-            samples += custom_panel_form.data['sample_set'].samples
+            samples += Sample.query.filter(Sample.id.in_(custom_panel_form.data['sample_set'].sample_ids)).all()
 
         custom_panel = CustomPanel(
             created_by=current_user,
@@ -560,201 +631,149 @@ def custom_panel_new():
 @app.route('/panel/custom/<int:id>', methods=['GET', 'POST'])
 @login_required
 def custom_panel(id):
-    """Custom panel page."""
-    custom_panel = (
-        CustomPanel.query
-        .options(joinedload(CustomPanel.transcripts))
-        .options(joinedload(CustomPanel.samples))
-        .get_or_404(id)
-    )
+    """Custom panel page, computed in the background for large custom panels or frozen for validated custom panels."""
+    custom_panel = CustomPanel.query.get_or_404(id)
     measurement_type_form = MeasurementTypeForm()
-
-    sample_ids = [sample.id for sample in custom_panel.samples]
-    transcript_ids = [transcript.id for transcript in custom_panel.transcripts]
+    measurement_types = [choice for choice, label in measurement_type_form.measurement_type.choices]
     measurement_type = [
         measurement_type_form.data['measurement_type'],
         dict(measurement_type_form.measurement_type.choices).get(measurement_type_form.data['measurement_type'])
     ]
-    transcript_measurements = {}
-    panel_measurements = {}
-    sample_stats = {sample: [[], {}] for sample in custom_panel.samples}
-
-    query = (
-        TranscriptMeasurement.query
-        .filter(TranscriptMeasurement.sample_id.in_(sample_ids))
-        .filter(TranscriptMeasurement.transcript_id.in_(transcript_ids))
-        .options(joinedload(TranscriptMeasurement.transcript).joinedload(Transcript.gene))
-        .all()
-    )
-
-    for transcript_measurement in query:
-        sample = transcript_measurement.sample
-        transcript = transcript_measurement.transcript
-
-        # Store transcript_measurements per transcript and sample
-        if transcript not in transcript_measurements:
-            transcript_measurements[transcript] = {}
-        transcript_measurements[transcript][sample] = transcript_measurement[measurement_type[0]]
-
-        if transcript_measurement[measurement_type[0]] == 100:
-            sample_stats[sample][0].append('{0}({1})'.format(transcript.gene.id, transcript.name))
-        else:
-            sample_stats[sample][1]['{0}({1})'.format(
-                transcript.gene.id, transcript.name
-            )] = transcript_measurement[measurement_type[0]]
-
-        # Calculate weighted average per sample for entire panel
-        if sample not in panel_measurements:
-            panel_measurements[sample] = {
-                'len': transcript_measurement.len,
-                'measurement': transcript_measurement[measurement_type[0]]
-            }
-        else:
-            panel_measurements[sample]['measurement'] = weighted_average(
-                values=[panel_measurements[sample]['measurement'], transcript_measurement[measurement_type[0]]],
-                weights=[panel_measurements[sample]['len'], transcript_measurement.len]
+    report = reports.snapshot_page(custom_panel.id, 'panel') if custom_panel.validated else None
+    frozen = report is not None
+    snapshot_report = None
+    if custom_panel.validated and not frozen:
+        snapshot_report = Report.query.filter_by(kind='custom_panel_snapshot', object_id=custom_panel.id).first()
+    if not frozen:
+        report = reports.get_report('custom_panel', custom_panel.id)
+        if report.status != 'done':
+            return render_template(
+                'report_progress.html', form=measurement_type_form, report=report,
+                title='Custom gene panel {0}'.format(id)
             )
-            panel_measurements[sample]['len'] += transcript_measurement.len
-
-    # Calculate min, mean, max
-    transcript_measurements = get_summary_stats_multi_sample(measurements=transcript_measurements)
+        report = json.loads(report.result)
 
-    values = [panel_measurements[sample]['measurement'] for sample in panel_measurements]
-    panel_measurements['min'], panel_measurements['max'], panel_measurements['mean'] = get_summary_stats(values)
     return render_template(
         'custom_panel.html',
         form=measurement_type_form,
         custom_panel=custom_panel,
+        frozen=frozen,
+        snapshot_report=snapshot_report,
         measurement_type=measurement_type,
-        transcript_measurements=transcript_measurements,
-        panel_measurements=panel_measurements,
-        sample_stats=sample_stats
+        report=report,
+        measurement_tables={
+            'panel_table': {
+                measurement_type: [measurement_row(**report['panel']['measurement_types'][measurement_type])]
+                for measurement_type in measurement_types
+            },
+            'data_table': {
+                measurement_type: [
+                    measurement_row(**transcript['measurement_types'][measurement_type])
+                    for transcript in report['transcripts']
+                ]
+                for measurement_type in measurement_types
+            },
+        }
     )
 
 
 @app.route('/panel/custom/<int:id>/transcript/<string:transcript_name>', methods=['GET', 'POST'])
 @login_required
 def custom_panel_transcript(id, transcript_name):
-    """Custom panel transcript page."""
-    custom_panel = CustomPanel.query.options(joinedload(CustomPanel.samples)).get_or_404(id)
+    """Custom panel transcript page, frozen for validated custom panels."""
+    custom_panel = CustomPanel.query.get_or_404(id)
     measurement_type_form = MeasurementTypeForm()
-
-    sample_ids = [sample.id for sample in custom_panel.samples]
-    transcript = (
-        Transcript.query
-        .filter_by(name=transcript_name)
-        .options(joinedload(Transcript.gene))
-        .options(joinedload(Transcript.exons))
-        .first()
-    )
+    measurement_types = [choice for choice, label in measurement_type_form.measurement_type.choices]
     measurement_type = [
         measurement_type_form.data['measurement_type'],
         dict(measurement_type_form.measurement_type.choices).get(measurement_type_form.data['measurement_type'])
     ]
-    transcript_measurements = {}
-    exon_measurements = {}
-
-    if sample_ids and measurement_type:
-        # Get transcript measurements
-        query = (
-            TranscriptMeasurement.query
-            .filter(TranscriptMeasurement.sample_id.in_(sample_ids))
-            .filter_by(transcript_id=transcript.id)
-            .all()
-        )
-        for transcript_measurement in query:
-            sample = transcript_measurement.sample
-            transcript_measurements[sample] = transcript_measurement[measurement_type[0]]
-
-        # Get exon measurements
-        for sample in custom_panel.samples:
-            try:
-                sample_tabix = pysam.TabixFile(sample.exon_measurement_file)
-            except IOError:
-                exon_measurements = {}
-                break
-            else:
-                with sample_tabix:
-                    header = sample_tabix.header[0].lstrip('#').split('\t')
-
-                    for exon in transcript.exons:
-                        if exon not in exon_measurements:
-                            exon_measurements[exon] = {}
-
-                        for row in sample_tabix.fetch(exon.chr, exon.start, exon.end):
-                            row = dict(zip(header, row.split('\t')))
-                            if int(row['start']) == exon.start and int(row['end']) == exon.end:
-                                exon_measurements[exon][sample] = float(row[measurement_type[0]])
-                                break
-
-        # Calculate min, mean, max
-        transcript_measurements['min'], transcript_measurements['max'], transcript_measurements['mean'] = get_summary_stats(
-            transcript_measurements.values()
-        )
-
-        exon_measurements = get_summary_stats_multi_sample(measurements=exon_measurements)
+    page = reports.snapshot_page(custom_panel.id, 'transcript', transcript_name) if custom_panel.validated else None
+    frozen = page is not None
+    if not frozen:
+        transcript = reference_data.design().transcript_by_name(transcript_name) or abort(404)
+        page = reports.compute_custom_panel_transcript(custom_panel.id, transcript)
 
     return render_template(
         'custom_panel_transcript.html',
         form=measurement_type_form,
-        transcript=transcript,
         custom_panel=custom_panel,
+        frozen=frozen,
         measurement_type=measurement_type,
-        transcript_measurements=transcript_measurements,
-        exon_measurements=exon_measurements
+        page=page,
+        measurement_tables={
+            'transcript_table': {
+                measurement_type: [measurement_row(**page['measurement_types'][measurement_type])]
+                for measurement_type in measurement_types
+            },
+            'data_table': {
+                measurement_type: [
+                    measurement_row(**exon['measurement_types'][measurement_type]) for exon in page['exons']
+                ]
+                for measurement_type in measurement_types
+            },
+        }
     )
 
 
 @app.route('/panel/custom/<int:id>/gene/<string:gene_id>', methods=['GET', 'POST'])
 @login_required
 def custom_panel_gene(id, gene_id):
-    """Custom panel gene page."""
+    """Custom panel gene page, frozen for validated custom panels."""
     custom_panel = CustomPanel.query.get_or_404(id)
-    gene = Gene.query.get_or_404(gene_id)
-
     measurement_type_form = MeasurementTypeForm()
-
-    sample_ids = [sample.id for sample in custom_panel.samples]
+    measurement_types = [choice for choice, label in measurement_type_form.measurement_type.choices]
     measurement_type = [
         measurement_type_form.data['measurement_type'],
         dict(measurement_type_form.measurement_type.choices).get(measurement_type_form.data['measurement_type'])
     ]
-    transcript_measurements = {}
-
-    if sample_ids and measurement_type:
-        query = (
-            TranscriptMeasurement.query
-            .filter(TranscriptMeasurement.sample_id.in_(sample_ids))
-            .join(Transcript)
-            .filter_by(gene_id=gene_id)
-            .options(joinedload(TranscriptMeasurement.sample))
-            .options(joinedload(TranscriptMeasurement.transcript))
-            .all()
-        )
-        for transcript_measurement in query:
-            sample = transcript_measurement.sample
-            transcript = transcript_measurement.transcript
-
-            if transcript not in transcript_measurements:
-                transcript_measurements[transcript] = {}
-            transcript_measurements[transcript][sample] = transcript_measurement[measurement_type[0]]
-
-        transcript_measurements = get_summary_stats_multi_sample(measurements=transcript_measurements)
+    page = reports.snapshot_page(custom_panel.id, 'gene', gene_id) if custom_panel.validated else None
+    frozen = page is not None
+    if not frozen:
+        gene = reference_data.design().genes.get(gene_id) or abort(404)
+        page = reports.compute_custom_panel_gene(custom_panel.id, gene)
 
     return render_template(
         'custom_panel_gene.html',
         form=measurement_type_form,
-        gene=gene,
         custom_panel=custom_panel,
+        frozen=frozen,
         measurement_type=measurement_type,
-        transcript_measurements=transcript_measurements
+        page=page,
+        measurement_tables={
+            'data_table': {
+                measurement_type: [
+                    measurement_row(**transcript['measurement_types'][measurement_type])
+                    for transcript in page['transcripts']
+                ]
+                for measurement_type in measurement_types
+            },
+        }
     )
 
 
+@app.route('/panel/custom/<int:id>/snapshot')
+@login_required
+def custom_panel_snapshot(id):
+    """Frozen custom panel pages as json file."""
+    custom_panel = CustomPanel.query.get_or_404(id)
+    snapshot = reports.snapshot_pages(custom_panel.id) or abort(404)
+    snapshot['custom_panel'] = {
+        'id': custom_panel.id,
+        'research_number': custom_panel.research_number,
+        'comments': custom_panel.comments,
+        'validated_by': str(custom_panel.validated_by),
+        'validated_date': str(custom_panel.validated_date),
+    }
+    return Response(json.dumps(snapshot), mimetype='application/json', headers={
+        'Content-Disposition': 'attachment; filename=custom_panel_{0}.json'.format(custom_panel.id)
+    })
+
+
 @app.route('/panel/custom/<int:id>/set_validated', methods=['GET', 'POST'])
 @login_required
 def custom_panel_validated(id):
-    """Set validation status to true."""
+    """Set validation status to true and queue freezing the custom panel pages."""
     custom_panel = CustomPanel.query.get_or_404(id)
 
     custom_panel_validate_form = CustomPanelValidateForm()
@@ -766,6 +785,7 @@ def custom_panel_validated(id):
         custom_panel.validated_date = datetime.date.today()
         db.session.add(custom_panel)
         db.session.commit()
+        reports.queue_custom_panel_snapshot(custom_panel.id)
 
         return redirect(url_for('custom_panel', id=custom_panel.id))
     else:
@@ -780,7 +800,7 @@ def custom_panel_validated(id):
 @login_required
 def sample_sets():
     """Sample sets page."""
-    sample_sets = SampleSet.query.options(joinedload(SampleSet.samples)).filter_by(active=True).all()
+    sample_sets = db.session.query(SampleSet, SampleSet.sample_count).filter_by(active=True).all()
 
     panel_gene_form = SampleSetPanelGeneForm()
 
@@ -804,63 +824,47 @@ def sample_sets():
 @app.route('/sample_set/<int:id>', methods=['GET', 'POST'])
 @login_required
 def sample_set(id):
-    """Sample set page."""
-    sample_set = SampleSet.query.options(joinedload(SampleSet.samples)).get_or_404(id)
+    """Sample set page, computed in the background for large sample sets."""
+    sample_set = SampleSet.query.get_or_404(id)
     measurement_type_form = MeasurementTypeForm()
-
-    sample_ids = [sample.id for sample in sample_set.samples]
+    measurement_types = [choice for choice, label in measurement_type_form.measurement_type.choices]
     measurement_type = [
         measurement_type_form.data['measurement_type'],
         dict(measurement_type_form.measurement_type.choices).get(measurement_type_form.data['measurement_type'])
     ]
-    panels_measurements = {}
-
-    query = (
-        db.session.query(PanelVersion, TranscriptMeasurement)
-        .filter_by(active=True)
-        .filter_by(validated=True)
-        .join(Transcript, PanelVersion.transcripts)
-        .join(TranscriptMeasurement)
-        .filter(TranscriptMeasurement.sample_id.in_(sample_ids))
-        .order_by(PanelVersion.panel_name)
-        .options(joinedload(PanelVersion.panel))
-        .all()
-    )
-
-    for panel, transcript_measurement in query:
-        sample = transcript_measurement.sample
-        if panel not in panels_measurements:
-            panels_measurements[panel] = {
-                'panel': panel,
-                'samples': {},
-            }
-
-        if sample not in panels_measurements[panel]['samples']:
-            panels_measurements[panel]['samples'][sample] = {
-                'len': transcript_measurement.len,
-                'measurement': transcript_measurement[measurement_type[0]]
-            }
-        else:
-            panels_measurements[panel]['samples'][sample]['measurement'] = weighted_average(
-                values=[
-                    panels_measurements[panel]['samples'][sample]['measurement'],
-                    transcript_measurement[measurement_type[0]]
-                ],
-                weights=[panels_measurements[panel]['samples'][sample]['len'], transcript_measurement.len]
-            )
-            panels_measurements[panel]['samples'][sample]['len'] += transcript_measurement.len
-
-    panels_measurements = get_summary_stats_multi_sample(measurements=panels_measurements, samples=sample_set.samples)
+    report = reports.get_report('sample_set', sample_set.id)
+    if report.status != 'done':
+        return render_template(
+            'report_progress.html', form=measurement_type_form, report=report,
+            title='Sample set - {0}'.format(sample_set.name)
+        )
+    report = json.loads(report.result)
 
     return render_template(
         'sample_set.html',
         sample_set=sample_set,
         form=measurement_type_form,
         measurement_type=measurement_type,
-        panels_measurements=panels_measurements
+        report=report,
+        measurement_tables={
+            'data_table': {
+                measurement_type: [
+                    measurement_row(**panel['measurement_types'][measurement_type]) for panel in report['panels']
+                ]
+                for measurement_type in measurement_types
+            },
+        }
     )
 
 
+@app.route('/report/<int:id>/progress')
+@login_required
+def report_progress(id):
+    """Report status and progress (0 - 1), polled by the report progress page."""
+    report = Report.query.get_or_404(id)
+    return jsonify(status=report.status, progress=report.progress, error=report.error)
+
+
 @app.route('/sample_set/<int:sample_set_id>/panel/<int:panel_id>', methods=['GET', 'POST'])
 @login_required
 def sample_set_panel(sample_set_id, panel_id):
@@ -868,13 +872,14 @@ def sample_set_panel(sample_set_id, panel_id):
     sample_set = SampleSet.query.options(joinedload(SampleSet.samples)).get_or_404(sample_set_id)
     panel = PanelVersion.query.options(joinedload(PanelVersion.transcripts)).get_or_404(panel_id)
     measurement_type_form = MeasurementTypeForm()
-
-    sample_ids = [sample.id for sample in sample_set.samples]
-    transcript_ids = [transcript.id for transcript in panel.transcripts]
+    measurement_types = [choice for choice, label in measurement_type_form.measurement_type.choices]
     measurement_type = [
         measurement_type_form.data['measurement_type'],
         dict(measurement_type_form.measurement_type.choices).get(measurement_type_form.data['measurement_type'])
     ]
+
+    sample_ids = [sample.id for sample in sample_set.samples]
+    transcript_ids = [transcript.id for transcript in panel.transcripts]
     transcript_measurements = {}
 
     query = (
@@ -892,10 +897,10 @@ def sample_set_panel(sample_set_id, panel_id):
         # Store transcript_measurements per transcript and sample
         if transcript not in transcript_measurements:
             transcript_measurements[transcript] = {}
-        transcript_measurements[transcript][sample] = transcript_measurement[measurement_type[0]]
+        transcript_measurements[transcript][sample] = transcript_measurement
 
-    # Calculate min, mean, max
-    transcript_measurements = get_summary_stats_multi_sample(measurements=transcript_measurements)
+    # Calculate min, mean, max for all measurement types
+    transcript_measurements = get_summary_stats_measurement_types(transcript_measurements, measurement_types)
 
     return render_template(
         'sample_set_panel.html',
@@ -903,7 +908,13 @@ def sample_set_panel(sample_set_id, panel_id):
         form=measurement_type_form,
         measurement_type=measurement_type,
         panel=panel,
-        transcript_measurements=transcript_measurements
+        transcript_measurements=transcript_measurements[measurement_type[0]],
+        measurement_tables={
+            'data_table': {
+                measurement_type: measurement_rows(transcript_measurements[measurement_type], sample_set.samples)
+                for measurement_type in measurement_types
+            },
+        }
     )
 
 
@@ -920,7 +931,7 @@ def sample_set_transcript(sample_set_id, transcript_name):
         .first()
     )
     measurement_type_form = MeasurementTypeForm()
-
+    measurement_types = [choice for choice, label in measurement_type_form.measurement_type.choices]
     measurement_type = [
         measurement_type_form.data['measurement_type'],
         dict(measurement_type_form.measurement_type.choices).get(measurement_type_form.data['measurement_type'])
@@ -930,25 +941,30 @@ def sample_set_transcript(sample_set_id, transcript_name):
     # Get exon measurements
     for sample in sample_set.samples:
         try:
-            sample_tabix = pysam.TabixFile(sample.exon_measurement_file)
+            sample_tabix = metrics.tabix_file(sample.exon_measurement_file)
         except IOError:
             exon_measurements = {}
             break
         else:
             with sample_tabix:
                 header = sample_tabix.header[0].lstrip('#').split('\t')
+                design_exon_ids = reference_data.design().designs[sample.design_id].exon_ids
 
                 for exon in transcript.exons:
+                    if exon.id not in design_exon_ids:
+                        continue
                     if exon not in exon_measurements:
                         exon_measurements[exon] = {}
 
                     for row in sample_tabix.fetch(exon.chr, exon.start, exon.end):
                         row = dict(zip(header, row.split('\t')))
                         if int(row['start']) == exon.start and int(row['end']) == exon.end:
-                            exon_measurements[exon][sample] = float(row[measurement_type[0]])
+                            exon_measurements[exon][sample] = {
+                                measurement_type: float(row[measurement_type]) for measurement_type in measurement_types
+                            }
                             break
 
-        exon_measurements = get_summary_stats_multi_sample(measurements=exon_measurements)
+    exon_measurements = get_summary_stats_measurement_types(exon_measurements, measurement_types)
 
     return render_template(
         'sample_set_transcript.html',
@@ -956,7 +972,13 @@ def sample_set_transcript(sample_set_id, transcript_name):
         transcript=transcript,
         sample_set=sample_set,
         measurement_type=measurement_type,
-        exon_measurements=exon_measurements
+        exon_measurements=exon_measurements[measurement_type[0]],
+        measurement_tables={
+            'data_table': {
+                measurement_type: measurement_rows(exon_measurements[measurement_type], sample_set.samples)
+                for measurement_type in measurement_types
+            },
+        }
     )
 
 
@@ -967,15 +989,16 @@ def sample_set_gene(sample_set_id, gene_id):
     sample_set = SampleSet.query.options(joinedload(SampleSet.samples)).get_or_404(sample_set_id)
     gene = Gene.query.get_or_404(gene_id)
     measurement_type_form = MeasurementTypeForm()
-
-    sample_ids = [sample.id for sample in sample_set.samples]
+    measurement_types = [choice for choice, label in measurement_type_form.measurement_type.choices]
     measurement_type = [
         measurement_type_form.data['measurement_type'],
         dict(measurement_type_form.measurement_type.choices).get(measurement_type_form.data['measurement_type'])
     ]
+
+    sample_ids = [sample.id for sample in sample_set.samples]
     transcript_measurements = {}
 
-    if sample_ids and measurement_type:
+    if sample_ids:
         query = (
             TranscriptMeasurement.query
             .filter(TranscriptMeasurement.sample_id.in_(sample_ids))
@@ -991,9 +1014,9 @@ def sample_set_gene(sample_set_id, gene_id):
 
             if transcript not in transcript_measurements:
                 transcript_measurements[transcript] = {}
-            transcript_measurements[transcript][sample] = transcript_measurement[measurement_type[0]]
+            transcript_measurements[transcript][sample] = transcript_measurement
 
-        transcript_measurements = get_summary_stats_multi_sample(measurements=transcript_measurements)
+    transcript_measurements = get_summary_stats_measurement_types(transcript_measurements, measurement_types)
 
     return render_template(
         'sample_set_gene.html',
@@ -1001,5 +1024,11 @@ def sample_set_gene(sample_set_id, gene_id):
         gene=gene,
         sample_set=sample_set,
         measurement_type=measurement_type,
-        transcript_measurements=transcript_measurements
+        transcript_measurements=transcript_measurements[measurement_type[0]],
+        measurement_tables={
+            'data_table': {
+                measurement_type: measurement_rows(transcript_measurements[measurement_type], sample_set.samples)
+                for measurement_type in measurement_types
+            },
+        }
     )
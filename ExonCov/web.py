@@ -0,0 +1,51 @@
+"""ExonCov web profile: views, api, admin, security, debug toolbar, metrics and SQL profiling.
+
+Imported once by ExonCov.create_app('web'), CLI commands do not import this module.
+"""
+from flask import url_for
+from flask_wtf.csrf import CSRFProtect
+import flask_admin
+from flask_security import Security, SQLAlchemyUserDatastore
+from flask_debugtoolbar import DebugToolbarExtension
+
+from . import app, db, models, forms
+from .utils import url_for_other_page, url_for_cursor, git_version
+
+csrf = CSRFProtect(app)
+admin = flask_admin.Admin(app, name='ExonCov Admin', template_mode='bootstrap3')
+
+# Debug
+toolbar = DebugToolbarExtension(app)
+
+# Jinja globals
+app.jinja_env.globals['url_for_other_page'] = url_for_other_page
+app.jinja_env.globals['url_for_cursor'] = url_for_cursor
+app.jinja_env.globals['git_version'], app.jinja_env.globals['git_commit'] = git_version()
+
+from . import views, api_views, admin_views, metrics_views, profiling
+
+# Setup flask_security
+user_datastore = SQLAlchemyUserDatastore(db, models.User, models.Role)
+security = Security(app, user_datastore, register_form=forms.ExtendedRegisterForm)
+security.login_manager.session_protection = 'strong'
+
+
+@security.context_processor
+def security_context_processor():
+    """Merge flask-admin's template context into the flask-security views."""
+    return dict(
+        admin_base_template=admin.base_template,
+        admin_view=admin.index_view,
+        h=flask_admin.helpers,
+        get_url=url_for
+    )
+
+
+# Custom filters
+@app.template_filter('supress_none')
+def supress_none_filter(value):
+    """Jinja2 filter to supress none/empty values."""
+    if not value:
+        return '-'
+    else:
+        return value
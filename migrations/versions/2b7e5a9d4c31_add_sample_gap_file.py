@@ -0,0 +1,23 @@
+"""Add sample gap file
+
+Revision ID: 2b7e5a9d4c31
+Revises: 9f2c6d4b8e17
+Create Date: 2026-10-19 19:11:54.602117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '2b7e5a9d4c31'
+down_revision = '9f2c6d4b8e17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('samples', sa.Column('gap_file', sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('samples', 'gap_file')
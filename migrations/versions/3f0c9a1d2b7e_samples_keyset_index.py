@@ -0,0 +1,26 @@
+"""Add samples (import_date DESC, name, id) index for keyset pagination
+
+Revision ID: 3f0c9a1d2b7e
+Revises: 743f453ff85b
+Create Date: 2026-10-19 10:12:31.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '3f0c9a1d2b7e'
+down_revision = '743f453ff85b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Descending import_date matches the overview order, MySQL 8 reads the index backward for the previous page
+    op.create_index(
+        'ix_samples_import_date_name_id', 'samples', [sa.desc('import_date'), 'name', 'id'], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_samples_import_date_name_id', table_name='samples')
@@ -0,0 +1,67 @@
+"""Add designs, design exons and transcripts and bind samples to a design
+
+Revision ID: 5d9a2c7e1f84
+Revises: c41d7e9a05f3
+Create Date: 2026-10-19 13:52:17.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '5d9a2c7e1f84'
+down_revision = 'c41d7e9a05f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    designs = op.create_table(
+        'designs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('exon_bed_file', sa.String(length=255), nullable=True),
+        sa.Column('active', sa.Boolean(), nullable=True),
+        sa.Column('created_date', sa.Date(), nullable=True),
+        sa.Column('comments', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.create_index(op.f('ix_designs_active'), 'designs', ['active'], unique=False)
+    op.create_table(
+        'designs_exons',
+        sa.Column('design_id', sa.Integer(), nullable=False),
+        sa.Column('exon_id', sa.String(length=25), nullable=False),
+        sa.ForeignKeyConstraint(['design_id'], ['designs.id'], ),
+        sa.ForeignKeyConstraint(['exon_id'], ['exons.id'], ),
+        sa.PrimaryKeyConstraint('design_id', 'exon_id')
+    )
+    op.create_table(
+        'designs_transcripts',
+        sa.Column('design_id', sa.Integer(), nullable=False),
+        sa.Column('transcript_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['design_id'], ['designs.id'], ),
+        sa.ForeignKeyConstraint(['transcript_id'], ['transcripts.id'], ),
+        sa.PrimaryKeyConstraint('design_id', 'transcript_id')
+    )
+
+    # Existing exons, transcripts and samples belong to the current (EXON_BED_FILE) design.
+    op.bulk_insert(designs, [{'id': 1, 'name': 'default', 'exon_bed_file': None, 'active': True, 'comments': None}])
+    op.execute("INSERT INTO designs_exons (design_id, exon_id) SELECT 1, id FROM exons")
+    op.execute("INSERT INTO designs_transcripts (design_id, transcript_id) SELECT 1, id FROM transcripts")
+
+    op.add_column('samples', sa.Column('design_id', sa.Integer(), nullable=True))
+    op.execute("UPDATE samples SET design_id = 1")
+    op.alter_column('samples', 'design_id', existing_type=sa.Integer(), nullable=False)
+    op.create_index(op.f('ix_samples_design_id'), 'samples', ['design_id'], unique=False)
+    op.create_foreign_key('samples_design_foreign_key', 'samples', 'designs', ['design_id'], ['id'])
+
+
+def downgrade():
+    op.drop_constraint('samples_design_foreign_key', 'samples', type_='foreignkey')
+    op.drop_index(op.f('ix_samples_design_id'), table_name='samples')
+    op.drop_column('samples', 'design_id')
+    op.drop_table('designs_transcripts')
+    op.drop_table('designs_exons')
+    op.drop_index(op.f('ix_designs_active'), table_name='designs')
+    op.drop_table('designs')
@@ -0,0 +1,32 @@
+"""Remove report measurement type
+
+Revision ID: 6e3b8d1f4a27
+Revises: 2b7e5a9d4c31
+Create Date: 2026-10-19 21:04:37.512836
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '6e3b8d1f4a27'
+down_revision = '2b7e5a9d4c31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Reports contain all measurement types, one report per kind and object.
+    op.execute("DELETE FROM reports WHERE measurement_type != 'all'")
+    with op.batch_alter_table('reports', schema=None) as batch_op:
+        if op.get_bind().dialect.name == 'mysql':  # Unnamed unique constraint, MySQL names it after the first column
+            batch_op.drop_constraint('kind', type_='unique')
+        batch_op.drop_column('measurement_type')
+        batch_op.create_unique_constraint('kind', ['kind', 'object_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('reports', schema=None) as batch_op:
+        batch_op.drop_constraint('kind', type_='unique')
+        batch_op.add_column(sa.Column('measurement_type', sa.String(length=50), nullable=False, server_default='all'))
+        batch_op.create_unique_constraint('kind', ['kind', 'object_id', 'measurement_type'])
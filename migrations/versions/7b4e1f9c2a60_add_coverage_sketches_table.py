@@ -0,0 +1,33 @@
+"""Add coverage sketches table
+
+Revision ID: 7b4e1f9c2a60
+Revises: a3f8c2d6e915
+Create Date: 2026-10-19 15:03:27.514920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '7b4e1f9c2a60'
+down_revision = 'a3f8c2d6e915'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'coverage_sketches',
+        sa.Column('transcript_id', sa.Integer(), nullable=False),
+        sa.Column('sample_type', sa.String(length=255), nullable=False),
+        sa.Column('year', sa.Integer(), nullable=False),
+        sa.Column('measurement_type', sa.String(length=50), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('bins', sa.LargeBinary(length=2**16), nullable=False),
+        sa.ForeignKeyConstraint(['transcript_id'], ['transcripts.id'], ),
+        sa.PrimaryKeyConstraint('transcript_id', 'sample_type', 'year', 'measurement_type')
+    )
+
+
+def downgrade():
+    op.drop_table('coverage_sketches')
@@ -0,0 +1,36 @@
+"""Add cache_generations table
+
+Revision ID: 8b2e5d41c6a9
+Revises: 3f0c9a1d2b7e
+Create Date: 2026-10-19 11:02:47.118230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '8b2e5d41c6a9'
+down_revision = '3f0c9a1d2b7e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    cache_generations = op.create_table(
+        'cache_generations',
+        sa.Column('name', sa.String(length=50), nullable=False),
+        sa.Column('generation', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(
+        cache_generations,
+        [
+            {'name': 'design', 'generation': 0},
+            {'name': 'panels', 'generation': 0},
+            {'name': 'sample_sets', 'generation': 0},
+        ]
+    )
+
+
+def downgrade():
+    op.drop_table('cache_generations')
@@ -0,0 +1,33 @@
+"""Add custom panel snapshots table
+
+Revision ID: 9f2c6d4b8e17
+Revises: e4a9b7c3d158
+Create Date: 2026-10-19 18:02:36.418950
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '9f2c6d4b8e17'
+down_revision = 'e4a9b7c3d158'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Snapshots of custom panels validated before this revision with: flask --app ExonCov db freeze_custom_panels
+    op.create_table(
+        'custom_panel_snapshots',
+        sa.Column('custom_panel_id', sa.Integer(), nullable=False),
+        sa.Column('page', sa.String(length=50), nullable=False),
+        sa.Column('name', sa.String(length=255, collation='utf8_bin'), nullable=False),
+        sa.Column('created_date', sa.DateTime(), nullable=False),
+        sa.Column('data', sa.LargeBinary(length=2**24), nullable=False),
+        sa.ForeignKeyConstraint(['custom_panel_id'], ['custom_panels.id'], ),
+        sa.PrimaryKeyConstraint('custom_panel_id', 'page', 'name')
+    )
+
+
+def downgrade():
+    op.drop_table('custom_panel_snapshots')
@@ -0,0 +1,40 @@
+"""Add reports table
+
+Revision ID: a3f8c2d6e915
+Revises: 5d9a2c7e1f84
+Create Date: 2026-10-19 14:12:41.208311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a3f8c2d6e915'
+down_revision = '5d9a2c7e1f84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'reports',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=50), nullable=False),
+        sa.Column('object_id', sa.Integer(), nullable=False),
+        sa.Column('measurement_type', sa.String(length=50), nullable=False),
+        sa.Column('input_key', sa.String(length=40), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('progress', sa.Float(), nullable=False),
+        sa.Column('result', sa.Text(length=2**24), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_date', sa.DateTime(), nullable=False),
+        sa.Column('updated_date', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('kind', 'object_id', 'measurement_type')
+    )
+    op.create_index(op.f('ix_reports_status'), 'reports', ['status'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_reports_status'), table_name='reports')
+    op.drop_table('reports')
@@ -0,0 +1,26 @@
+"""Add coverage sketch running statistics
+
+Revision ID: c1d5e8a3f276
+Revises: 7b4e1f9c2a60
+Create Date: 2026-10-19 16:21:09.772514
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c1d5e8a3f276'
+down_revision = '7b4e1f9c2a60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing sketches get running statistics with: flask --app ExonCov db rebuild_sketches
+    op.add_column('coverage_sketches', sa.Column('mean', sa.Double(), nullable=True))
+    op.add_column('coverage_sketches', sa.Column('m2', sa.Double(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('coverage_sketches', 'm2')
+    op.drop_column('coverage_sketches', 'mean')
@@ -0,0 +1,35 @@
+"""Add low_coverage_index table
+
+Revision ID: c41d7e9a05f3
+Revises: 8b2e5d41c6a9
+Create Date: 2026-10-19 11:48:05.640021
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7e9a05f3'
+down_revision = '8b2e5d41c6a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'low_coverage_index',
+        sa.Column('sample_id', sa.Integer(), nullable=False),
+        sa.Column('threshold', sa.Integer(), nullable=False),
+        sa.Column('exon_count', sa.Integer(), nullable=False),
+        sa.Column('transcript_count', sa.Integer(), nullable=False),
+        sa.Column('exons', sa.LargeBinary(length=2**24), nullable=False),
+        sa.Column('transcripts', sa.LargeBinary(length=2**24), nullable=False),
+        sa.ForeignKeyConstraint(['sample_id'], ['samples.id'], ),
+        sa.PrimaryKeyConstraint('sample_id', 'threshold')
+    )
+    op.create_index(op.f('ix_low_coverage_index_threshold'), 'low_coverage_index', ['threshold'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_low_coverage_index_threshold'), table_name='low_coverage_index')
+    op.drop_table('low_coverage_index')
@@ -0,0 +1,23 @@
+"""Remove single measurement type reports
+
+Revision ID: e4a9b7c3d158
+Revises: c1d5e8a3f276
+Create Date: 2026-10-19 17:02:44.318095
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'e4a9b7c3d158'
+down_revision = 'c1d5e8a3f276'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Reports are computed for all measurement types (measurement_type 'all'), single type reports are not used anymore.
+    op.execute("DELETE FROM reports WHERE measurement_type != 'all'")
+
+
+def downgrade():
+    op.execute("DELETE FROM reports WHERE measurement_type = 'all'")